@@ -0,0 +1,115 @@
+"""Benchmarks the memory and time of creating RSS feeds of recorded programs.
+
+Compares building a feed of `PodcastItem`s and feedgen entries ("feedgen") with
+streaming `PodcastItemRecord`s (`iter_rss_from_documents`, "record") as done by
+`Feeder`, and reports them per 10k items. Each method is run in a fresh process
+so that the peak RSS (including lxml) is comparable.
+
+    python benchmarks/bench_feed_items.py --num-items 10000
+"""
+import argparse
+import concurrent.futures
+import datetime
+import multiprocessing
+import resource
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from bson import ObjectId
+
+from jadio_recorder.podcast import PodcastItem, PodcastRssFeedGenCreator
+from jadio_recorder.program_group import ProgramGroup
+from jadio_recorder.program_query import ProgramQuery
+
+METHODS = ["feedgen", "record"]
+
+
+def create_documents(media_root: Path, num_items: int) -> List[Dict[str, Any]]:
+    """Creates documents of `recorded_programs` and their media files."""
+    pub_date = datetime.datetime(2023, 1, 1, 1)
+    documents = []
+    for i in range(num_items):
+        document = {
+            "_id": ObjectId(),
+            "service_id": "radiko.jp",
+            "station_id": "TBS",
+            "program_id": "bench",
+            "episode_id": f"episode-{i}",
+            "episode_title": f"Episode {i}",
+            "pub_date": pub_date + datetime.timedelta(days=i),
+            "description": "Description of the episode. " * 20,
+            "duration": 3600,
+            "link_url": "https://example.com/",
+            "image_url": "https://example.com/image.jpg",
+            "is_video": False,
+        }
+        media_dir = media_root.joinpath(
+            document["service_id"], document["program_id"], str(document["_id"])
+        )
+        media_dir.mkdir(parents=True)
+        (media_dir / "media.m4a").write_bytes(b"\0" * 1024)
+        documents.append(document)
+    return documents
+
+
+def run(method: str, media_root: str, num_items: int) -> Tuple[float, int, int]:
+    documents = create_documents(Path(media_root), num_items)
+    program_group = ProgramGroup(
+        query=ProgramQuery(program_id="bench"), title="Benchmark"
+    )
+    creator = PodcastRssFeedGenCreator("http://localhost/", media_root)
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    if method == "feedgen":
+        # same items as `iter_rss_from_documents`, all held as lxml elements
+        feed_generator = creator._create_channel(program_group).to_feed_generator()
+        for document in documents:
+            item = PodcastItem.from_document(
+                document, creator.base_url, creator.media_root
+            )
+            creator._set_feed_entry(item, feed_generator)
+        data = feed_generator.rss_str(pretty=True)
+    else:
+        data = b"".join(creator.iter_rss_from_documents(program_group, documents))
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss) * 1024
+    assert data.count(b"<item>") == num_items
+    return seconds, peak, rss
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    scale = 10000 / args.num_items
+    print(f"{args.num_items} items, best of {args.repeat}, per 10k items")
+    print(f"{'method':<10} {'time (s)':>10} {'traced (MB)':>12} {'RSS (MB)':>10}")
+    context = multiprocessing.get_context("spawn")
+    for method in METHODS:
+        results = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as media_root:
+                with concurrent.futures.ProcessPoolExecutor(
+                    1, mp_context=context
+                ) as executor:
+                    future = executor.submit(run, method, media_root, args.num_items)
+                    results.append(future.result())
+        seconds, peak, rss = min(results)
+        print(
+            f"{method:<10} {seconds * scale:>10.3f} {peak * scale / 1e6:>12.1f} "
+            f"{rss * scale / 1e6:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 DATA_ROOT=/data
 SERVICE_CONFIG_PATH="${DATA_ROOT}/configs/service.json"
 MEDIA_ROOT="${DATA_ROOT}/media"
+VOLUMES_ROOT="${DATA_ROOT}/volumes"
 RSS_ROOT="${DATA_ROOT}/rss"
 
 DB_HOST=mongodb://docker-jadio-mongo-1:27017/
@@ -13,17 +14,28 @@ COMMAND=/usr/local/bin/jadio
 
 script=$0
 
+# each directory under VOLUMES_ROOT is an additional media volume, served by
+# the httpd container as volumes/<name>/
+MEDIA_VOLUME_ARGS=()
+for volume_root in "${VOLUMES_ROOT}"/*/; do
+    [ -d "${volume_root}" ] || continue
+    volume_name=$(basename "${volume_root}")
+    MEDIA_VOLUME_ARGS+=(--media-volume "${volume_name}=${volume_root%/}")
+done
+
 echo "[$(date)] Start ${script}" >> ${LOG_PATH}
 
 "${COMMAND}" record \
     --service-config-path "${SERVICE_CONFIG_PATH}" \
     --media-root "${MEDIA_ROOT}" \
+    "${MEDIA_VOLUME_ARGS[@]}" \
     --db-host "${DB_HOST}" \
 2>&1 | tee -a ${LOG_PATH}
 
 "${COMMAND}" feed \
     --rss-root ${RSS_ROOT} \
     --media-root "${MEDIA_ROOT}" \
+    "${MEDIA_VOLUME_ARGS[@]}" \
     --http-host "${HTTP_HOST}" \
     --db-host "${DB_HOST}" \
 2>&1 | tee -a ${LOG_PATH}
@@ -1,3 +1,3 @@
 from ._version import __version__
-from .database import JadioDatabase  # NOQA
-from .handlers import Feeder, Recorder  # NOQA
+from .database import AsyncJadioDatabase, JadioDatabase  # NOQA
+from .handlers import AsyncFeeder, AsyncRecorder, Feeder, Recorder  # NOQA
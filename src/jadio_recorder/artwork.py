@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import io
+import json
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from .utils import write_atomic
+
+__all__ = ["ArtworkCache"]
+
+logger = logging.getLogger(__name__)
+
+# Directory of cached artworks under the RSS root, which is served by the HTTP
+# server as `<http-host>/rss/`.
+ARTWORK_DIRNAME = "artwork"
+
+
+def _key(image_url: str) -> str:
+    return hashlib.sha1(image_url.encode("utf-8")).hexdigest()
+
+
+class ArtworkCache:
+    """Cache of artworks of podcast channels and items.
+
+    Each distinct image URL is downloaded once and saved as a square JPEG of at
+    most `size` x `size` pixels (center-cropped) in
+    `<rss_root>/artwork/<sha1 of URL>.jpg`, together with its metadata. Cached
+    images older than `ttl_seconds` are revalidated by `ETag` and
+    `Last-Modified`, and downloaded again only if they have changed upstream.
+    If an image cannot be downloaded, a stale cached image or the original URL
+    is used.
+
+    Pillow is required: `pip install jadio-recorder[artwork]`.
+    """
+
+    def __init__(
+        self,
+        rss_root: Union[str, Path],
+        base_url: str,
+        size: int = 1400,
+        ttl_seconds: float = 7 * 86400.0,
+        timeout: float = 30.0,
+    ) -> None:
+        try:
+            from PIL import Image
+        except ImportError as err:
+            raise ImportError(
+                "Pillow is required to cache artworks. "
+                "Please install jadio-recorder[artwork]."
+            ) from err
+        self._image_module = Image
+        self._artwork_root = Path(rss_root) / ARTWORK_DIRNAME
+        self._artwork_root.mkdir(parents=True, exist_ok=True)
+        self._base_url = base_url
+        self._size = size
+        self._ttl = datetime.timedelta(seconds=ttl_seconds)
+        self._timeout = timeout
+        # local URLs of images resolved in this process
+        self._resolved: Dict[str, str] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _local_url(self, key: str) -> str:
+        return urllib.parse.urljoin(self._base_url, f"rss/{ARTWORK_DIRNAME}/{key}.jpg")
+
+    def _load_metadata(self, key: str) -> Dict[str, Any]:
+        try:
+            with open(self._artwork_root / f"{key}.json", "r") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_metadata(self, key: str, metadata: Dict[str, Any]) -> None:
+        data = json.dumps(metadata, ensure_ascii=False).encode("utf-8")
+        write_atomic(self._artwork_root / f"{key}.json", data)
+
+    def _render(self, data: bytes) -> bytes:
+        image = self._image_module.open(io.BytesIO(data)).convert("RGB")
+        side = min(image.size)
+        left = (image.width - side) // 2
+        top = (image.height - side) // 2
+        image = image.crop((left, top, left + side, top + side))
+        if side > self._size:
+            image = image.resize(
+                (self._size, self._size), self._image_module.Resampling.LANCZOS
+            )
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85, optimize=True, progressive=True)
+        return buffer.getvalue()
+
+    def _fetch(self, image_url: str, key: str) -> bool:
+        """Downloads or revalidates an image. Returns whether it is cached."""
+        image_path = self._artwork_root / f"{key}.jpg"
+        metadata = self._load_metadata(key) if image_path.exists() else {}
+        now = datetime.datetime.now()
+        if metadata.get("checked_at"):
+            checked_at = datetime.datetime.fromisoformat(metadata["checked_at"])
+            if now - checked_at < self._ttl:
+                return True
+
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+        try:
+            request = urllib.request.Request(image_url, headers=headers)
+            with urllib.request.urlopen(request, timeout=self._timeout) as res:
+                write_atomic(image_path, self._render(res.read()))
+                metadata = {
+                    "url": image_url,
+                    "etag": res.headers.get("ETag"),
+                    "last_modified": res.headers.get("Last-Modified"),
+                }
+                logger.debug(f"Cache artwork {image_url} to {image_path}")
+        except urllib.error.HTTPError as err:
+            if err.code != 304:
+                logger.warning(f"Failed to cache artwork {image_url}: {err}")
+                return image_path.exists()
+        except Exception as err:
+            logger.warning(f"Failed to cache artwork {image_url}: {err}")
+            return image_path.exists()
+        metadata["checked_at"] = now.isoformat()
+        self._save_metadata(key, metadata)
+        return True
+
+    def __call__(self, image_url: Optional[str]) -> Optional[str]:
+        """Returns the URL of the cached artwork of `image_url`.
+
+        The original URL is returned if the image cannot be cached.
+        """
+        if not image_url:
+            return image_url
+        with self._lock:
+            if image_url in self._resolved:
+                return self._resolved[image_url]
+            lock = self._locks.setdefault(image_url, threading.Lock())
+        # images shared by feeds created in parallel are fetched only once
+        with lock:
+            if image_url not in self._resolved:
+                key = _key(image_url)
+                cached = self._fetch(image_url, key)
+                self._resolved[image_url] = (
+                    self._local_url(key) if cached else image_url
+                )
+        return self._resolved[image_url]
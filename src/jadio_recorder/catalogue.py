@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import os
+import re
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from bson import ObjectId
+
+from .program_query import ProgramQuery, _to_list
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ["CATALOGUE_PROJECTION", "ProgramCatalogue"]
+
+logger = logging.getLogger(__name__)
+
+# Keys of IDs stored as categorical codes.
+CATEGORICAL_KEYS = ["service_id", "station_id", "program_id", "episode_id"]
+# Keys of texts matched with keywords by regular expressions.
+TEXT_KEYS = ["program_title", "episode_title", "description", "information"]
+# Keys of lists of names matched with keywords exactly.
+LIST_KEYS = ["performers", "guests"]
+
+# Fields of fetched programs loaded into a catalogue.
+CATALOGUE_PROJECTION = {
+    **{key: 1 for key in CATEGORICAL_KEYS + TEXT_KEYS + LIST_KEYS},
+    "pub_date": 1,
+    "duration": 1,
+    "is_video": 1,
+    "fetch.updated_at": 1,
+}
+
+_SEPARATOR = "\x1f"
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError(
+            "NumPy is required for the catalogue. "
+            "Please install jadio-recorder[numpy]."
+        )
+
+
+def _to_datetime64(value: Optional[datetime.datetime]) -> Any:
+    return np.datetime64("NaT") if value is None else np.datetime64(value, "ms")
+
+
+def _encode_texts(texts: List[str]) -> Tuple[Any, Any]:
+    """Encodes texts to a buffer of UTF-8 bytes and offsets of the texts."""
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class ProgramCatalogue:
+    """Columnar snapshot of fetched programs to evaluate `ProgramQuery` by NumPy.
+
+    IDs are stored as categorical codes, `pub_date` (and when programs were
+    updated) as datetime64 and `duration` as float arrays, so that the
+    conditions of queries other than keywords are evaluated as vectorized
+    boolean masks. Keywords are matched only with the programs satisfying the
+    other conditions. Texts are stored as UTF-8 buffers with offsets, so that
+    a catalogue is saved to and loaded from a `.npz` file without pickle.
+
+    The conditions are evaluated in the same way as
+    `ProgramQuery.to_mongo_format`, except that IDs are compared as strings.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, Any],
+        fetched_at: Optional[datetime.datetime] = None,
+    ) -> None:
+        _require_numpy()
+        self._columns = columns
+        self.fetched_at = fetched_at
+        self._categories = {
+            key: {
+                value: code
+                for code, value in enumerate(columns[f"{key}.categories"].tolist())
+            }
+            for key in CATEGORICAL_KEYS
+        }
+
+    def __len__(self) -> int:
+        return len(self._columns["_id"])
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: Iterable[Dict[str, Any]],
+        fetched_at: Optional[datetime.datetime] = None,
+    ) -> ProgramCatalogue:
+        """Creates a catalogue from fetched programs having `CATALOGUE_PROJECTION`.
+
+        Args:
+            fetched_at (`datetime.datetime`): When the programs were fetched, to
+                check whether a saved catalogue is up to date.
+        """
+        _require_numpy()
+        keys = CATEGORICAL_KEYS + TEXT_KEYS + LIST_KEYS
+        rows: Dict[str, List[Any]] = {key: [] for key in keys}
+        object_ids, pub_dates, durations, is_videos, updated_ats = [], [], [], [], []
+        for document in documents:
+            object_ids.append(document["_id"].binary)
+            for key in keys:
+                rows[key].append(document.get(key))
+            pub_dates.append(_to_datetime64(document.get("pub_date")))
+            duration = document.get("duration")
+            durations.append(np.nan if duration is None else float(duration))
+            is_video = document.get("is_video")
+            is_videos.append(-1 if is_video is None else int(bool(is_video)))
+            updated_at = (document.get("fetch") or {}).get("updated_at")
+            updated_ats.append(_to_datetime64(updated_at))
+
+        columns = {
+            # ObjectIds as rows of 12 bytes, because "S12" strips trailing nulls
+            "_id": np.frombuffer(b"".join(object_ids), dtype=np.uint8).reshape(-1, 12),
+            "pub_date": np.array(pub_dates, dtype="datetime64[ms]"),
+            "updated_at": np.array(updated_ats, dtype="datetime64[ms]"),
+            "duration": np.array(durations, dtype=np.float64),
+            "is_video": np.array(is_videos, dtype=np.int8),
+        }
+        for key in CATEGORICAL_KEYS:
+            values = [None if value is None else str(value) for value in rows[key]]
+            categories = sorted({value for value in values if value is not None})
+            index = {value: code for code, value in enumerate(categories)}
+            columns[f"{key}.codes"] = np.array(
+                [index.get(value, -1) for value in values], dtype=np.int32
+            )
+            columns[f"{key}.categories"] = np.array(categories, dtype=str)
+        for key in TEXT_KEYS:
+            texts = ["" if value is None else str(value) for value in rows[key]]
+            columns[f"{key}.data"], columns[f"{key}.offsets"] = _encode_texts(texts)
+        for key in LIST_KEYS:
+            texts = [
+                _SEPARATOR.join(str(x) for x in _to_list(value) if x is not None)
+                for value in rows[key]
+            ]
+            columns[f"{key}.data"], columns[f"{key}.offsets"] = _encode_texts(texts)
+        return cls(columns, fetched_at)
+
+    def save(self, path: Union[str, Path]) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fetched_at = _to_datetime64(self.fetched_at)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as fh:
+            np.savez(fh, fetched_at=fetched_at, **self._columns)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(
+        cls, path: Union[str, Path], fetched_at: Optional[datetime.datetime]
+    ) -> Optional[ProgramCatalogue]:
+        """Loads a saved catalogue if it is of the programs fetched at
+        `fetched_at`, otherwise returns None. None is also returned if the file
+        is missing, corrupt or lacks columns, so that it is built again."""
+        _require_numpy()
+        if fetched_at is None:
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = {key: data[key] for key in data.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile) as err:
+            logger.warning(f"Ignore the corrupt catalogue {path}: {err}")
+            return None
+        if columns.pop("fetched_at", None) != _to_datetime64(fetched_at):
+            return None
+        missing = set(cls.from_documents([])._columns) - set(columns)
+        if missing:
+            logger.warning(f"Ignore the catalogue {path} lacking {sorted(missing)}")
+            return None
+        return cls(columns, fetched_at)
+
+    def _isin(self, key: str, values: Any) -> Any:
+        index = self._categories[key]
+        codes = [index[str(x)] for x in _to_list(values) if str(x) in index]
+        return np.isin(self._columns[f"{key}.codes"], codes)
+
+    def _range(self, column: Any, condition: Any, convert: Callable) -> Any:
+        conditions = _to_list(condition)
+        if len(conditions) > 2:
+            raise ValueError(f"len({condition}) must be less than 2.")
+        if len(conditions) == 1:
+            return column <= convert(conditions[0])
+        mask = np.ones(len(self), dtype=bool)
+        if conditions[0] is not None:
+            mask &= column >= convert(conditions[0])
+        if conditions[1] is not None:
+            mask &= column < convert(conditions[1])
+        return mask
+
+    def _text(self, key: str, i: int) -> str:
+        offsets = self._columns[f"{key}.offsets"]
+        data = self._columns[f"{key}.data"][offsets[i] : offsets[i + 1]]
+        return data.tobytes().decode("utf-8")
+
+    def _match_keywords(self, i: int, keywords: List[str]) -> bool:
+        for key in LIST_KEYS:
+            text = self._text(key, i)
+            if text and not set(text.split(_SEPARATOR)).isdisjoint(keywords):
+                return True
+        for key in TEXT_KEYS:
+            text = self._text(key, i)
+            if text and any(re.search(keyword, text) for keyword in keywords):
+                return True
+        return False
+
+    def evaluate(
+        self,
+        query: ProgramQuery,
+        updated_after: Optional[datetime.datetime] = None,
+    ) -> Any:
+        """Evaluates a query.
+
+        Args:
+            query (`ProgramQuery`): Query.
+            updated_after (`datetime.datetime`): If given, only programs updated
+                after it are matched.
+
+        Returns:
+            `numpy.ndarray`: Boolean mask of matched programs.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for key in CATEGORICAL_KEYS:
+            if getattr(query, key):
+                mask &= self._isin(key, getattr(query, key))
+        if query.pub_date:
+            mask &= self._range(
+                self._columns["pub_date"], query.pub_date, _to_datetime64
+            )
+        if query.duration:
+            mask &= self._range(self._columns["duration"], query.duration, float)
+        if query.is_video is not None:
+            values = [int(bool(x)) for x in _to_list(query.is_video)]
+            mask &= np.isin(self._columns["is_video"], values)
+        if updated_after is not None:
+            mask &= self._columns["updated_at"] > _to_datetime64(updated_after)
+        if query.keywords:
+            keywords = _to_list(query.keywords)
+            for i in np.flatnonzero(mask):
+                mask[i] = self._match_keywords(i, keywords)
+        return mask
+
+    def find(
+        self,
+        queries: List[ProgramQuery],
+        updated_after: Optional[datetime.datetime] = None,
+    ) -> List[ObjectId]:
+        """Returns the ObjectIds of programs matching any of the queries."""
+        mask = np.zeros(len(self), dtype=bool)
+        for query in queries:
+            mask |= self.evaluate(query, updated_after=updated_after)
+        return [ObjectId(row.tobytes()) for row in self._columns["_id"][mask]]
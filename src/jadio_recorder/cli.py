@@ -2,9 +2,20 @@ import argparse
 import json
 import logging
 from pathlib import Path
-
-from .handlers import Feeder, Recorder
+from typing import List, Optional, Tuple
+
+from .handlers import (
+    Feeder,
+    FeedWatcher,
+    MediaLibrary,
+    Planner,
+    QueryProfiler,
+    Recorder,
+    Searcher,
+)
+from .media_volume import PLACEMENT_POLICIES
 from .program_group import ProgramGroup
+from .rate_limit import split_service_config
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s: %(message)s"
@@ -20,6 +31,24 @@ def add_argument_common(parser: argparse.ArgumentParser):
     )
 
 
+def _key_value(value: str) -> Tuple[str, str]:
+    key, _, assigned = value.partition("=")
+    if not key or not assigned:
+        raise argparse.ArgumentTypeError(f"'{value}' is not KEY=VALUE")
+    return key, assigned
+
+
+def add_argument_media_volumes(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--media-volume",
+        type=_key_value,
+        action="append",
+        default=[],
+        metavar="NAME=PATH",
+        help="Additional media volume (can be repeated)",
+    )
+
+
 def add_argument_record_program_group(parser: argparse.ArgumentParser):
     parser.set_defaults(handler=record_program_group)
     parser.add_argument(
@@ -39,6 +68,11 @@ def add_argument_record_programs(parser: argparse.ArgumentParser):
     parser.add_argument(
         "--force-fetch", action="store_true", help="Force fetch programs from services"
     )
+    parser.add_argument(
+        "--full-search",
+        action="store_true",
+        help="Search all fetched programs instead of only new or updated ones",
+    )
     parser.add_argument(
         "--service-config-path",
         type=Path,
@@ -48,6 +82,69 @@ def add_argument_record_programs(parser: argparse.ArgumentParser):
     parser.add_argument(
         "--media-root", type=Path, default="./data/media", help="Media root directory"
     )
+    add_argument_media_volumes(parser)
+    parser.add_argument(
+        "--worker-id",
+        type=str,
+        default=None,
+        help="ID of this recorder used to lease reserved programs (default: host-pid)",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=600.0,
+        help="Lease duration of a reserved program being recorded",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="Max number of attempts to record a reserved program",
+    )
+    parser.add_argument(
+        "--max-retry-wait",
+        type=float,
+        default=300.0,
+        help="Max seconds to wait for a failed recording to be retried in this run",
+    )
+    parser.add_argument(
+        "--hls-workers",
+        type=int,
+        default=0,
+        help="Number of threads fetching HLS segments (0: download by the service)",
+    )
+    parser.add_argument(
+        "--search-index-path",
+        type=Path,
+        default=None,
+        help="Full-text search index to add recorded programs to (SQLite)",
+    )
+    parser.add_argument(
+        "--search-engine",
+        choices=["mongo", "numpy"],
+        default="mongo",
+        help="Engine to evaluate program groups against fetched programs",
+    )
+    parser.add_argument(
+        "--catalogue-path",
+        type=Path,
+        default=None,
+        help="File to cache the catalogue of fetched programs (numpy engine)",
+    )
+    parser.add_argument(
+        "--placement",
+        choices=PLACEMENT_POLICIES,
+        default="most_free",
+        help="Policy to choose the media volume to store programs on",
+    )
+    parser.add_argument(
+        "--pin",
+        type=_key_value,
+        action="append",
+        default=[],
+        metavar="SERVICE[/PROGRAM]=NAME",
+        help="Store programs of the service or program on the volume",
+    )
 
 
 def add_argument_feed_rss(parser: argparse.ArgumentParser):
@@ -58,12 +155,165 @@ def add_argument_feed_rss(parser: argparse.ArgumentParser):
     parser.add_argument(
         "--media-root", type=Path, default="./data/media", help="Media root directory"
     )
+    add_argument_media_volumes(parser)
     parser.add_argument(
         "--http-host",
         type=str,
         default="http://localhost",
         help="HTTP host for RSS feed",
     )
+    parser.add_argument(
+        "--auto",
+        action="store_true",
+        help="Also create a feed of each recorded program under <rss-root>/auto/",
+    )
+    add_argument_feed_options(parser)
+
+
+def add_argument_feed_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--max-items",
+        type=int,
+        default=None,
+        help="Max number of the newest items in each RSS feed",
+    )
+    parser.add_argument(
+        "--artwork-size",
+        type=int,
+        default=None,
+        help="Cache artworks as square JPEGs of at most this size in pixels",
+    )
+    parser.add_argument(
+        "--precompress",
+        action="store_true",
+        help="Write compact RSS feeds with their gzip and brotli compressed files",
+    )
+
+
+def add_argument_watch_feeds(parser: argparse.ArgumentParser):
+    parser.set_defaults(handler=watch_feeds)
+    parser.add_argument(
+        "--rss-root", type=Path, default="./data/rss", help="RSS root directory"
+    )
+    parser.add_argument(
+        "--media-root", type=Path, default="./data/media", help="Media root directory"
+    )
+    add_argument_media_volumes(parser)
+    parser.add_argument(
+        "--http-host",
+        type=str,
+        default="http://localhost",
+        help="HTTP host for RSS feed",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=5.0,
+        help="Seconds to wait for following changes before updating feeds",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=10.0,
+        help="Polling interval in seconds if change streams are not available",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        type=float,
+        default=3600.0,
+        help="Seconds between updates of all feeds if polling the DB",
+    )
+    add_argument_feed_options(parser)
+
+
+def add_argument_plan_program_group(parser: argparse.ArgumentParser):
+    parser.set_defaults(handler=plan_program_group)
+    parser.add_argument(
+        "config_path", type=Path, help="Program group config file path (JSON)"
+    )
+    parser.add_argument(
+        "--service-config-path",
+        type=Path,
+        default="./data/configs/service.json",
+        help="Radio service config Json file path",
+    )
+    parser.add_argument(
+        "--media-root", type=Path, default="./data/media", help="Media root directory"
+    )
+    add_argument_media_volumes(parser)
+
+
+def add_argument_profile_queries(parser: argparse.ArgumentParser):
+    parser.set_defaults(handler=profile_queries)
+    parser.add_argument(
+        "target",
+        type=str,
+        choices=["search", "feed"],
+        help="Profile queries of `record` (search) or `feed` (feed) sub-command",
+    )
+    parser.add_argument(
+        "--top", type=int, default=None, help="Show only the most expensive queries"
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save the profiles to query_profiles collection",
+    )
+
+
+def add_argument_search_programs(parser: argparse.ArgumentParser):
+    parser.set_defaults(handler=search_programs)
+    parser.add_argument("keywords", type=str, nargs="+", help="Search keywords")
+    parser.add_argument(
+        "--index-path",
+        type=Path,
+        default="./data/search.sqlite3",
+        help="Full-text search index file path (SQLite)",
+    )
+    parser.add_argument(
+        "--media-root", type=Path, default="./data/media", help="Media root directory"
+    )
+    add_argument_media_volumes(parser)
+    parser.add_argument(
+        "--service-id",
+        type=str,
+        action="append",
+        default=None,
+        help="Search only programs of the service (can be repeated)",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=20, help="Max number of programs to show"
+    )
+    parser.add_argument(
+        "--full-sync",
+        action="store_true",
+        help="Rebuild the index from all recorded programs before searching",
+    )
+
+
+def add_argument_scan_media(parser: argparse.ArgumentParser):
+    parser.set_defaults(handler=scan_media)
+    parser.add_argument(
+        "--media-root", type=Path, default="./data/media", help="Media root directory"
+    )
+    add_argument_media_volumes(parser)
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="Restore orphans from program.json and remove records of missing media",
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Ignore the manifest and stat all files"
+    )
+    parser.add_argument(
+        "--num-workers", type=int, default=8, help="Number of scanning threads"
+    )
+    parser.add_argument(
+        "--grace-seconds",
+        type=float,
+        default=3600.0,
+        help="Seconds for which recorded programs missing media are kept",
+    )
 
 
 def parse_args() -> argparse.Namespace:
@@ -92,22 +342,60 @@ def parse_args() -> argparse.Namespace:
             add_argument_feed_rss,
             "Create Podcast RSS feeds of recorded radio programs.",
         ),
+        (
+            "plan",
+            add_argument_plan_program_group,
+            "Estimate recordings of program groups without reserving them.",
+        ),
+        (
+            "watch",
+            add_argument_watch_feeds,
+            "Update Podcast RSS feeds as soon as recorded radio programs change.",
+        ),
+        (
+            "profile",
+            add_argument_profile_queries,
+            "Rank the queries of program groups by their cost.",
+        ),
+        (
+            "search",
+            add_argument_search_programs,
+            "Search recorded radio programs by keywords.",
+        ),
     ]
     for name, add_arument_fn, help in commands:
         sub_parser = subparsers.add_parser(name, help=help)
         add_arument_fn(sub_parser)
         add_argument_common(sub_parser)
 
+    media_parser = subparsers.add_parser("media", help="Manage recorded media files.")
+    media_subparsers = media_parser.add_subparsers()
+    media_commands = [
+        (
+            "scan",
+            add_argument_scan_media,
+            "Check consistency between media files and recorded radio programs.",
+        ),
+    ]
+    for name, add_arument_fn, help in media_commands:
+        sub_parser = media_subparsers.add_parser(name, help=help)
+        add_arument_fn(sub_parser)
+        add_argument_common(sub_parser)
+
     return parser
 
 
-def record_program_group(args: argparse.Namespace) -> None:
-    with open(args.config_path, "r") as fh:
+def load_program_groups(config_path: Path) -> List[ProgramGroup]:
+    with open(config_path, "r") as fh:
         data = fh.read()
         try:
-            program_groups = ProgramGroup.schema().loads(data, many=True)
+            return ProgramGroup.schema().loads(data, many=True)
         except:
-            program_groups = [ProgramGroup.from_json(data)]
+            return [ProgramGroup.from_json(data)]
+
+
+def record_program_group(args: argparse.Namespace) -> None:
+    program_groups = load_program_groups(args.config_path)
 
     with Recorder(db_host=args.db_host) as handler:
         for program_group in program_groups:
@@ -115,12 +403,7 @@ def record_program_group(args: argparse.Namespace) -> None:
 
 
 def feed_program_group(args: argparse.Namespace) -> None:
-    with open(args.config_path, "r") as fh:
-        data = fh.read()
-        try:
-            program_groups = ProgramGroup.schema().loads(data, many=True)
-        except:
-            program_groups = [ProgramGroup.from_json(data)]
+    program_groups = load_program_groups(args.config_path)
 
     with Feeder(db_host=args.db_host) as handler:
         for program_group in program_groups:
@@ -134,10 +417,21 @@ def record_programs(args: argparse.Namespace) -> None:
     with Recorder(
         service_config=service_config,
         media_root=args.media_root,
+        media_volumes=dict(args.media_volume),
         db_host=args.db_host,
+        worker_id=args.worker_id,
+        lease_seconds=args.lease_seconds,
+        max_attempts=args.max_attempts,
+        max_retry_wait=args.max_retry_wait,
+        hls_workers=args.hls_workers,
+        search_index_path=args.search_index_path,
+        search_engine=args.search_engine,
+        catalogue_path=args.catalogue_path,
+        placement=args.placement,
+        pins=dict(args.pin),
     ) as handler:
         handler.fetch_programs(force=args.force_fetch)
-        handler.search_programs()
+        handler.search_programs(full=args.full_search)
         handler.record_programs()
 
 
@@ -145,10 +439,133 @@ def feed_rss(args: argparse.Namespace) -> None:
     with Feeder(
         rss_root=args.rss_root,
         media_root=args.media_root,
+        media_volumes=dict(args.media_volume),
         http_host=args.http_host,
         db_host=args.db_host,
+        max_items=args.max_items,
+        artwork_size=args.artwork_size,
+        precompress=args.precompress,
     ) as handler:
         handler.feed_rss()
+        if args.auto:
+            handler.feed_auto_rss()
+
+
+def _format_size(num_bytes: Optional[float]) -> str:
+    return "-" if num_bytes is None else f"{num_bytes / 1e9:.2f} GB"
+
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds / 3600:.1f} h"
+
+
+def plan_program_group(args: argparse.Namespace) -> None:
+    program_groups = load_program_groups(args.config_path)
+    with open(args.service_config_path, "r") as fh:
+        _, rate_limits = split_service_config(json.load(fh))
+
+    with Planner(
+        rate_limits=rate_limits,
+        media_root=args.media_root,
+        media_volumes=dict(args.media_volume),
+        db_host=args.db_host,
+    ) as handler:
+        for program_group in program_groups:
+            plan = handler.plan(program_group)
+            print(f"Query: {program_group.query.to_json(ensure_ascii=False)}")
+            header = (
+                "service",
+                "matched",
+                "recorded",
+                "reserved",
+                "new",
+                "duration",
+                "size",
+                "download",
+            )
+            print("  " + " | ".join(header))
+            for p in plan.services:
+                row = (
+                    p.service_id,
+                    str(p.num_matched),
+                    str(p.num_recorded),
+                    str(p.num_reserved),
+                    str(p.num_new),
+                    _format_seconds(p.duration),
+                    _format_size(p.estimated_bytes),
+                    _format_seconds(p.estimated_seconds),
+                )
+                print("  " + " | ".join(row))
+
+
+def watch_feeds(args: argparse.Namespace) -> None:
+    with FeedWatcher(
+        rss_root=args.rss_root,
+        media_root=args.media_root,
+        media_volumes=dict(args.media_volume),
+        http_host=args.http_host,
+        db_host=args.db_host,
+        debounce_seconds=args.debounce,
+        poll_interval=args.poll_interval,
+        full_refresh_seconds=args.full_refresh,
+        max_items=args.max_items,
+        artwork_size=args.artwork_size,
+        precompress=args.precompress,
+    ) as handler:
+        handler.watch()
+
+
+def profile_queries(args: argparse.Namespace) -> None:
+    with QueryProfiler(db_host=args.db_host) as handler:
+        profiles = handler.profile(args.target, save=args.save)
+    header = ("ms", "examined", "keys", "returned", "plan", "program group")
+    print(" | ".join(header))
+    for p in profiles[: args.top]:
+        row = (
+            str(p.execution_millis),
+            str(p.docs_examined),
+            str(p.keys_examined),
+            str(p.num_returned),
+            "IXSCAN" if p.index_used else "COLLSCAN",
+            f"{p.program_group_id}: {p.title}",
+        )
+        print(" | ".join(row))
+
+
+def search_programs(args: argparse.Namespace) -> None:
+    with Searcher(
+        index_path=args.index_path,
+        media_root=args.media_root,
+        media_volumes=dict(args.media_volume),
+        db_host=args.db_host,
+    ) as handler:
+        handler.sync(full=args.full_sync)
+        hits = handler.search(
+            " ".join(args.keywords), limit=args.limit, service_ids=args.service_id
+        )
+        for hit in hits:
+            title = " ".join(x for x in [hit.program_title, hit.episode_title] if x)
+            print(f"{hit.pub_date or '-'} | {hit.service_id} | {title}")
+            print(f"  {handler.get_media_path(hit) or hit.object_id}")
+
+
+def scan_media(args: argparse.Namespace) -> None:
+    with MediaLibrary(
+        media_root=args.media_root,
+        media_volumes=dict(args.media_volume),
+        db_host=args.db_host,
+        num_workers=args.num_workers,
+        grace_seconds=args.grace_seconds,
+    ) as handler:
+        result = handler.scan(repair=args.repair, full=args.full)
+    for path in result.orphans:
+        print(f"orphan: {path}")
+    for object_id in result.missing:
+        print(f"missing: {object_id}")
+    for object_id in result.restored:
+        print(f"restored: {object_id}")
+    for object_id in result.removed:
+        print(f"removed: {object_id}")
 
 
 def main():
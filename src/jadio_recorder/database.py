@@ -1,13 +1,60 @@
 from __future__ import annotations
 
-from typing import Optional
+import abc
+from typing import Any, Dict, List, Optional
 
 import pymongo
+import pymongo.change_stream
 import pymongo.collation
 import pymongo.database
 
 
-class JadioDatabase:
+class _JadioCollections(abc.ABC):
+    """Collections of the jadio database shared by sync and async databases."""
+
+    @property
+    @abc.abstractmethod
+    def _database(self) -> Any:
+        ...
+
+    @property
+    def fetched_programs(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("fetched_programs")
+
+    @property
+    def reserved_programs(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("reserved_programs")
+
+    @property
+    def recorded_programs(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("recorded_programs")
+
+    @property
+    def program_groups(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("program_groups")
+
+    @property
+    def stations(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("stations")
+
+    @property
+    def service_stats(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("service_stats")
+
+    @property
+    def query_profiles(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("query_profiles")
+
+    @property
+    def auto_feeds(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("auto_feeds")
+
+    @property
+    def timestamp(self) -> pymongo.collation.Collation:
+        return self._database.get_collection("timestamp")
+
+
+class JadioDatabase(_JadioCollections):
     def __init__(
         self,
         host: Optional[str] = None,
@@ -30,26 +77,49 @@ class JadioDatabase:
     def _database(self) -> pymongo.database.Database:
         return self._client.get_database(self._name)
 
-    @property
-    def fetched_programs(self) -> pymongo.collation.Collation:
-        return self._database.get_collection("fetched_programs")
+    def watch(
+        self, pipeline: Optional[List[Dict[str, Any]]] = None, **kwargs
+    ) -> pymongo.change_stream.DatabaseChangeStream:
+        """Watches changes of all collections. Requires a replica set."""
+        return self._database.watch(pipeline, **kwargs)
 
-    @property
-    def reserved_programs(self) -> pymongo.collation.Collation:
-        return self._database.get_collection("reserved_programs")
 
-    @property
-    def recorded_programs(self) -> pymongo.collation.Collation:
-        return self._database.get_collection("recorded_programs")
+class AsyncJadioDatabase(_JadioCollections):
+    """Jadio database on the asyncio driver (motor).
 
-    @property
-    def program_groups(self) -> pymongo.collation.Collation:
-        return self._database.get_collection("program_groups")
+    Collections are `motor.motor_asyncio.AsyncIOMotorCollection`. The client
+    keeps a connection pool of up to `max_pool_size` connections, so one
+    instance can be shared by handlers running concurrently on an event loop.
+    """
 
-    @property
-    def stations(self) -> pymongo.collation.Collation:
-        return self._database.get_collection("stations")
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        name: str = "jadio",
+        max_pool_size: int = 100,
+    ) -> None:
+        try:
+            import motor.motor_asyncio
+        except ImportError as err:
+            raise ImportError(
+                "motor is required for AsyncJadioDatabase. "
+                "Please install jadio-recorder[async]"
+            ) from err
+        host = host or "mongodb://localhost:27017/"
+        self._client = motor.motor_asyncio.AsyncIOMotorClient(
+            host, maxPoolSize=max_pool_size
+        )
+        self._name = name
+
+    async def __aenter__(self) -> AsyncJadioDatabase:
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._client.close()
 
     @property
-    def timestamp(self) -> pymongo.collation.Collation:
-        return self._database.get_collection("timestamp")
+    def _database(self) -> Any:
+        return self._client.get_database(self._name)
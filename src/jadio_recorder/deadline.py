@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import copy
+import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+__all__ = [
+    "DEFAULT_AVAILABILITY_DAYS",
+    "FAR_FUTURE",
+    "deadline_expression",
+    "estimate_at_risk",
+    "split_availability_config",
+]
+
+# Key of the days for which programs can be downloaded after their broadcast in
+# each service config of `service.json`.
+AVAILABILITY_KEY = "availability_days"
+
+# Days for which programs can be downloaded after their broadcast by service.
+# e.g. radiko time-free programs can be downloaded for a week.
+DEFAULT_AVAILABILITY_DAYS = {"radiko.jp": 7.0}
+
+# Deadline of programs of services whose availability is unknown, which sorts
+# after all known deadlines.
+FAR_FUTURE = datetime.datetime(9999, 12, 31)
+
+
+def split_availability_config(
+    service_config: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """Splits the availability days from the service config given to `Jadio`.
+
+    Returns:
+        tuple: The service config and availability days by service, which
+            override `DEFAULT_AVAILABILITY_DAYS`.
+    """
+    service_config = copy.deepcopy(service_config)
+    availability_days = dict(DEFAULT_AVAILABILITY_DAYS)
+    for service_id, config in service_config.items():
+        if isinstance(config, dict) and AVAILABILITY_KEY in config:
+            days = config.pop(AVAILABILITY_KEY)
+            if days is None:
+                availability_days.pop(service_id, None)
+            else:
+                availability_days[service_id] = float(days)
+    return service_config, availability_days
+
+
+def deadline_expression(availability_days: Dict[str, float]) -> Any:
+    """Aggregation expression of the deadline of a program by its `pub_date`."""
+    branches = [
+        {
+            "case": {"$eq": ["$service_id", service_id]},
+            "then": {"$add": ["$pub_date", int(days * 86400000)]},
+        }
+        for service_id, days in sorted(availability_days.items())
+    ]
+    if not branches:
+        return FAR_FUTURE
+    return {"$switch": {"branches": branches, "default": FAR_FUTURE}}
+
+
+def estimate_at_risk(
+    programs: Iterable[Dict[str, Any]],
+    service_stats: Dict[str, Dict[str, Any]],
+    now: datetime.datetime,
+    concurrency: int = 1,
+) -> List[Any]:
+    """Estimates programs which will not be recorded before their deadline.
+
+    Programs are assumed to be recorded in order of their deadline by
+    `concurrency` downloads at a time, taking as long per second of program
+    duration as the past downloads of the service (`service_stats`). Programs
+    of services without statistics are assumed to take no time.
+
+    Args:
+        programs (iterable of dict): Reserved programs sorted by deadline,
+            having `_id`, `service_id`, `duration` and `deadline`.
+
+    Returns:
+        list: IDs of programs at risk.
+    """
+    elapsed = 0.0
+    ret = []
+    for program in programs:
+        stats = service_stats.get(program["service_id"]) or {}
+        seconds = 0.0
+        if stats.get("downloaded_duration") and program.get("duration"):
+            ratio = stats["download_seconds"] / stats["downloaded_duration"]
+            seconds = ratio * program["duration"]
+        elif stats.get("downloads"):
+            seconds = stats["download_seconds"] / stats["downloads"]
+        elapsed += seconds / max(concurrency, 1)
+        finish = now + datetime.timedelta(seconds=elapsed)
+        deadline = program.get("deadline")
+        if deadline is not None and finish > deadline and deadline < FAR_FUTURE:
+            ret.append(program["_id"])
+    return ret
@@ -1,2 +1,9 @@
+from .async_feeder import AsyncFeeder  # NOQA
+from .async_recorder import AsyncRecorder  # NOQA
+from .feed_watcher import FeedWatcher  # NOQA
 from .feeder import Feeder  # NOQA
+from .media_library import MediaLibrary  # NOQA
+from .planner import Planner  # NOQA
+from .profiler import QueryProfiler  # NOQA
 from .recorder import Recorder  # NOQA
+from .searcher import Searcher  # NOQA
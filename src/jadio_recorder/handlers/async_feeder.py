@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from bson import ObjectId
+
+from ..database import AsyncJadioDatabase
+from ..podcast import default_sort_by
+from ..program_group import ProgramGroup
+from .base import AsyncDatabaseHandler
+from .feeding import (
+    AUTO_FEED_PROJECTION,
+    AUTO_FEED_SORT,
+    FeedWriter,
+    PartitionT,
+    auto_feed_delete,
+    auto_feed_query,
+    auto_feed_state_update,
+    auto_feed_stats_pipeline,
+    changed_partitions,
+    feed_pipeline,
+    is_completed_feed,
+    log_auto_feeds,
+    log_feed_sizes,
+    partition_of,
+)
+
+logger = logging.getLogger(__name__)
+
+# Number of documents read from the DB at once by a worker thread writing a feed.
+CURSOR_BATCH_SIZE = 1000
+
+
+def _iter_cursor(
+    cursor: Any, loop: asyncio.AbstractEventLoop, batch_size: int = CURSOR_BATCH_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """Iterates an asyncio cursor from a worker thread, reading `batch_size`
+    documents at a time on `loop`, so that the documents are not all held in
+    memory."""
+    while True:
+        documents = asyncio.run_coroutine_threadsafe(
+            cursor.to_list(batch_size), loop
+        ).result()
+        if not documents:
+            return
+        yield from documents
+
+
+class AsyncFeeder(AsyncDatabaseHandler):
+    """Asyncio version of `Feeder`.
+
+    RSS feeds of up to `concurrency` program groups are created concurrently.
+    Creating and writing a feed is done in a worker thread so that it overlaps
+    with the queries of the other program groups.
+    """
+
+    def __init__(
+        self,
+        rss_root: Union[str, Path] = ".",
+        media_root: Union[str, Path] = ".",
+        http_host: str = "http://localhost",
+        db_host: Optional[str] = None,
+        db_name: str = "jadio",
+        database: Optional[AsyncJadioDatabase] = None,
+        concurrency: int = 4,
+        max_items: Optional[int] = None,
+        artwork_size: Optional[int] = None,
+        precompress: bool = False,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+    ) -> None:
+        super().__init__(db_host, db_name, database=database)
+        self._writer = FeedWriter(
+            rss_root,
+            media_root,
+            http_host,
+            max_items=max_items,
+            artwork_size=artwork_size,
+            precompress=precompress,
+            media_volumes=media_volumes,
+        )
+        self._concurrency = concurrency
+
+    async def insert_program_group(self, program_group: ProgramGroup) -> None:
+        logger.info("Start: insert_program_group")
+
+        program_group.enable_feed = True
+
+        program_group = program_group.to_dict()
+        if await self.db.program_groups.find_one(
+            {"query": program_group["query"], "enable_feed": True}
+        ):
+            logger.warning("There is already a program group for the same query.")
+        await self.db.program_groups.update_one(
+            program_group, {"$set": program_group}, upsert=True
+        )
+
+        await self._update_timestamp("insert_program_group")
+        logger.info("Finish: insert_program_group")
+
+    async def _feed_rss(
+        self,
+        program_group: ProgramGroup,
+        object_id: Union[str, ObjectId],
+        pretty: bool = True,
+    ) -> Dict[str, int]:
+        # fetch specified recorded programs in order of feed items
+        logger.debug(f"Feed RSS: {program_group}")
+        query = program_group.query.to_mongo_format()
+        station_ids = await self.db.recorded_programs.distinct("station_id", query)
+        service_ids = []
+        if len(station_ids) <= 1:
+            service_ids = await self.db.recorded_programs.distinct("service_id", query)
+        sort_by = default_sort_by(station_ids, service_ids)
+        cursor = self.db.recorded_programs.aggregate(
+            feed_pipeline(query, sort_by, limit=self._writer.max_items),
+            allowDiskUse=True,
+        )
+        try:
+            # the documents are streamed to the thread writing the feed
+            return await asyncio.to_thread(
+                self._writer.write,
+                _iter_cursor(cursor, asyncio.get_running_loop()),
+                program_group,
+                object_id,
+                pretty=pretty,
+            )
+        finally:
+            await cursor.close()
+
+    async def feed_rss(self, force: bool = False) -> List[ProgramGroup]:
+        logger.info("Start: feed_rss")
+
+        last_timestamp = await self.db.timestamp.find_one({"name": "feed_rss"})
+        if last_timestamp:
+            last_timestamp = last_timestamp["timestamp"]
+
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def feed(
+            program_group: ProgramGroup, object_id: ObjectId
+        ) -> Optional[Tuple[ProgramGroup, Dict[str, int]]]:
+            async with semaphore:
+                try:
+                    return program_group, await self._feed_rss(program_group, object_id)
+                except Exception as err:
+                    logger.error(f"Error: {err}\n{program_group}", stack_info=True)
+                    return None
+
+        tasks = []
+        async for program_group in self.db.program_groups.find({"enable_feed": True}):
+            object_id = program_group.pop("_id")
+            program_group = ProgramGroup.from_dict(program_group)
+            if not force and is_completed_feed(
+                program_group, self._writer.feed_path(object_id), last_timestamp
+            ):
+                logger.debug(
+                    f"Skip: feed the RSS of completed channels: {str(object_id)}"
+                )
+                continue
+            tasks.append(feed(program_group, object_id))
+        results = [x for x in await asyncio.gather(*tasks) if x is not None]
+        log_feed_sizes([sizes for _, sizes in results])
+        ret = [program_group for program_group, _ in results]
+
+        await self._update_timestamp("feed_rss")
+        logger.info(f"Finish: feed_rss: {len(ret)} feeds")
+        return ret
+
+    async def feed_auto_rss(self, force: bool = False) -> List[PartitionT]:
+        logger.info("Start: feed_auto_rss")
+
+        now = datetime.datetime.now()
+        stats = {
+            partition_of(stat["_id"]): stat
+            async for stat in self.db.recorded_programs.aggregate(
+                auto_feed_stats_pipeline(), allowDiskUse=True
+            )
+        }
+        states = {
+            partition_of(state): state async for state in self.db.auto_feeds.find({})
+        }
+        changed = changed_partitions(stats, states, self._writer.rss_root, force=force)
+        removed = [partition for partition in states if partition not in stats]
+        log_auto_feeds(len(stats), len(changed), len(removed))
+
+        # up to `concurrency` programs are held in memory while being written
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def feed(
+            partition: PartitionT, documents: List[Dict]
+        ) -> Optional[Tuple[PartitionT, Dict[str, int]]]:
+            try:
+                return partition, await asyncio.to_thread(
+                    self._writer.write_auto, documents, partition
+                )
+            except Exception as err:
+                logger.error(f"Error: {err}\n{partition}", stack_info=True)
+                return None
+            finally:
+                semaphore.release()
+
+        async def start_feed(partition: PartitionT, documents: List[Dict]) -> None:
+            if partition in stats:
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(feed(partition, documents)))
+
+        tasks: List[asyncio.Task] = []
+        if changed:
+            cursor = (
+                self.db.recorded_programs.find(
+                    auto_feed_query(changed, len(stats)), AUTO_FEED_PROJECTION
+                )
+                .sort(AUTO_FEED_SORT)
+                .allow_disk_use(True)
+            )
+            partition, documents = None, []
+            async for document in cursor:
+                if documents and partition_of(document) != partition:
+                    await start_feed(partition, documents)
+                    documents = []
+                partition = partition_of(document)
+                documents.append(document)
+            if documents:
+                await start_feed(partition, documents)
+        results = [x for x in await asyncio.gather(*tasks) if x is not None]
+
+        requests = [
+            auto_feed_state_update(partition, stats[partition], now)
+            for partition, _ in results
+        ]
+        for partition in removed:
+            await asyncio.to_thread(self._writer.remove_auto, partition)
+            requests.append(auto_feed_delete(partition))
+        if requests:
+            await self.db.auto_feeds.bulk_write(requests, ordered=False)
+        log_feed_sizes([sizes for _, sizes in results])
+        ret = [partition for partition, _ in results]
+
+        await self._update_timestamp("feed_auto_rss")
+        logger.info(f"Finish: feed_auto_rss: {len(ret)} feeds")
+        return ret
@@ -0,0 +1,439 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import pymongo
+from jadio import Program
+
+from ..catalogue import CATALOGUE_PROJECTION, ProgramCatalogue
+from ..database import AsyncJadioDatabase
+from ..deadline import estimate_at_risk
+from ..program_group import ProgramGroup
+from .base import AsyncDatabaseHandler
+from .recording import (
+    DEADLINE_PROJECTION,
+    DEADLINE_SORT,
+    EXISTING_FETCHED_PROGRAM_PROJECTION,
+    FAILED_QUERY,
+    LAST_FETCHED_SORT,
+    PROGRAM_KEYS_INDEX,
+    RETRY_SORT,
+    SEARCH_ENGINES,
+    RecorderServices,
+    active_lease_query,
+    at_risk_updates,
+    catalogue_search_query,
+    claim_query,
+    concurrency_limits,
+    deadline_program,
+    deadline_update,
+    default_worker_id,
+    existing_fetched_program_key,
+    expired_query,
+    expired_update,
+    fetched_programs_requests,
+    heartbeat_update,
+    high_water_mark,
+    is_modified_groups,
+    lease_update,
+    log_deadlines,
+    log_duplicate_programs,
+    log_failed,
+    log_throughput,
+    owner_query,
+    pending_query,
+    pop_queue_state,
+    recordable_query,
+    recorded_document,
+    reserved_program,
+    retry_update,
+    retry_wait_seconds,
+    retry_waiting_query,
+    search_query,
+    service_stats_update,
+    stale_reservations_query,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRecorder(AsyncDatabaseHandler):
+    """Asyncio version of `Recorder`.
+
+    DB operations are done on the asyncio driver, and the blocking operations
+    of `Jadio` (login, fetching and downloading) and file operations are done
+    in worker threads. Up to `concurrency` reserved programs are recorded
+    concurrently.
+    """
+
+    def __init__(
+        self,
+        service_config: Dict[str, str] = {},
+        media_root: Union[str, Path] = ".",
+        db_host: Optional[str] = None,
+        db_name: str = "jadio",
+        database: Optional[AsyncJadioDatabase] = None,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = 600.0,
+        max_attempts: int = 5,
+        retry_backoff: float = 30.0,
+        max_retry_backoff: float = 86400.0,
+        max_retry_wait: float = 300.0,
+        concurrency: int = 1,
+        hls_workers: int = 0,
+        search_index_path: Optional[Union[str, Path]] = None,
+        search_engine: str = "mongo",
+        catalogue_path: Optional[Union[str, Path]] = None,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+        placement: str = "most_free",
+        pins: Dict[str, str] = {},
+    ) -> None:
+        if search_engine not in SEARCH_ENGINES:
+            raise ValueError(f"search_engine must be one of {SEARCH_ENGINES}.")
+        super().__init__(db_host, db_name, database=database)
+        self._services = RecorderServices(
+            service_config,
+            media_root,
+            hls_workers=hls_workers,
+            search_index_path=search_index_path,
+            media_volumes=media_volumes,
+            placement=placement,
+            pins=pins,
+        )
+        self._worker_id = worker_id or default_worker_id()
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._retry_backoff = retry_backoff
+        self._max_retry_backoff = max_retry_backoff
+        self._max_retry_wait = max_retry_wait
+        self._concurrency = concurrency
+        self._search_engine = search_engine
+        self._catalogue_path = catalogue_path
+        self._catalogue: Optional[ProgramCatalogue] = None
+
+    async def login(self) -> None:
+        # services are logged in when programs are fetched or downloaded
+        await self._create_program_indexes()
+
+    async def close(self) -> None:
+        await super().close()
+        await asyncio.to_thread(self._services.close)
+
+    async def insert_program_group(
+        self,
+        program_group: ProgramGroup,
+        enable_feed: bool = True,
+    ) -> None:
+        logger.info("Start: insert_program_group")
+
+        program_group.enable_record = True
+        program_group.enable_feed = enable_feed
+
+        program_group = program_group.to_dict()
+        if await self.db.program_groups.find_one(
+            {"query": program_group["query"], "enable_record": True}
+        ):
+            logger.info("There is already a program group for the same query.")
+        await self.db.program_groups.update_one(
+            program_group, {"$set": program_group}, upsert=True
+        )
+
+        await self._update_timestamp("insert_program_group")
+        logger.info("Finish: insert_program_group")
+
+    async def fetch_programs(self, force: bool = False, interval_days: int = 1) -> None:
+        logger.info("Start: fetch_programs")
+
+        timestamp = await self.db.timestamp.find_one({"name": "fetch_programs"})
+        if not timestamp:
+            force = True
+        else:
+            timestamp = timestamp["timestamp"]
+        now = datetime.datetime.now()
+        if not force and timestamp + datetime.timedelta(days=interval_days) > now:
+            logger.info("Skipped: fetch_programs")
+            return
+
+        programs = await asyncio.to_thread(self._services.get_programs)
+
+        # Keep first-seen and updated times of the programs fetched before
+        existing = dict(
+            [
+                existing_fetched_program_key(program)
+                async for program in self.db.fetched_programs.find(
+                    {}, EXISTING_FETCHED_PROGRAM_PROJECTION
+                )
+            ]
+        )
+        requests = fetched_programs_requests(programs, existing, now)
+        if requests:
+            await self.db.fetched_programs.bulk_write(requests, ordered=False)
+
+        await self._update_timestamp("fetch_programs")
+        logger.info(f"Finish: fetch_programs: {len(programs)} programs")
+
+    async def _load_catalogue(self) -> ProgramCatalogue:
+        timestamp = await self.db.timestamp.find_one({"name": "fetch_programs"})
+        fetched_at = (timestamp or {}).get("timestamp")
+        if self._catalogue is not None and self._catalogue.fetched_at == fetched_at:
+            return self._catalogue
+        catalogue = None
+        if self._catalogue_path:
+            catalogue = await asyncio.to_thread(
+                ProgramCatalogue.load, self._catalogue_path, fetched_at
+            )
+        if catalogue is None:
+            documents = [
+                document
+                async for document in self.db.fetched_programs.find(
+                    {}, CATALOGUE_PROJECTION
+                )
+            ]
+            catalogue = await asyncio.to_thread(
+                ProgramCatalogue.from_documents, documents, fetched_at
+            )
+            if self._catalogue_path:
+                await asyncio.to_thread(catalogue.save, self._catalogue_path)
+            logger.info(f"Build a catalogue of {len(catalogue)} fetched program(s)")
+        self._catalogue = catalogue
+        return catalogue
+
+    async def _create_program_indexes(self) -> None:
+        for collection in [self.db.reserved_programs, self.db.recorded_programs]:
+            try:
+                await collection.create_index(PROGRAM_KEYS_INDEX, unique=True)
+            except pymongo.errors.DuplicateKeyError as err:
+                # programs are still looked up by `PROGRAM_KEYS` before recording
+                log_duplicate_programs(collection.name, err)
+
+    async def search_programs(self, full: bool = False) -> List[Program]:
+        logger.info("Start: search_programs")
+
+        now = datetime.datetime.now()
+        program_groups = [
+            ProgramGroup.from_dict(program_group)
+            async for program_group in self.db.program_groups.find(
+                {"enable_record": True}
+            )
+        ]
+        last_search = await self.db.timestamp.find_one({"name": "search_programs"})
+        if self._search_engine == "numpy":
+            query, digests = await asyncio.to_thread(
+                catalogue_search_query,
+                await self._load_catalogue(),
+                program_groups,
+                last_search,
+                full=full,
+            )
+        else:
+            query, digests = search_query(program_groups, last_search, full=full)
+        if is_modified_groups(digests, last_search):
+            result = await self.db.reserved_programs.delete_many(
+                stale_reservations_query(program_groups, now)
+            )
+            if result.deleted_count:
+                logger.info(f"Remove {result.deleted_count} stale reservation(s)")
+        last_fetched = await self.db.fetched_programs.find_one(sort=LAST_FETCHED_SORT)
+
+        ret: List[Program] = []
+        if query is not None:
+            async for program in self.db.fetched_programs.find(query):
+                find_query, program = reserved_program(program)
+                if await self.db.recorded_programs.find_one(find_query):
+                    continue
+                result = await self.db.reserved_programs.update_one(
+                    find_query, {"$setOnInsert": program}, upsert=True
+                )
+                if result.upserted_id is not None:
+                    ret.append(Program.from_dict(program))
+
+        await self._update_timestamp(
+            "search_programs",
+            high_water_mark=high_water_mark(last_fetched),
+            group_digests=digests,
+        )
+        logger.info(f"Finish: search_programs: {len(ret)} program(s)")
+        return ret
+
+    async def _get_saturated_service_ids(self, now: datetime.datetime) -> List[str]:
+        ret = []
+        limits = concurrency_limits(self._services.rate_limiters)
+        for service_id, max_downloads in limits.items():
+            num_downloads = await self.db.reserved_programs.count_documents(
+                active_lease_query(service_id, now)
+            )
+            if num_downloads >= max_downloads:
+                ret.append(service_id)
+        return ret
+
+    async def _claim_reserved_program(
+        self, query: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        now = datetime.datetime.now()
+        return await self.db.reserved_programs.find_one_and_update(
+            claim_query(query, now, await self._get_saturated_service_ids(now)),
+            lease_update(self._worker_id, now, self._lease_seconds),
+            sort=DEADLINE_SORT,
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+
+    async def _schedule_by_deadline(self, query: Dict[str, Any]) -> None:
+        now = datetime.datetime.now()
+        await self.db.reserved_programs.update_many(
+            pending_query(query), deadline_update(self._services.availability_days)
+        )
+        result = await self.db.reserved_programs.update_many(
+            {"$and": [query, expired_query(now)]}, expired_update()
+        )
+
+        service_stats = {
+            stats["service_id"]: stats async for stats in self.db.service_stats.find()
+        }
+        programs = [
+            deadline_program(program)
+            async for program in self.db.reserved_programs.find(
+                pending_query(query), DEADLINE_PROJECTION
+            ).sort(DEADLINE_SORT)
+        ]
+        at_risk = estimate_at_risk(
+            programs, service_stats, now, concurrency=self._concurrency
+        )
+        await self.db.reserved_programs.bulk_write(at_risk_updates(at_risk))
+        log_deadlines(len(programs), at_risk, result.modified_count)
+
+    async def _heartbeat(self, target_id: Any) -> None:
+        """Extends the lease of a claimed reserved program until cancelled.
+
+        Returns when the lease has been taken over by another recorder.
+        """
+        while True:
+            await asyncio.sleep(self._lease_seconds / 3)
+            now = datetime.datetime.now()
+            try:
+                result = await self.db.reserved_programs.update_one(
+                    owner_query(target_id, self._worker_id),
+                    heartbeat_update(now, self._lease_seconds),
+                )
+            except pymongo.errors.PyMongoError as err:
+                logger.warning(f"Failed to extend lease of {target_id}: {err}")
+                continue
+            if result.matched_count == 0:
+                logger.warning(f"Lease of {target_id} was taken over")
+                return
+
+    async def _wait_for_retry(self, query: Dict[str, Any]) -> bool:
+        now = datetime.datetime.now()
+        program = await self.db.reserved_programs.find_one(
+            retry_waiting_query(query, now), sort=RETRY_SORT
+        )
+        if program is None:
+            return False
+        wait = retry_wait_seconds(program, now)
+        if wait > self._max_retry_wait:
+            return False
+        logger.info(f"Wait {wait:.0f} seconds to retry recording")
+        await asyncio.sleep(max(wait, 0.0))
+        return True
+
+    async def _record_program(self, program: Program) -> None:
+        ext = self._services.media_suffix(program)
+        inserted_id = None
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                # download (record) media file to temporary dir
+                tmp_media_path = Path(tmp_dir) / f"media{ext}"
+                num_bytes, seconds = await asyncio.to_thread(
+                    self._services.download, program, tmp_media_path
+                )
+                await self.db.service_stats.update_one(
+                    {"service_id": program.service_id},
+                    service_stats_update(program, num_bytes, seconds),
+                    upsert=True,
+                )
+
+                # insert recorded program to db
+                volume = await asyncio.to_thread(self._services.place, program)
+                result = await self.db.recorded_programs.insert_one(
+                    recorded_document(program, volume)
+                )
+                inserted_id = result.inserted_id
+                await asyncio.to_thread(
+                    self._services.store, program, tmp_media_path, inserted_id, volume
+                )
+        except Exception:
+            if inserted_id:
+                await self.db.recorded_programs.delete_one({"_id": inserted_id})
+            raise
+
+    async def _record_reserved_program(
+        self, program: Dict[str, Any]
+    ) -> Optional[Program]:
+        target_id = program.pop("_id")
+        queue_state = pop_queue_state(program)
+        if await self.db.recorded_programs.find_one(program):
+            await self.db.reserved_programs.delete_one({"_id": target_id})
+            return None
+
+        program = Program.from_dict(program)
+        heartbeat = asyncio.create_task(self._heartbeat(target_id))
+        try:
+            await self._record_program(program)
+            error = None
+        except Exception as err:
+            logger.error(f"error: {err}\n{program}", stack_info=True)
+            error = err
+        finally:
+            lost = heartbeat.done()
+            heartbeat.cancel()
+        if lost:
+            # another recorder owns the reservation now
+            return program if error is None else None
+        if error is None:
+            await self.db.reserved_programs.delete_one(
+                owner_query(target_id, self._worker_id)
+            )
+            return program
+        await self.db.reserved_programs.update_one(
+            owner_query(target_id, self._worker_id),
+            retry_update(
+                target_id,
+                queue_state,
+                error,
+                self._max_attempts,
+                self._retry_backoff,
+                self._max_retry_backoff,
+            ),
+        )
+        return None
+
+    async def record_programs(self) -> List[Program]:
+        logger.info(f"Start: record_programs: worker {self._worker_id}")
+
+        date_query = recordable_query(datetime.datetime.now())
+        await self._schedule_by_deadline(date_query)
+
+        ret = []
+
+        async def work() -> None:
+            while True:
+                program = await self._claim_reserved_program(date_query)
+                if program is None:
+                    if await self._wait_for_retry(date_query):
+                        continue
+                    return
+                recorded = await self._record_reserved_program(program)
+                if recorded is not None:
+                    ret.append(recorded)
+
+        await asyncio.gather(*[work() for _ in range(self._concurrency)])
+
+        log_failed(await self.db.reserved_programs.count_documents(FAILED_QUERY))
+        log_throughput(self._services.rate_limiters)
+        await self._update_timestamp("record_programs")
+        logger.info(f"Finish: record_programs: {len(ret)} program(s)")
+        return ret
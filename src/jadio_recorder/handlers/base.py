@@ -3,11 +3,12 @@ from __future__ import annotations
 import abc
 import datetime
 import logging
-from typing import Optional, TypeVar
+from typing import Any, Optional, TypeVar
 
-from ..database import JadioDatabase
+from ..database import AsyncJadioDatabase, JadioDatabase
 
 A = TypeVar("A", bound="DatabaseHandler")
+B = TypeVar("B", bound="AsyncDatabaseHandler")
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +37,48 @@ class DatabaseHandler(abc.ABC):
     def close(self) -> None:
         self.db.close()
 
-    def _update_timestamp(self, name: str) -> None:
+    def _update_timestamp(self, name: str, **fields: Any) -> None:
         timestamp = datetime.datetime.now()
         self.db.timestamp.update_one(
-            {"name": name}, {"$set": {"timestamp": timestamp}}, upsert=True
+            {"name": name}, {"$set": {"timestamp": timestamp, **fields}}, upsert=True
+        )
+
+
+class AsyncDatabaseHandler(abc.ABC):
+    """Asyncio version of `DatabaseHandler`.
+
+    A `AsyncJadioDatabase` can be given as `database` to share its connection
+    pool between handlers. It is not closed by the handler in that case.
+    """
+
+    def __init__(
+        self,
+        db_host: Optional[str] = None,
+        db_name: str = "jadio",
+        database: Optional[AsyncJadioDatabase] = None,
+    ) -> None:
+        self._owns_database = database is None
+        self._database = database or AsyncJadioDatabase(db_host, name=db_name)
+
+    @property
+    def db(self) -> AsyncJadioDatabase:
+        return self._database
+
+    async def __aenter__(self: B) -> B:
+        await self.login()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def login(self) -> None: ...
+
+    async def close(self) -> None:
+        if self._owns_database:
+            self.db.close()
+
+    async def _update_timestamp(self, name: str, **fields: Any) -> None:
+        timestamp = datetime.datetime.now()
+        await self.db.timestamp.update_one(
+            {"name": name}, {"$set": {"timestamp": timestamp, **fields}}, upsert=True
         )
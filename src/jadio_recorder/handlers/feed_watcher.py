@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+import pymongo
+from bson import ObjectId
+
+from ..program_group import ProgramGroup
+from .feeder import Feeder
+
+logger = logging.getLogger(__name__)
+
+# (collection name, IDs of inserted or updated documents, whether other documents
+# may have changed, e.g. been deleted)
+ChangeT = Tuple[str, List[ObjectId], bool]
+
+# ObjectIds are created by clients, so programs inserted by other recorders can
+# have older ObjectIds than the newest one seen. Polling looks for inserted
+# programs among ObjectIds created up to this many seconds before the newest.
+INSERT_LOOKBACK_SECONDS = 300.0
+
+
+class FeedWatcher(Feeder):
+    """Updates RSS feeds as soon as recorded programs or program groups change.
+
+    Changes are received by MongoDB change streams, or by polling if change
+    streams are not available (standalone mongod). Only the RSS feeds of the
+    program groups affected by the changes are created again, after no changes
+    have been received for `debounce_seconds` (or `max_delay_seconds` has
+    passed since the first pending change).
+
+    Polling finds inserted programs, deleted programs (by their count) and
+    changed program groups, but not updated programs, so all feeds are also
+    created again every `full_refresh_seconds` while polling.
+    """
+
+    def __init__(
+        self,
+        rss_root: Union[str, Path] = ".",
+        media_root: Union[str, Path] = ".",
+        http_host: str = "http://localhost",
+        db_host: Optional[str] = None,
+        db_name: str = "jadio",
+        debounce_seconds: float = 5.0,
+        max_delay_seconds: float = 60.0,
+        poll_interval: float = 10.0,
+        full_refresh_seconds: float = 3600.0,
+        max_items: Optional[int] = None,
+        artwork_size: Optional[int] = None,
+        precompress: bool = False,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+    ) -> None:
+        super().__init__(
+            rss_root,
+            media_root,
+            http_host,
+            db_host,
+            db_name,
+            max_items=max_items,
+            artwork_size=artwork_size,
+            precompress=precompress,
+            media_volumes=media_volumes,
+        )
+        self._debounce_seconds = debounce_seconds
+        self._max_delay_seconds = max_delay_seconds
+        self._poll_interval = poll_interval
+        self._full_refresh_seconds = full_refresh_seconds
+
+    def _watch_change_stream(self) -> Iterator[Optional[ChangeT]]:
+        pipeline = [
+            {
+                "$match": {
+                    "ns.coll": {"$in": ["recorded_programs", "program_groups"]},
+                    "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+                }
+            }
+        ]
+        with self.db.watch(pipeline, max_await_time_ms=1000) as stream:
+            logger.info("Watch changes by change streams")
+            while stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    yield None
+                    continue
+                collection = change["ns"]["coll"]
+                object_id = change["documentKey"]["_id"]
+                if change["operationType"] == "delete":
+                    yield collection, [], True
+                else:
+                    yield collection, [object_id], False
+
+    def _snapshot_program_groups(self) -> Dict[ObjectId, Dict[str, Any]]:
+        return {
+            program_group.pop("_id"): program_group
+            for program_group in self.db.program_groups.find()
+        }
+
+    def _poll_inserted_programs(
+        self, newest: Optional[datetime.datetime], seen: Set[ObjectId]
+    ) -> Tuple[List[ObjectId], Optional[datetime.datetime], Set[ObjectId]]:
+        """Finds programs inserted since the last poll.
+
+        Args:
+            newest (`datetime.datetime`): When the newest ObjectId seen was
+                created, or None to find all programs.
+            seen (set of ObjectId): ObjectIds seen within the lookback.
+
+        Returns:
+            tuple: The ObjectIds of the inserted programs, and `newest` and
+            `seen` for the next poll.
+        """
+        query = {}
+        if newest is not None:
+            start = newest - datetime.timedelta(seconds=INSERT_LOOKBACK_SECONDS)
+            query = {"_id": {"$gte": ObjectId.from_datetime(start)}}
+        ids = [
+            program["_id"]
+            for program in self.db.recorded_programs.find(query, {"_id": 1})
+        ]
+        times = [object_id.generation_time for object_id in ids]
+        if times:
+            newest = max(times + ([newest] if newest else []))
+        return [x for x in ids if x not in seen], newest, set(ids)
+
+    def _watch_polling(self) -> Iterator[Optional[ChangeT]]:
+        logger.info(f"Watch changes by polling every {self._poll_interval} seconds")
+        _, newest, seen = self._poll_inserted_programs(None, set())
+        num_programs = self.db.recorded_programs.count_documents({})
+        program_groups = self._snapshot_program_groups()
+        refreshed_at = time.monotonic()
+        while True:
+            time.sleep(self._poll_interval)
+
+            ids, newest, seen = self._poll_inserted_programs(newest, seen)
+            prev_num_programs = num_programs
+            num_programs = self.db.recorded_programs.count_documents({})
+            deleted = num_programs < prev_num_programs + len(ids)
+            if time.monotonic() - refreshed_at >= self._full_refresh_seconds:
+                # updated programs are not found by polling
+                refreshed_at = time.monotonic()
+                deleted = True
+            if ids or deleted:
+                yield "recorded_programs", ids, deleted
+
+            prev_program_groups = program_groups
+            program_groups = self._snapshot_program_groups()
+            changed_ids = [
+                object_id
+                for object_id in set(program_groups) | set(prev_program_groups)
+                if prev_program_groups.get(object_id) != program_groups.get(object_id)
+            ]
+            if changed_ids:
+                yield "program_groups", changed_ids, False
+            yield None
+
+    def _watch(self) -> Iterator[Optional[ChangeT]]:
+        try:
+            yield from self._watch_change_stream()
+        except pymongo.errors.OperationFailure as err:
+            # e.g. "The $changeStream stage is only supported on replica sets"
+            logger.info(f"Change streams are not available: {err}")
+        yield from self._watch_polling()
+
+    def _find_affected_program_groups(self, change: ChangeT) -> Set[ObjectId]:
+        collection, ids, deleted = change
+        if collection == "program_groups":
+            return set(ids)
+
+        program_groups = self.db.program_groups.find({"enable_feed": True})
+        if deleted:
+            # deleted programs cannot be matched with the queries
+            return {program_group["_id"] for program_group in program_groups}
+        ret = set()
+        for program_group in program_groups:
+            object_id = program_group.pop("_id")
+            query = ProgramGroup.from_dict(program_group).query.to_mongo_format()
+            if self.db.recorded_programs.count_documents(
+                {"$and": [{"_id": {"$in": ids}}, query]}, limit=1
+            ):
+                ret.add(object_id)
+        return ret
+
+    def _update_feeds(self, object_ids: Set[ObjectId]) -> List[ProgramGroup]:
+        ret = []
+        query = {"_id": {"$in": list(object_ids)}, "enable_feed": True}
+        for program_group in self.db.program_groups.find(query):
+            object_id = program_group.pop("_id")
+            program_group = ProgramGroup.from_dict(program_group)
+            try:
+                self._feed_rss(program_group, object_id)
+                ret.append(program_group)
+            except Exception as err:
+                logger.error(f"Error: {err}\n{program_group}", stack_info=True)
+        self._update_timestamp("feed_rss")
+        logger.info(f"Update {len(ret)} feed(s)")
+        return ret
+
+    def watch(self, timeout: Optional[float] = None) -> None:
+        """Watches changes and updates affected RSS feeds.
+
+        Args:
+            timeout (float): Seconds to watch. If None, watch forever.
+        """
+        logger.info("Start: watch")
+        start = time.monotonic()
+        pending: Set[ObjectId] = set()
+        first_change_at = last_change_at = 0.0
+        for change in self._watch():
+            now = time.monotonic()
+            if change is not None:
+                object_ids = self._find_affected_program_groups(change)
+                if object_ids:
+                    if not pending:
+                        first_change_at = now
+                    last_change_at = now
+                    pending |= object_ids
+            if pending and (
+                now - last_change_at >= self._debounce_seconds
+                or now - first_change_at >= self._max_delay_seconds
+            ):
+                self._update_feeds(pending)
+                pending = set()
+            if timeout is not None and now - start >= timeout:
+                break
+        if pending:
+            self._update_feeds(pending)
+        logger.info("Finish: watch")
@@ -1,20 +1,44 @@
 from __future__ import annotations
 
+import datetime
+import itertools
 import logging
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 import tqdm
 from bson import ObjectId
-from jadio import Program
 
-from ..podcast import PodcastRssFeedGenCreator
+from ..podcast import default_sort_by
 from ..program_group import ProgramGroup
 from .base import DatabaseHandler
+from .feeding import (
+    AUTO_FEED_PROJECTION,
+    AUTO_FEED_SORT,
+    FeedWriter,
+    PartitionT,
+    auto_feed_delete,
+    auto_feed_query,
+    auto_feed_state_update,
+    auto_feed_stats_pipeline,
+    changed_partitions,
+    feed_pipeline,
+    is_completed_feed,
+    log_auto_feeds,
+    log_feed_sizes,
+    partition_of,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _feed_sort_by(collection: Any, query: Dict[str, Any]) -> str:
+    station_ids = collection.distinct("station_id", query)
+    if len(station_ids) > 1:
+        return default_sort_by(station_ids, [])
+    return default_sort_by(station_ids, collection.distinct("service_id", query))
+
+
 class Feeder(DatabaseHandler):
     def __init__(
         self,
@@ -23,12 +47,21 @@ class Feeder(DatabaseHandler):
         http_host: str = "http://localhost",
         db_host: Optional[str] = None,
         db_name: str = "jadio",
+        max_items: Optional[int] = None,
+        artwork_size: Optional[int] = None,
+        precompress: bool = False,
+        media_volumes: Dict[str, Union[str, Path]] = {},
     ) -> None:
         super().__init__(db_host, db_name)
-        self._rss_root = Path(rss_root)
-        self._rss_root.mkdir(parents=True, exist_ok=True)
-        self._media_root = Path(media_root)
-        self._http_host = http_host
+        self._writer = FeedWriter(
+            rss_root,
+            media_root,
+            http_host,
+            max_items=max_items,
+            artwork_size=artwork_size,
+            precompress=precompress,
+            media_volumes=media_volumes,
+        )
 
     def insert_program_group(self, program_group: ProgramGroup) -> None:
         logger.info("Start: insert_program_group")
@@ -52,28 +85,16 @@ class Feeder(DatabaseHandler):
         program_group: ProgramGroup,
         object_id: Union[str, ObjectId],
         pretty: bool = True,
-    ) -> None:
-        # fetch specified recorded programs
+    ) -> Dict[str, int]:
+        # fetch specified recorded programs in order of feed items
         logger.debug(f"Feed RSS: {program_group}")
-        programs = self.db.recorded_programs.find(program_group.query.to_mongo_format())
-        program_and_id_pairs = [
-            (Program.from_dict(program), program["_id"]) for program in programs
-        ]
-        if len(program_and_id_pairs) == 0:
-            logger.debug("Find no programs. RSS feed is not created")
-            return
-        logger.debug(f"Fetch {len(program_and_id_pairs)} program(s)")
-
-        # create FeedGenerator
-        feed_generator = PodcastRssFeedGenCreator(
-            self._http_host, self._media_root
-        ).create(program_group, program_and_id_pairs, remove_duplicates=True)
-
-        # save RSS feed file
-        rss_feed_path = self._rss_root / f"{str(object_id)}.xml"
-        rss_feed_path.parent.mkdir(exist_ok=True)
-        feed_generator.rss_file(rss_feed_path, pretty=pretty)
-        logger.debug(f"Save RSS feed to {rss_feed_path}")
+        query = program_group.query.to_mongo_format()
+        sort_by = _feed_sort_by(self.db.recorded_programs, query)
+        documents = self.db.recorded_programs.aggregate(
+            feed_pipeline(query, sort_by, limit=self._writer.max_items),
+            allowDiskUse=True,
+        )
+        return self._writer.write(documents, program_group, object_id, pretty=pretty)
 
     def feed_rss(self, force: bool = False) -> List[ProgramGroup]:
         logger.info("Start: feed_rss")
@@ -83,30 +104,85 @@ class Feeder(DatabaseHandler):
             last_timestamp = last_timestamp["timestamp"]
 
         program_groups = list(self.db.program_groups.find({"enable_feed": True}))
-        ret = []
+        ret, sizes = [], []
         for program_group in tqdm.tqdm(program_groups):
             object_id = program_group.pop("_id")
             program_group = ProgramGroup.from_dict(program_group)
-            if (
-                isinstance(program_group.query.pub_date, list)
-                and program_group.query.pub_date[1]
+            if not force and is_completed_feed(
+                program_group, self._writer.feed_path(object_id), last_timestamp
             ):
-                last_datetime = program_group.query.pub_date[1]
-                if (
-                    last_datetime < (last_timestamp or last_datetime)
-                    and not force
-                    and (self._rss_root / f"{str(object_id)}.xml").exists()
-                ):
-                    logger.debug(
-                        f"Skip: feed the RSS of completed channels: {str(object_id)}"
-                    )
-                    continue
+                logger.debug(
+                    f"Skip: feed the RSS of completed channels: {str(object_id)}"
+                )
+                continue
             try:
-                self._feed_rss(program_group, object_id)
+                sizes.append(self._feed_rss(program_group, object_id))
                 ret.append(program_group)
             except Exception as err:
                 logger.error(f"Error: {err}\n{program_group}", stack_info=True)
+        log_feed_sizes(sizes)
 
         self._update_timestamp("feed_rss")
         logger.info(f"Finish: feed_rss: {len(ret)} feeds")
         return ret
+
+    def feed_auto_rss(self, force: bool = False) -> List[PartitionT]:
+        """Creates an RSS feed of each recorded program (`program_id`).
+
+        Recorded programs are counted by program first, and only the feeds of
+        programs which have changed since the last call are created again, from
+        one scan of their recorded programs sorted by program. The channel of
+        each feed is described by the newest episode.
+
+        Returns:
+            list of tuple: Service and program IDs of the created feeds.
+        """
+        logger.info("Start: feed_auto_rss")
+
+        now = datetime.datetime.now()
+        stats = {
+            partition_of(stat["_id"]): stat
+            for stat in self.db.recorded_programs.aggregate(
+                auto_feed_stats_pipeline(), allowDiskUse=True
+            )
+        }
+        states = {partition_of(state): state for state in self.db.auto_feeds.find({})}
+        changed = changed_partitions(stats, states, self._writer.rss_root, force=force)
+        removed = [partition for partition in states if partition not in stats]
+        log_auto_feeds(len(stats), len(changed), len(removed))
+
+        ret, sizes, requests = [], [], []
+        if changed:
+            documents = (
+                self.db.recorded_programs.find(
+                    auto_feed_query(changed, len(stats)), AUTO_FEED_PROJECTION
+                )
+                .sort(AUTO_FEED_SORT)
+                .allow_disk_use(True)
+            )
+            for partition, partition_documents in tqdm.tqdm(
+                itertools.groupby(documents, key=partition_of), total=len(changed)
+            ):
+                if partition not in stats:
+                    # recorded after counting, so created by the next call
+                    continue
+                try:
+                    sizes.append(
+                        self._writer.write_auto(list(partition_documents), partition)
+                    )
+                    ret.append(partition)
+                    requests.append(
+                        auto_feed_state_update(partition, stats[partition], now)
+                    )
+                except Exception as err:
+                    logger.error(f"Error: {err}\n{partition}", stack_info=True)
+        for partition in removed:
+            self._writer.remove_auto(partition)
+            requests.append(auto_feed_delete(partition))
+        if requests:
+            self.db.auto_feeds.bulk_write(requests, ordered=False)
+        log_feed_sizes(sizes)
+
+        self._update_timestamp("feed_auto_rss")
+        logger.info(f"Finish: feed_auto_rss: {len(ret)} feeds")
+        return ret
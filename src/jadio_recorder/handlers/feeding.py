@@ -0,0 +1,423 @@
+"""Steps of creating RSS feeds shared by `Feeder` and `AsyncFeeder`.
+
+The aggregation pipelines, queries and other steps without I/O are plain
+functions, and feeds are written by `FeedWriter`, so that the handlers only
+run them against the DB.
+"""
+from __future__ import annotations
+
+import datetime
+import gzip
+import itertools
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import pymongo
+
+from ..artwork import ArtworkCache
+from ..media_volume import MediaVolumes
+from ..podcast import FEED_ITEM_FIELDS, PodcastRssFeedGenCreator, default_sort_by
+from ..program_group import ProgramGroup
+from ..program_query import ProgramQuery
+from ..utils import write_atomic
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of precompressed RSS feeds written next to "<program-group-id>.xml".
+COMPRESSED_SUFFIXES = [".gz", ".br"]
+
+# Directory of the RSS feeds of programs created by `feed_auto_rss` under the
+# RSS root, where feeds are written as "<service-id>/<program-id>.xml".
+AUTO_FEED_DIRNAME = "auto"
+
+# Fields of recorded programs needed to create the feeds of programs, whose
+# channels are taken from the newest episodes.
+AUTO_FEED_PROJECTION = {
+    key: 1
+    for key in FEED_ITEM_FIELDS
+    + ["program_title", "information", "performers", "copyright"]
+}
+
+# Service and program ID (partition of an auto feed) of a recorded program.
+PartitionT = Tuple[Any, Any]
+
+
+def feed_pipeline(
+    query: Dict[str, Any],
+    sort_by: str,
+    from_oldest: bool = False,
+    remove_duplicates: bool = True,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Aggregation pipeline selecting the items of a feed from recorded programs.
+
+    Programs are sorted by `sort_by`, and programs having the same `episode_id`
+    or `pub_date` as a preceding program are removed as duplicates. Programs
+    without the key are not removed by it. Only the fields needed by the feed
+    items are projected.
+    """
+    order = pymongo.ASCENDING if from_oldest else pymongo.DESCENDING
+    sort = {"$sort": {sort_by: order, "_id": order}}
+    pipeline = [
+        {"$match": query},
+        {"$project": {key: 1 for key in FEED_ITEM_FIELDS}},
+        sort,
+    ]
+    if remove_duplicates:
+        for key in ["episode_id", "pub_date"]:
+            pipeline += [
+                {
+                    "$group": {
+                        # each program without the key is a group of its own
+                        "_id": {"$ifNull": [f"${key}", "$_id"]},
+                        "document": {"$first": "$$ROOT"},
+                    }
+                },
+                {"$replaceRoot": {"newRoot": "$document"}},
+                sort,
+            ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    return pipeline
+
+
+def compress(data: bytes, suffix: str) -> Optional[bytes]:
+    if suffix == ".gz":
+        # fix mtime so that unchanged feeds are compressed to the same bytes
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if suffix == ".br" and brotli is not None:
+        return brotli.compress(data, quality=11)
+    return None
+
+
+def write_rss_feed(
+    documents: Iterable[Dict[str, Any]],
+    program_group: ProgramGroup,
+    rss_feed_path: Path,
+    http_host: str,
+    media_root: Union[Path, MediaVolumes],
+    pretty: bool = True,
+    image_url_mapper: Optional[Callable[[Optional[str]], Optional[str]]] = None,
+    precompress: bool = False,
+) -> Dict[str, int]:
+    """Writes the RSS feed of documents selected by `feed_pipeline`.
+
+    If `precompress`, the feed is written as compact XML together with its
+    gzip and brotli (if installed) compressed files, otherwise stale compressed
+    files are removed. Each file is replaced atomically.
+
+    Returns:
+        dict: Sizes of the written files in bytes by suffix (e.g. ".xml").
+    """
+    documents = iter(documents)
+    first_document = next(documents, None)
+    if first_document is None:
+        logger.debug("Find no programs. RSS feed is not created")
+        return {}
+    documents = itertools.chain([first_document], documents)
+
+    # stream RSS feed items without creating feedgen entries
+    data = b"".join(
+        PodcastRssFeedGenCreator(
+            http_host, media_root, image_url_mapper=image_url_mapper
+        ).iter_rss_from_documents(
+            program_group, documents, pretty=pretty and not precompress
+        )
+    )
+
+    # save RSS feed file
+    rss_feed_path.parent.mkdir(exist_ok=True)
+    write_atomic(rss_feed_path, data)
+    ret = {rss_feed_path.suffix: len(data)}
+    for suffix in COMPRESSED_SUFFIXES:
+        compressed_path = rss_feed_path.with_name(rss_feed_path.name + suffix)
+        compressed = compress(data, suffix) if precompress else None
+        if compressed is not None:
+            write_atomic(compressed_path, compressed)
+            ret[suffix] = len(compressed)
+        elif compressed_path.exists():
+            os.remove(compressed_path)
+    logger.debug(f"Save RSS feed to {rss_feed_path}")
+    return ret
+
+
+def log_feed_sizes(sizes: List[Dict[str, int]]) -> None:
+    sizes = [size for size in sizes if size]
+    num_bytes = sum(size.get(".xml", 0) for size in sizes)
+    if num_bytes == 0:
+        return
+    message = f"Feed sizes: {len(sizes)} feed(s), {num_bytes / 1e6:.2f} MB"
+    for suffix in COMPRESSED_SUFFIXES:
+        num_compressed = sum(size[suffix] for size in sizes if suffix in size)
+        if num_compressed:
+            message += (
+                f", {suffix[1:]} {num_compressed / 1e6:.2f} MB "
+                f"({num_compressed / num_bytes:.1%})"
+            )
+    logger.info(message)
+
+
+def is_completed_feed(
+    program_group: ProgramGroup,
+    rss_feed_path: Path,
+    last_timestamp: Optional[datetime.datetime],
+) -> bool:
+    """Whether the RSS feed of a program group whose period has ended before the
+    last `feed_rss` has already been created."""
+    if (
+        isinstance(program_group.query.pub_date, list)
+        and program_group.query.pub_date[1]
+    ):
+        last_datetime = program_group.query.pub_date[1]
+        return (
+            last_datetime < (last_timestamp or last_datetime) and rss_feed_path.exists()
+        )
+    return False
+
+
+def auto_feed_stats_pipeline() -> List[Dict[str, Any]]:
+    """Aggregation pipeline counting recorded programs by program, to find the
+    programs whose feeds have changed without reading the programs."""
+    return [
+        {
+            "$group": {
+                "_id": {"service_id": "$service_id", "program_id": "$program_id"},
+                "count": {"$sum": 1},
+                "max_id": {"$max": "$_id"},
+            }
+        }
+    ]
+
+
+def auto_feed_path(rss_root: Path, partition: PartitionT) -> Path:
+    service_id, program_id = partition
+    return rss_root.joinpath(AUTO_FEED_DIRNAME, str(service_id), f"{program_id}.xml")
+
+
+def changed_partitions(
+    stats: Dict[PartitionT, Dict[str, Any]],
+    states: Dict[PartitionT, Dict[str, Any]],
+    rss_root: Path,
+    force: bool = False,
+) -> List[PartitionT]:
+    """Programs which have been recorded or removed since their feeds were
+    created, or whose feeds are missing."""
+    ret = []
+    for partition, stat in stats.items():
+        state = states.get(partition) or {}
+        if (
+            force
+            or state.get("count") != stat["count"]
+            or state.get("max_id") != stat["max_id"]
+            or not auto_feed_path(rss_root, partition).exists()
+        ):
+            ret.append(partition)
+    return ret
+
+
+def auto_feed_query(
+    partitions: List[PartitionT], num_partitions: int
+) -> Dict[str, Any]:
+    if len(partitions) == num_partitions:
+        return {}
+    return {
+        "$or": [
+            {"service_id": service_id, "program_id": program_id}
+            for service_id, program_id in partitions
+        ]
+    }
+
+
+# Order of recorded programs read by `feed_auto_rss`, grouped by program.
+AUTO_FEED_SORT = [("service_id", pymongo.ASCENDING), ("program_id", pymongo.ASCENDING)]
+
+
+def partition_of(document: Dict[str, Any]) -> PartitionT:
+    return document.get("service_id"), document.get("program_id")
+
+
+def select_feed_items(
+    documents: List[Dict[str, Any]], limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Same as `feed_pipeline` without `$match`, for the documents of a program
+    in memory."""
+    sort_by = default_sort_by(
+        [document.get("station_id") for document in documents],
+        [document.get("service_id") for document in documents],
+    )
+    documents = sorted(
+        documents,
+        key=lambda x: (x.get(sort_by) is not None, x.get(sort_by), x["_id"]),
+        reverse=True,
+    )
+    for key in ["episode_id", "pub_date"]:
+        seen, unique = set(), []
+        for document in documents:
+            if document.get(key) not in seen:
+                seen.add(document.get(key))
+                unique.append(document)
+        documents = unique
+    return documents[:limit] if limit else documents
+
+
+def auto_program_group(newest: Dict[str, Any]) -> ProgramGroup:
+    """Program group of the feed of a program, described by its newest episode."""
+    performers = newest.get("performers")
+    if isinstance(performers, list):
+        performers = ", ".join(str(x) for x in performers if x) or None
+    return ProgramGroup(
+        query=ProgramQuery(
+            service_id=newest.get("service_id"), program_id=newest.get("program_id")
+        ),
+        title=newest.get("program_title"),
+        description=newest.get("information") or newest.get("description"),
+        copyright=newest.get("copyright"),
+        link_url=newest.get("link_url"),
+        image_url=newest.get("image_url"),
+        author=performers,
+        enable_feed=True,
+    )
+
+
+def write_auto_feed(
+    documents: List[Dict[str, Any]],
+    rss_feed_path: Path,
+    http_host: str,
+    media_root: Union[Path, MediaVolumes],
+    max_items: Optional[int] = None,
+    image_url_mapper: Optional[Callable[[Optional[str]], Optional[str]]] = None,
+    precompress: bool = False,
+) -> Dict[str, int]:
+    """Writes the RSS feed of a program from all of its recorded programs."""
+    newest = max(
+        documents,
+        key=lambda x: (x.get("pub_date") is not None, x.get("pub_date"), x["_id"]),
+    )
+    rss_feed_path.parent.mkdir(parents=True, exist_ok=True)
+    return write_rss_feed(
+        select_feed_items(documents, max_items),
+        auto_program_group(newest),
+        rss_feed_path,
+        http_host,
+        media_root,
+        image_url_mapper=image_url_mapper,
+        precompress=precompress,
+    )
+
+
+def auto_feed_state_update(
+    partition: PartitionT, stat: Dict[str, Any], now: datetime.datetime
+) -> pymongo.UpdateOne:
+    service_id, program_id = partition
+    return pymongo.UpdateOne(
+        {"service_id": service_id, "program_id": program_id},
+        {
+            "$set": {
+                "count": stat["count"],
+                "max_id": stat["max_id"],
+                "timestamp": now,
+            }
+        },
+        upsert=True,
+    )
+
+
+def auto_feed_delete(partition: PartitionT) -> pymongo.DeleteOne:
+    service_id, program_id = partition
+    return pymongo.DeleteOne({"service_id": service_id, "program_id": program_id})
+
+
+def remove_auto_feed(rss_root: Path, partition: PartitionT) -> None:
+    rss_feed_path = auto_feed_path(rss_root, partition)
+    for path in [rss_feed_path] + [
+        rss_feed_path.with_name(rss_feed_path.name + suffix)
+        for suffix in COMPRESSED_SUFFIXES
+    ]:
+        if path.exists():
+            os.remove(path)
+
+
+def log_auto_feeds(num_partitions: int, num_changed: int, num_removed: int) -> None:
+    logger.info(
+        f"Auto feeds: {num_partitions} program(s), {num_changed} changed, "
+        f"{num_removed} removed"
+    )
+
+
+class FeedWriter:
+    """Writes RSS feeds under `rss_root`, configured by the arguments of
+    `Feeder`.
+
+    The methods are blocking, so `AsyncFeeder` runs them in worker threads.
+    """
+
+    def __init__(
+        self,
+        rss_root: Union[str, Path] = ".",
+        media_root: Union[str, Path] = ".",
+        http_host: str = "http://localhost",
+        max_items: Optional[int] = None,
+        artwork_size: Optional[int] = None,
+        precompress: bool = False,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+    ) -> None:
+        self.rss_root = Path(rss_root)
+        self.rss_root.mkdir(parents=True, exist_ok=True)
+        self.max_items = max_items
+        self._media_root = MediaVolumes(media_root, media_volumes)
+        self._http_host = http_host
+        self._precompress = precompress
+        if precompress and brotli is None:
+            logger.warning("brotli is not installed. Only gzip files are written")
+        self._artwork_cache = None
+        if artwork_size:
+            self._artwork_cache = ArtworkCache(
+                self.rss_root, http_host, size=artwork_size
+            )
+
+    def feed_path(self, object_id: Any) -> Path:
+        """Path of the RSS feed of a program group."""
+        return self.rss_root / f"{str(object_id)}.xml"
+
+    def write(
+        self,
+        documents: Iterable[Dict[str, Any]],
+        program_group: ProgramGroup,
+        object_id: Any,
+        pretty: bool = True,
+    ) -> Dict[str, int]:
+        """Writes the RSS feed of a program group by `write_rss_feed`."""
+        return write_rss_feed(
+            documents,
+            program_group,
+            self.feed_path(object_id),
+            self._http_host,
+            self._media_root,
+            pretty=pretty,
+            image_url_mapper=self._artwork_cache,
+            precompress=self._precompress,
+        )
+
+    def write_auto(
+        self, documents: List[Dict[str, Any]], partition: PartitionT
+    ) -> Dict[str, int]:
+        """Writes the RSS feed of a program by `write_auto_feed`."""
+        return write_auto_feed(
+            documents,
+            auto_feed_path(self.rss_root, partition),
+            self._http_host,
+            self._media_root,
+            max_items=self.max_items,
+            image_url_mapper=self._artwork_cache,
+            precompress=self._precompress,
+        )
+
+    def remove_auto(self, partition: PartitionT) -> None:
+        remove_auto_feed(self.rss_root, partition)
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pymongo
+from bson import ObjectId
+from bson.errors import InvalidId
+from jadio import Program
+
+from ..media_volume import DEFAULT_VOLUME, VOLUME_KEY, MediaVolumes
+from .base import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _stat_entry(stat: os.stat_result) -> Dict[str, int]:
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def _list_dir(path: Path) -> List[os.DirEntry]:
+    with os.scandir(path) as it:
+        return [entry for entry in it if not entry.name.startswith(".")]
+
+
+def _scan_program_dir(
+    path: Path, cached: Optional[Dict[str, Any]], full: bool
+) -> Tuple[Dict[str, Any], int]:
+    """Scans `<service-id>/<program-id>/` directory.
+
+    Directories of recorded programs are only listed when their mtime has
+    changed since the last scan, because media and program files are moved
+    into them (not modified in place) by `Recorder`.
+
+    Returns:
+        tuple: Manifest entry of the directory and the number of stat calls.
+    """
+    num_stats = 1
+    mtime_ns = path.stat().st_mtime_ns
+    cached = cached or {}
+    cached_objects = cached.get("objects", {})
+    if not full and cached.get("mtime_ns") == mtime_ns:
+        names = list(cached_objects)
+    else:
+        names = [entry.name for entry in _list_dir(path) if entry.is_dir()]
+
+    objects = {}
+    for name in names:
+        object_path = path / name
+        try:
+            object_mtime_ns = object_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+        num_stats += 1
+        cached_object = cached_objects.get(name)
+        if (
+            not full
+            and cached_object
+            and cached_object.get("mtime_ns") == object_mtime_ns
+        ):
+            objects[name] = cached_object
+            continue
+        files = {}
+        for entry in _list_dir(object_path):
+            if entry.is_file():
+                files[entry.name] = _stat_entry(entry.stat())
+                num_stats += 1
+        objects[name] = {"mtime_ns": object_mtime_ns, "files": files}
+    return {"mtime_ns": mtime_ns, "objects": objects}, num_stats
+
+
+@dataclass
+class MediaScanResult:
+    """Result of `MediaLibrary.scan`.
+
+    Attributes:
+        num_programs (int): Number of recorded program directories.
+        total_bytes (int): Total size of files under the media root.
+        num_stats (int): Number of stat calls in the scan.
+        orphans (list of `Path`): Recorded program directories which have no
+            document in `recorded_programs`.
+        missing (list of `ObjectId`): IDs of `recorded_programs` documents
+            whose media file is missing.
+        recent (list of `ObjectId`): IDs of `recorded_programs` documents
+            whose media file is missing but which were inserted within the
+            grace period (e.g. programs being recorded), which are not removed.
+        restored (list of `ObjectId`): IDs of orphans restored to
+            `recorded_programs` from their `program.json`.
+        removed (list of `ObjectId`): IDs of `recorded_programs` documents
+            removed because their media file is missing.
+    """
+
+    num_programs: int = 0
+    total_bytes: int = 0
+    num_stats: int = 0
+    orphans: List[Path] = field(default_factory=list)
+    missing: List[ObjectId] = field(default_factory=list)
+    recent: List[ObjectId] = field(default_factory=list)
+    restored: List[ObjectId] = field(default_factory=list)
+    removed: List[ObjectId] = field(default_factory=list)
+
+
+class MediaLibrary(DatabaseHandler):
+    """Checks consistency between media files and `recorded_programs`.
+
+    Media files are stored as `<media-root>/<service-id>/<program-id>/<id>/`
+    by `Recorder`, on any of the media volumes. The directory tree of each
+    volume is recorded in a manifest file under its root so that rescans only
+    list directories which have changed.
+
+    `Recorder` inserts a recorded program before moving its media file into
+    place, so documents inserted within the last `grace_seconds` are not
+    regarded as missing their media file.
+    """
+
+    def __init__(
+        self,
+        media_root: Union[str, Path] = ".",
+        db_host: Optional[str] = None,
+        db_name: str = "jadio",
+        manifest_path: Optional[Union[str, Path]] = None,
+        num_workers: int = 8,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+        grace_seconds: float = 3600.0,
+    ) -> None:
+        super().__init__(db_host, db_name)
+        self._volumes = MediaVolumes(media_root, media_volumes)
+        self._manifest_paths = {
+            name: self._volumes.root(name) / MANIFEST_NAME
+            for name in self._volumes.names
+        }
+        if manifest_path:
+            self._manifest_paths[DEFAULT_VOLUME] = Path(manifest_path)
+        self._num_workers = num_workers
+        self._grace_seconds = grace_seconds
+
+    def _load_manifest(self, manifest_path: Path) -> Dict[str, Any]:
+        if not manifest_path.exists():
+            return {}
+        try:
+            with open(manifest_path, "r") as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Failed to load manifest {manifest_path}: {err}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("dirs", {})
+
+    def _save_manifest(self, manifest_path: Path, dirs: Dict[str, Any]) -> None:
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "dirs": dirs,
+        }
+        tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+        with open(tmp_path, "w") as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp_path, manifest_path)
+
+    def _scan_tree(self, volume: str, full: bool) -> Tuple[Dict[str, Any], int]:
+        manifest_path = self._manifest_paths[volume]
+        cached_dirs = {} if full else self._load_manifest(manifest_path)
+        program_dirs = []
+        for service_entry in _list_dir(self._volumes.root(volume)):
+            if not service_entry.is_dir():
+                continue
+            for program_entry in _list_dir(Path(service_entry.path)):
+                if program_entry.is_dir():
+                    key = f"{service_entry.name}/{program_entry.name}"
+                    program_dirs.append((key, Path(program_entry.path)))
+
+        dirs = {}
+        num_stats = 0
+        with concurrent.futures.ThreadPoolExecutor(self._num_workers) as executor:
+            futures = {
+                executor.submit(
+                    _scan_program_dir, path, cached_dirs.get(key), full
+                ): key
+                for key, path in program_dirs
+            }
+            for future in concurrent.futures.as_completed(futures):
+                dirs[futures[future]], n = future.result()
+                num_stats += n
+        self._save_manifest(manifest_path, dirs)
+        return dirs, num_stats
+
+    def _restore_orphan(self, volume: str, path: Path) -> Optional[ObjectId]:
+        try:
+            object_id = ObjectId(path.name)
+            with open(path / "program.json", "r") as fh:
+                program = Program.from_json(fh.read()).to_dict()
+        except (InvalidId, OSError, ValueError, KeyError) as err:
+            logger.warning(f"Cannot restore {path}: {err}")
+            return None
+        if not list(path.glob("media.*")):
+            logger.warning(f"Cannot restore {path}: media file is not found")
+            return None
+        program["_id"] = object_id
+        program[VOLUME_KEY] = volume
+        try:
+            self.db.recorded_programs.insert_one(program)
+        except pymongo.errors.DuplicateKeyError:
+            logger.warning(f"Cannot restore {path}: {object_id} is already recorded")
+            return None
+        return object_id
+
+    def scan(self, repair: bool = False, full: bool = False) -> MediaScanResult:
+        """Scans the media volumes and reconciles them with `recorded_programs`.
+
+        Args:
+            repair (bool): If True, orphans are restored to `recorded_programs`
+                from their `program.json`, and documents of `recorded_programs`
+                whose media file is missing are removed.
+            full (bool): If True, ignore the manifest and stat all files.
+        """
+        logger.info("Start: scan media")
+        ret = MediaScanResult()
+
+        dirs_by_volume = {}
+        for volume in self._volumes.names:
+            if not self._volumes.root(volume).is_dir():
+                logger.warning(f"Volume '{volume}' is not found")
+                continue
+            dirs_by_volume[volume], num_stats = self._scan_tree(volume, full)
+            ret.num_stats += num_stats
+
+        # (service_id, program_id, id) of media directories having media file
+        # on any volume
+        media_keys = set()
+        for dirs in dirs_by_volume.values():
+            for key, program_dir in dirs.items():
+                service_id, program_id = key.split("/", 1)
+                for name, entry in program_dir["objects"].items():
+                    ret.num_programs += 1
+                    ret.total_bytes += sum(f["size"] for f in entry["files"].values())
+                    if any(
+                        file_name.startswith("media.") for file_name in entry["files"]
+                    ):
+                        media_keys.add((service_id, program_id, name))
+
+        grace_cutoff = datetime.datetime.now(
+            datetime.timezone.utc
+        ) - datetime.timedelta(seconds=self._grace_seconds)
+        recorded_keys = set()
+        for program in self.db.recorded_programs.find(
+            {}, {"_id": 1, "service_id": 1, "program_id": 1}
+        ):
+            key = (program["service_id"], program["program_id"], str(program["_id"]))
+            recorded_keys.add(key)
+            if key in media_keys:
+                continue
+            if program["_id"].generation_time > grace_cutoff:
+                ret.recent.append(program["_id"])
+            else:
+                ret.missing.append(program["_id"])
+
+        orphan_volumes = []
+        for volume, dirs in dirs_by_volume.items():
+            for key, program_dir in dirs.items():
+                service_id, program_id = key.split("/", 1)
+                for name in program_dir["objects"]:
+                    if (service_id, program_id, name) not in recorded_keys:
+                        ret.orphans.append(self._volumes.root(volume) / key / name)
+                        orphan_volumes.append(volume)
+
+        if repair:
+            for volume, path in zip(orphan_volumes, ret.orphans):
+                object_id = self._restore_orphan(volume, path)
+                if object_id:
+                    ret.restored.append(object_id)
+            if ret.missing:
+                self.db.recorded_programs.delete_many({"_id": {"$in": ret.missing}})
+                ret.removed = list(ret.missing)
+
+        self._update_timestamp("scan_media")
+        logger.info(
+            f"Finish: scan media: {ret.num_programs} program(s), "
+            f"{ret.total_bytes / 1e9:.2f} GB, {ret.num_stats} stat(s), "
+            f"{len(ret.orphans)} orphan(s), {len(ret.missing)} missing"
+        )
+        return ret
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pymongo
+
+from ..media_volume import VOLUME_KEY, MediaVolumes
+from ..program_group import ProgramGroup
+from ..rate_limit import RateLimit
+from .base import DatabaseHandler
+from .recording import PROGRAM_KEYS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ServicePlan:
+    """Estimated workload of a program group for a radio service.
+
+    Attributes:
+        service_id (str): Service ID.
+        num_matched (int): Number of fetched programs matching the group.
+        num_recorded (int): Number of recorded programs matching the group.
+        num_reserved (int): Number of matched programs already reserved.
+        num_new (int): Number of matched programs to be newly reserved.
+        duration (float): Total duration of new programs in seconds.
+        bitrate (float): Historical size of media in bytes per second of
+            program duration. None if unknown.
+        estimated_bytes (float): Estimated size of new programs in bytes.
+        throughput (float): Download throughput of all recorders in bytes
+            per second. None if unknown.
+        estimated_seconds (float): Estimated time to download new programs.
+    """
+
+    service_id: str
+    num_matched: int = 0
+    num_recorded: int = 0
+    num_reserved: int = 0
+    num_new: int = 0
+    duration: float = 0.0
+    bitrate: Optional[float] = None
+    estimated_bytes: Optional[float] = None
+    throughput: Optional[float] = None
+    estimated_seconds: Optional[float] = None
+
+
+@dataclass
+class ProgramGroupPlan:
+    program_group: ProgramGroup
+    services: List[ServicePlan] = field(default_factory=list)
+
+
+class Planner(DatabaseHandler):
+    """Estimates the workload of program groups without writing anything.
+
+    The bitrate of each service is taken from the download statistics of
+    `Recorder` (`service_stats`), or from recorded media files under
+    `media_root` if there are no statistics. The throughput is taken from
+    the download statistics, limited by `RateLimit` of the service.
+    """
+
+    def __init__(
+        self,
+        rate_limits: Dict[str, RateLimit] = {},
+        media_root: Optional[Union[str, Path]] = None,
+        db_host: Optional[str] = None,
+        db_name: str = "jadio",
+        num_bitrate_samples: int = 20,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+    ) -> None:
+        super().__init__(db_host, db_name)
+        self._rate_limits = rate_limits
+        self._volumes = None
+        if media_root:
+            self._volumes = MediaVolumes(media_root, media_volumes)
+        self._num_bitrate_samples = num_bitrate_samples
+
+    def _sample_bitrate(self, service_id: str) -> Optional[float]:
+        if self._volumes is None:
+            return None
+        num_bytes, duration = 0, 0.0
+        programs = (
+            self.db.recorded_programs.find(
+                {"service_id": service_id, "duration": {"$gt": 0}},
+                {"program_id": 1, "duration": 1, VOLUME_KEY: 1},
+            )
+            .sort("_id", pymongo.DESCENDING)
+            .limit(self._num_bitrate_samples)
+        )
+        for program in programs:
+            found = self._volumes.find_media_path(
+                service_id,
+                program["program_id"],
+                str(program["_id"]),
+                volume=program.get(VOLUME_KEY),
+            )
+            if found:
+                num_bytes += os.path.getsize(found[1])
+                duration += program["duration"]
+        return num_bytes / duration if duration > 0 else None
+
+    def _estimate(self, plan: ServicePlan) -> None:
+        stats = self.db.service_stats.find_one({"service_id": plan.service_id}) or {}
+        if stats.get("downloaded_duration"):
+            plan.bitrate = stats["downloaded_bytes"] / stats["downloaded_duration"]
+        else:
+            plan.bitrate = self._sample_bitrate(plan.service_id)
+        if plan.bitrate is not None:
+            plan.estimated_bytes = plan.duration * plan.bitrate
+
+        rate_limit = self._rate_limits.get(plan.service_id) or RateLimit()
+        throughput = None
+        if stats.get("download_seconds"):
+            throughput = stats["downloaded_bytes"] / stats["download_seconds"]
+        if rate_limit.bytes_per_second:
+            throughput = min(throughput or math.inf, rate_limit.bytes_per_second)
+        if throughput:
+            plan.throughput = throughput * (rate_limit.max_concurrent_downloads or 1)
+
+        seconds = []
+        if plan.estimated_bytes is not None and plan.throughput:
+            seconds.append(plan.estimated_bytes / plan.throughput)
+        if rate_limit.requests_per_minute:
+            seconds.append(plan.num_new / rate_limit.requests_per_minute * 60.0)
+        if seconds:
+            plan.estimated_seconds = max(seconds)
+
+    def plan(self, program_group: ProgramGroup) -> ProgramGroupPlan:
+        """Evaluates a program group against fetched and recorded programs."""
+        query = program_group.query.to_mongo_format()
+        projection = {**{key: 1 for key in PROGRAM_KEYS}, "duration": 1}
+
+        def keys(collection: pymongo.collection.Collection) -> Dict[tuple, str]:
+            return {
+                tuple(program.get(k) for k in PROGRAM_KEYS): program["service_id"]
+                for program in collection.find(query, projection)
+            }
+
+        recorded_keys = keys(self.db.recorded_programs)
+        reserved_keys = keys(self.db.reserved_programs)
+
+        plans: Dict[str, ServicePlan] = {}
+        for service_id in recorded_keys.values():
+            plans.setdefault(service_id, ServicePlan(service_id)).num_recorded += 1
+        for program in self.db.fetched_programs.find(query, projection):
+            service_id = program["service_id"]
+            plan = plans.setdefault(service_id, ServicePlan(service_id))
+            plan.num_matched += 1
+            key = tuple(program.get(k) for k in PROGRAM_KEYS)
+            if key in recorded_keys:
+                continue
+            if key in reserved_keys:
+                plan.num_reserved += 1
+                continue
+            plan.num_new += 1
+            plan.duration += program.get("duration") or 0
+        for plan in plans.values():
+            self._estimate(plan)
+        return ProgramGroupPlan(
+            program_group, [plans[service_id] for service_id in sorted(plans)]
+        )
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import datetime
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from bson import ObjectId
+
+from ..program_group import ProgramGroup
+from .base import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+# Stages of query plans which scan an index.
+INDEX_STAGES = {"IXSCAN", "EXPRESS_IXSCAN", "IDHACK", "COUNT_SCAN", "DISTINCT_SCAN"}
+
+# Program groups and collections evaluated by `search_programs` and `feed_rss`.
+PROFILE_TARGETS = {
+    "search": ("enable_record", "fetched_programs"),
+    "feed": ("enable_feed", "recorded_programs"),
+}
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Returns the stages of a query plan from the root to the leaves."""
+    # slot based execution engine (MongoDB 5.0+) wraps the plan by "queryPlan"
+    plan = plan.get("queryPlan", plan)
+    ret = [plan["stage"]] if "stage" in plan else []
+    if "inputStage" in plan:
+        ret += _plan_stages(plan["inputStage"])
+    for input_stage in plan.get("inputStages", []):
+        ret += _plan_stages(input_stage)
+    return ret
+
+
+@dataclass
+class QueryProfile:
+    """Cost of the query of a program group.
+
+    Attributes:
+        program_group_id (`ObjectId`): ID of the program group.
+        title (str): Title of the program group, or its query if no title.
+        target (str): "search" or "feed".
+        execution_millis (int): Execution time of the query in milliseconds.
+        docs_examined (int): Number of documents examined.
+        keys_examined (int): Number of index keys examined.
+        num_returned (int): Number of documents returned.
+        index_used (bool): Whether the winning plan scans an index.
+        stages (list of str): Stages of the winning plan.
+    """
+
+    program_group_id: ObjectId
+    title: str
+    target: str
+    execution_millis: int = 0
+    docs_examined: int = 0
+    keys_examined: int = 0
+    num_returned: int = 0
+    index_used: bool = False
+    stages: List[str] = field(default_factory=list)
+
+    @property
+    def examined_per_returned(self) -> float:
+        return self.docs_examined / max(self.num_returned, 1)
+
+    def to_document(self, timestamp: datetime.datetime) -> Dict[str, Any]:
+        return {**self.__dict__, "timestamp": timestamp}
+
+
+class QueryProfiler(DatabaseHandler):
+    """Profiles the queries of program groups by `explain`.
+
+    The queries evaluated by `Recorder.search_programs` (against fetched
+    programs) or `Feeder.feed_rss` (against recorded programs) are explained
+    one by one, and ranked by execution time.
+    """
+
+    def profile(self, target: str = "search", save: bool = False) -> List[QueryProfile]:
+        """Profiles the queries of program groups.
+
+        Args:
+            target (str): "search" or "feed".
+            save (bool): If True, the profiles are saved to `query_profiles`
+                collection to track the trend.
+
+        Returns:
+            list of `QueryProfile`: Profiles from the most expensive one.
+        """
+        if target not in PROFILE_TARGETS:
+            raise ValueError(
+                f"'{target}' is not supported target. Please select "
+                + " or ".join(f"'{t}'" for t in PROFILE_TARGETS)
+            )
+        logger.info(f"Start: profile {target}")
+        enable_key, collection_name = PROFILE_TARGETS[target]
+        collection = getattr(self.db, collection_name)
+
+        ret = []
+        for program_group in self.db.program_groups.find({enable_key: True}):
+            object_id = program_group.pop("_id")
+            program_group = ProgramGroup.from_dict(program_group)
+            query = program_group.query.to_mongo_format()
+            explain = collection.find(query).explain()
+            stats = explain.get("executionStats", {})
+            winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+            stages = _plan_stages(winning_plan)
+            ret.append(
+                QueryProfile(
+                    program_group_id=object_id,
+                    title=program_group.title
+                    or program_group.query.to_json(ensure_ascii=False),
+                    target=target,
+                    execution_millis=stats.get("executionTimeMillis", 0),
+                    docs_examined=stats.get("totalDocsExamined", 0),
+                    keys_examined=stats.get("totalKeysExamined", 0),
+                    num_returned=stats.get("nReturned", 0),
+                    index_used=bool(INDEX_STAGES & set(stages)),
+                    stages=stages,
+                )
+            )
+        ret.sort(key=lambda p: (p.execution_millis, p.docs_examined), reverse=True)
+
+        if save and ret:
+            timestamp = datetime.datetime.now()
+            self.db.query_profiles.insert_many(
+                [profile.to_document(timestamp) for profile in ret]
+            )
+        self._update_timestamp(f"profile_{target}")
+        logger.info(f"Finish: profile {target}: {len(ret)} program group(s)")
+        return ret
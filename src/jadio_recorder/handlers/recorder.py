@@ -2,21 +2,115 @@ from __future__ import annotations
 
 import datetime
 import logging
-import shutil
 import tempfile
+import threading
+import time
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
+import pymongo
 import tqdm
-from jadio import Jadio, Program
+from jadio import Program
 
+from ..catalogue import CATALOGUE_PROJECTION, ProgramCatalogue
+from ..deadline import estimate_at_risk
 from ..program_group import ProgramGroup
-from ..program_query import ProgramQuery, queries_to_mongo_format
 from .base import DatabaseHandler
+from .recording import (
+    DEADLINE_PROJECTION,
+    DEADLINE_SORT,
+    EXISTING_FETCHED_PROGRAM_PROJECTION,
+    FAILED_QUERY,
+    LAST_FETCHED_SORT,
+    PROGRAM_KEYS_INDEX,
+    RETRY_SORT,
+    SEARCH_ENGINES,
+    RecorderServices,
+    active_lease_query,
+    at_risk_updates,
+    catalogue_search_query,
+    claim_query,
+    concurrency_limits,
+    deadline_program,
+    deadline_update,
+    default_worker_id,
+    existing_fetched_program_key,
+    expired_query,
+    expired_update,
+    fetched_programs_requests,
+    heartbeat_update,
+    high_water_mark,
+    is_modified_groups,
+    lease_update,
+    log_deadlines,
+    log_duplicate_programs,
+    log_failed,
+    log_throughput,
+    owner_query,
+    pending_query,
+    pop_queue_state,
+    recordable_query,
+    recorded_document,
+    reserved_program,
+    retry_update,
+    retry_wait_seconds,
+    retry_waiting_query,
+    search_query,
+    service_stats_update,
+    stale_reservations_query,
+)
 
 logger = logging.getLogger(__name__)
 
 
+class _LeaseHeartbeat(threading.Thread):
+    """Periodically extends the lease of a claimed reserved program.
+
+    The lease is extended while the (blocking) download is running so that
+    other recorders do not reclaim it. If the lease is taken over by another
+    recorder, `lost` is set.
+    """
+
+    def __init__(
+        self,
+        collection: pymongo.collection.Collection,
+        target_id: Any,
+        worker_id: str,
+        lease_seconds: float,
+    ) -> None:
+        super().__init__(daemon=True)
+        self._collection = collection
+        self._target_id = target_id
+        self._worker_id = worker_id
+        self._lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+        self.lost = False
+
+    def __enter__(self) -> _LeaseHeartbeat:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._stopped.set()
+        self.join()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._lease_seconds / 3):
+            now = datetime.datetime.now()
+            try:
+                result = self._collection.update_one(
+                    owner_query(self._target_id, self._worker_id),
+                    heartbeat_update(now, self._lease_seconds),
+                )
+            except pymongo.errors.PyMongoError as err:
+                logger.warning(f"Failed to extend lease of {self._target_id}: {err}")
+                continue
+            if result.matched_count == 0:
+                logger.warning(f"Lease of {self._target_id} was taken over")
+                self.lost = True
+                return
+
+
 class Recorder(DatabaseHandler):
     def __init__(
         self,
@@ -24,18 +118,49 @@ class Recorder(DatabaseHandler):
         media_root: Union[str, Path] = ".",
         db_host: Optional[str] = None,
         db_name: str = "jadio",
+        worker_id: Optional[str] = None,
+        lease_seconds: float = 600.0,
+        max_attempts: int = 5,
+        retry_backoff: float = 30.0,
+        max_retry_backoff: float = 86400.0,
+        max_retry_wait: float = 300.0,
+        hls_workers: int = 0,
+        search_index_path: Optional[Union[str, Path]] = None,
+        search_engine: str = "mongo",
+        catalogue_path: Optional[Union[str, Path]] = None,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+        placement: str = "most_free",
+        pins: Dict[str, str] = {},
     ) -> None:
+        if search_engine not in SEARCH_ENGINES:
+            raise ValueError(f"search_engine must be one of {SEARCH_ENGINES}.")
         super().__init__(db_host, db_name)
-        self._media_root = Path(media_root)
-        self._media_root.mkdir(parents=True, exist_ok=True)
-        self._service = Jadio(service_config)
+        self._services = RecorderServices(
+            service_config,
+            media_root,
+            hls_workers=hls_workers,
+            search_index_path=search_index_path,
+            media_volumes=media_volumes,
+            placement=placement,
+            pins=pins,
+        )
+        self._worker_id = worker_id or default_worker_id()
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._retry_backoff = retry_backoff
+        self._max_retry_backoff = max_retry_backoff
+        self._max_retry_wait = max_retry_wait
+        self._search_engine = search_engine
+        self._catalogue_path = catalogue_path
+        self._catalogue: Optional[ProgramCatalogue] = None
 
     def login(self) -> None:
-        self._service.login()
+        # services are logged in when programs are fetched or downloaded
+        self._create_program_indexes()
 
     def close(self) -> None:
         super().close()
-        self._service.close()
+        self._services.close()
 
     def insert_program_group(
         self,
@@ -72,91 +197,280 @@ class Recorder(DatabaseHandler):
             logger.info("Skipped: fetch_programs")
             return
 
-        programs = self._service.get_programs()
-        self.db.fetched_programs.delete_many({})
-        self.db.fetched_programs.insert_many([p.to_dict() for p in programs])
+        programs = self._services.get_programs()
+
+        # Keep first-seen and updated times of the programs fetched before
+        existing = dict(
+            existing_fetched_program_key(program)
+            for program in self.db.fetched_programs.find(
+                {}, EXISTING_FETCHED_PROGRAM_PROJECTION
+            )
+        )
+        requests = fetched_programs_requests(programs, existing, now)
+        if requests:
+            self.db.fetched_programs.bulk_write(requests, ordered=False)
 
         self._update_timestamp("fetch_programs")
         logger.info(f"Finish: fetch_programs: {len(programs)} programs")
 
-    def search_programs(self) -> List[Program]:
+    def _load_catalogue(self) -> ProgramCatalogue:
+        """Loads the catalogue of fetched programs, which is built again only
+        if programs have been fetched since it was built."""
+        timestamp = self.db.timestamp.find_one({"name": "fetch_programs"})
+        fetched_at = (timestamp or {}).get("timestamp")
+        if self._catalogue is not None and self._catalogue.fetched_at == fetched_at:
+            return self._catalogue
+        catalogue = None
+        if self._catalogue_path:
+            catalogue = ProgramCatalogue.load(self._catalogue_path, fetched_at)
+        if catalogue is None:
+            catalogue = ProgramCatalogue.from_documents(
+                self.db.fetched_programs.find({}, CATALOGUE_PROJECTION), fetched_at
+            )
+            if self._catalogue_path:
+                catalogue.save(self._catalogue_path)
+            logger.info(f"Build a catalogue of {len(catalogue)} fetched program(s)")
+        self._catalogue = catalogue
+        return catalogue
+
+    def _create_program_indexes(self) -> None:
+        for collection in [self.db.reserved_programs, self.db.recorded_programs]:
+            try:
+                collection.create_index(PROGRAM_KEYS_INDEX, unique=True)
+            except pymongo.errors.DuplicateKeyError as err:
+                # programs are still looked up by `PROGRAM_KEYS` before recording
+                log_duplicate_programs(collection.name, err)
+
+    def search_programs(self, full: bool = False) -> List[Program]:
+        """Reserves fetched programs matching program groups to be recorded.
+
+        Only programs fetched or updated since the last search are evaluated,
+        except for program groups which are new or modified since then.
+
+        Args:
+            full (bool): If True, evaluate all fetched programs.
+        """
         logger.info("Start: search_programs")
 
-        self.db.reserved_programs.delete_many({})
-        program_groups = list(self.db.program_groups.find({"enable_record": True}))
-        if len(program_groups) == 0:
-            return []
+        now = datetime.datetime.now()
         program_groups = [
-            ProgramGroup.from_dict(program_group) for program_group in program_groups
+            ProgramGroup.from_dict(program_group)
+            for program_group in self.db.program_groups.find({"enable_record": True})
         ]
-        query = queries_to_mongo_format(
-            [program_group.query for program_group in program_groups]
-        )
+        last_search = self.db.timestamp.find_one({"name": "search_programs"})
+        if self._search_engine == "numpy":
+            query, digests = catalogue_search_query(
+                self._load_catalogue(), program_groups, last_search, full=full
+            )
+        else:
+            query, digests = search_query(program_groups, last_search, full=full)
+        if is_modified_groups(digests, last_search):
+            result = self.db.reserved_programs.delete_many(
+                stale_reservations_query(program_groups, now)
+            )
+            if result.deleted_count:
+                logger.info(f"Remove {result.deleted_count} stale reservation(s)")
+        last_fetched = self.db.fetched_programs.find_one(sort=LAST_FETCHED_SORT)
+
         ret: List[Program] = []
-        for program in self.db.fetched_programs.find(query):
-            program.pop("_id")
-            find_keys = [
-                "service_id",
-                "station_id",
-                "program_id",
-                "episode_id",
-                "program_title",
-                "episode_title",
-            ]
-            find_query = {key: program[key] for key in find_keys}
-            if not self.db.reserved_programs.find_one(find_query):
-                if not self.db.recorded_programs.find_one(find_query):
+        if query is not None:
+            for program in self.db.fetched_programs.find(query):
+                find_query, program = reserved_program(program)
+                if self.db.recorded_programs.find_one(find_query):
+                    continue
+                result = self.db.reserved_programs.update_one(
+                    find_query, {"$setOnInsert": program}, upsert=True
+                )
+                if result.upserted_id is not None:
                     ret.append(Program.from_dict(program))
-                    self.db.reserved_programs.insert_one(program)
 
-        self._update_timestamp("search_programs")
+        self._update_timestamp(
+            "search_programs",
+            high_water_mark=high_water_mark(last_fetched),
+            group_digests=digests,
+        )
         logger.info(f"Finish: search_programs: {len(ret)} program(s)")
         return ret
 
+    def _get_saturated_service_ids(self, now: datetime.datetime) -> List[str]:
+        """Returns services whose programs are being downloaded by as many
+        recorders as `RateLimit.max_concurrent_downloads`.
+
+        The active leases are counted before claiming, so the limit is
+        best-effort: recorders claiming at the same time may exceed it.
+        """
+        return [
+            service_id
+            for service_id, max_downloads in concurrency_limits(
+                self._services.rate_limiters
+            ).items()
+            if self.db.reserved_programs.count_documents(
+                active_lease_query(service_id, now)
+            )
+            >= max_downloads
+        ]
+
+    def _claim_reserved_program(
+        self, query: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Atomically lease one reserved program matching `query`.
+
+        Programs whose lease has expired (e.g. the recorder holding it crashed)
+        are reclaimed. Programs waiting for retry backoff and failed programs
+        are not claimed.
+        """
+        now = datetime.datetime.now()
+        return self.db.reserved_programs.find_one_and_update(
+            claim_query(query, now, self._get_saturated_service_ids(now)),
+            lease_update(self._worker_id, now, self._lease_seconds),
+            sort=DEADLINE_SORT,
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+
+    def _schedule_by_deadline(self, query: Dict[str, Any]) -> None:
+        """Updates the deadlines of reserved programs matching `query`.
+
+        Programs whose deadline has passed are marked as failed, and programs
+        estimated not to be recorded before their deadline are flagged by
+        `at_risk`.
+        """
+        now = datetime.datetime.now()
+        self.db.reserved_programs.update_many(
+            pending_query(query), deadline_update(self._services.availability_days)
+        )
+        num_missed = self.db.reserved_programs.update_many(
+            {"$and": [query, expired_query(now)]}, expired_update()
+        ).modified_count
+
+        service_stats = {
+            stats["service_id"]: stats for stats in self.db.service_stats.find()
+        }
+        programs = [
+            deadline_program(program)
+            for program in self.db.reserved_programs.find(
+                pending_query(query), DEADLINE_PROJECTION
+            ).sort(DEADLINE_SORT)
+        ]
+        at_risk = estimate_at_risk(programs, service_stats, now)
+        self.db.reserved_programs.bulk_write(at_risk_updates(at_risk))
+        log_deadlines(len(programs), at_risk, num_missed)
+
+    def _retry_reserved_program(
+        self, target_id: Any, queue_state: Dict[str, Any], error: Exception
+    ) -> None:
+        """Release the lease of a reserved program which failed to be recorded.
+
+        The program is retried after exponential backoff, or marked as failed
+        once `max_attempts` is reached.
+        """
+        self.db.reserved_programs.update_one(
+            owner_query(target_id, self._worker_id),
+            retry_update(
+                target_id,
+                queue_state,
+                error,
+                self._max_attempts,
+                self._retry_backoff,
+                self._max_retry_backoff,
+            ),
+        )
+
+    def _wait_for_retry(self, query: Dict[str, Any]) -> bool:
+        """Wait for the earliest reserved program waiting for retry.
+
+        Returns False without waiting if there is no such program or it is not
+        eligible within `max_retry_wait` seconds.
+        """
+        now = datetime.datetime.now()
+        program = self.db.reserved_programs.find_one(
+            retry_waiting_query(query, now), sort=RETRY_SORT
+        )
+        if program is None:
+            return False
+        wait = retry_wait_seconds(program, now)
+        if wait > self._max_retry_wait:
+            return False
+        logger.info(f"Wait {wait:.0f} seconds to retry recording")
+        time.sleep(max(wait, 0.0))
+        return True
+
+    def _record_program(self, program: Program) -> None:
+        ext = self._services.media_suffix(program)
+        inserted_id = None
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                # download (record) media file to temporary dir
+                tmp_media_path = Path(tmp_dir) / f"media{ext}"
+                num_bytes, seconds = self._services.download(program, tmp_media_path)
+                self.db.service_stats.update_one(
+                    {"service_id": program.service_id},
+                    service_stats_update(program, num_bytes, seconds),
+                    upsert=True,
+                )
+
+                # insert recorded program to db
+                volume = self._services.place(program)
+                result = self.db.recorded_programs.insert_one(
+                    recorded_document(program, volume)
+                )
+                inserted_id = result.inserted_id
+                self._services.store(program, tmp_media_path, inserted_id, volume)
+        except Exception:
+            if inserted_id:
+                self.db.recorded_programs.delete_one({"_id": inserted_id})
+            raise
+
     def record_programs(self) -> List[Program]:
-        logger.info("Start: record_programs")
+        logger.info(f"Start: record_programs: worker {self._worker_id}")
 
-        # Only programs that have completed broadcasting can be downloaded.
-        lt_date = datetime.datetime.now() - datetime.timedelta(hours=2)
-        date_query = ProgramQuery(pub_date=[None, lt_date])
-        target_programs = self.db.reserved_programs.find(date_query.to_mongo_format())
+        date_query = recordable_query(datetime.datetime.now())
+        self._schedule_by_deadline(date_query)
 
         ret = []
-        for program in tqdm.tqdm(list(target_programs)):
+        progress = tqdm.tqdm(
+            total=self.db.reserved_programs.count_documents(date_query)
+        )
+        while True:
+            program = self._claim_reserved_program(date_query)
+            if program is None:
+                if self._wait_for_retry(date_query):
+                    continue
+                break
+            progress.update()
             target_id = program.pop("_id")
-            if not self.db.recorded_programs.find_one(program):
-                program = Program.from_dict(program)
-                ext = Path(self._service._get_default_file_path(program)).suffix
-                inserted_id = None
+            queue_state = pop_queue_state(program)
+            if self.db.recorded_programs.find_one(program):
+                self.db.reserved_programs.delete_one({"_id": target_id})
+                continue
+
+            program = Program.from_dict(program)
+            with _LeaseHeartbeat(
+                self.db.reserved_programs,
+                target_id,
+                self._worker_id,
+                self._lease_seconds,
+            ) as heartbeat:
                 try:
-                    with tempfile.TemporaryDirectory() as tmp_dir:
-                        # download (record) media file to temporary dir
-                        tmp_media_path = Path(tmp_dir) / f"media{ext}"
-                        self._service.download(program, str(tmp_media_path))
-
-                        # insert recorded program to db
-                        result = self.db.recorded_programs.insert_one(program.to_dict())
-                        inserted_id = result.inserted_id
-
-                        # move downloaded media file to specified media root
-                        save_root = self._media_root.joinpath(
-                            program.service_id, program.program_id, str(inserted_id)
-                        )
-                        save_root.mkdir(parents=True, exist_ok=True)
-                        shutil.move(str(tmp_media_path), str(save_root / f"media{ext}"))
-
-                        # save program information as JSON file
-                        with open(str(save_root / f"program.json"), "w") as fh:
-                            fh.write(program.to_json(indent=2, ensure_ascii=False))
-
-                        logger.debug(f"Save media and program file to {save_root}")
-                        ret.append(program)
+                    self._record_program(program)
+                    error = None
                 except Exception as err:
-                    if inserted_id:
-                        self.db.recorded_programs.delete_one({"_id": inserted_id})
                     logger.error(f"error: {err}\n{program}", stack_info=True)
-            self.db.reserved_programs.delete_one({"_id": target_id})
+                    error = err
+            if error is None:
+                ret.append(program)
+            if heartbeat.lost:
+                # another recorder owns the reservation now
+                continue
+            if error is None:
+                self.db.reserved_programs.delete_one(
+                    owner_query(target_id, self._worker_id)
+                )
+            else:
+                self._retry_reserved_program(target_id, queue_state, error)
+        progress.close()
 
+        log_failed(self.db.reserved_programs.count_documents(FAILED_QUERY))
+        log_throughput(self._services.rate_limiters)
         self._update_timestamp("record_programs")
         logger.info(f"Finish: record_programs: {len(ret)} program(s)")
         return ret
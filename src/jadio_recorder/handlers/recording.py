@@ -0,0 +1,702 @@
+"""Steps of recording programs shared by `Recorder` and `AsyncRecorder`.
+
+The queries, updates and other steps without I/O are plain functions, and the
+blocking operations of the services and media files are done by
+`RecorderServices`, so that the handlers only run them against the DB.
+"""
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import pymongo
+from jadio import Jadio, Program
+
+from ..catalogue import ProgramCatalogue
+from ..deadline import deadline_expression, split_availability_config
+from ..hls import HlsDownloader, HlsError
+from ..media_volume import VOLUME_KEY, MediaVolumes
+from ..program_group import ProgramGroup
+from ..program_query import FORMAT_VERSIONS, ProgramQuery, queries_to_mongo_format
+from ..radiko import RadikoPlaylistResolver
+from ..rate_limit import ServiceRateLimiter, split_service_config
+from ..search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Field of reserved program documents holding the work queue state.
+QUEUE_KEY = "queue"
+# Terminal state of reserved programs which failed to be recorded too many times.
+FAILED_STATE = "failed"
+# Query for reserved programs which failed to be recorded.
+FAILED_QUERY = {f"{QUEUE_KEY}.state": FAILED_STATE}
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def pop_queue_state(program: Dict[str, Any]) -> Dict[str, Any]:
+    return program.pop(QUEUE_KEY, None) or {}
+
+
+def recordable_query(now: datetime.datetime) -> Dict[str, Any]:
+    """Query for programs which can be downloaded: only programs that have
+    completed broadcasting."""
+    lt_date = now - datetime.timedelta(hours=2)
+    return ProgramQuery(pub_date=[None, lt_date]).to_mongo_format()
+
+
+def pending_query(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Query for reserved programs matching `query` which have not failed."""
+    return {"$and": [query, {f"{QUEUE_KEY}.state": {"$ne": FAILED_STATE}}]}
+
+
+def owner_query(target_id: Any, worker_id: str) -> Dict[str, Any]:
+    """Query for a reserved program leased by the worker."""
+    return {"_id": target_id, f"{QUEUE_KEY}.owner": worker_id}
+
+
+def unleased_query(now: datetime.datetime) -> Dict[str, Any]:
+    """Query for reserved programs which are not leased or whose lease has expired."""
+    return {
+        "$or": [
+            {f"{QUEUE_KEY}.owner": None},
+            {f"{QUEUE_KEY}.expires_at": {"$lt": now}},
+        ]
+    }
+
+
+def claimable_query(now: datetime.datetime) -> Dict[str, Any]:
+    """Query for reserved programs which can be claimed to be recorded now."""
+    return {
+        "$and": [
+            unleased_query(now),
+            {f"{QUEUE_KEY}.state": {"$ne": FAILED_STATE}},
+            {
+                "$or": [
+                    {f"{QUEUE_KEY}.next_attempt_at": None},
+                    {f"{QUEUE_KEY}.next_attempt_at": {"$lte": now}},
+                ]
+            },
+        ]
+    }
+
+
+def claim_query(
+    query: Dict[str, Any],
+    now: datetime.datetime,
+    saturated_service_ids: List[str],
+) -> Dict[str, Any]:
+    """Query for reserved programs matching `query` which can be claimed now,
+    except those of services downloading as many programs as their limits."""
+    conditions = [query, claimable_query(now)]
+    if saturated_service_ids:
+        conditions.append({"service_id": {"$nin": saturated_service_ids}})
+    return {"$and": conditions}
+
+
+def retry_waiting_query(
+    query: Dict[str, Any], now: datetime.datetime
+) -> Dict[str, Any]:
+    """Query for reserved programs matching `query` waiting for retry backoff."""
+    return {
+        "$and": [
+            query,
+            unleased_query(now),
+            {f"{QUEUE_KEY}.state": {"$ne": FAILED_STATE}},
+            {f"{QUEUE_KEY}.next_attempt_at": {"$gt": now}},
+        ]
+    }
+
+
+# Order of waiting for reserved programs waiting for retry backoff.
+RETRY_SORT = [(f"{QUEUE_KEY}.next_attempt_at", pymongo.ASCENDING)]
+
+
+def retry_wait_seconds(program: Dict[str, Any], now: datetime.datetime) -> float:
+    """Seconds until a program found by `retry_waiting_query` can be retried."""
+    return (program[QUEUE_KEY]["next_attempt_at"] - now).total_seconds()
+
+
+def concurrency_limits(rate_limiters: Dict[str, ServiceRateLimiter]) -> Dict[str, int]:
+    """`RateLimit.max_concurrent_downloads` of services limiting it."""
+    return {
+        service_id: rate_limiter.rate_limit.max_concurrent_downloads
+        for service_id, rate_limiter in rate_limiters.items()
+        if rate_limiter.rate_limit.max_concurrent_downloads
+    }
+
+
+def active_lease_query(service_id: str, now: datetime.datetime) -> Dict[str, Any]:
+    """Query for reserved programs of the service being recorded."""
+    return {
+        "service_id": service_id,
+        f"{QUEUE_KEY}.owner": {"$ne": None},
+        f"{QUEUE_KEY}.expires_at": {"$gte": now},
+    }
+
+
+# Order of claiming reserved programs: earliest deadline first.
+DEADLINE_SORT = [
+    (f"{QUEUE_KEY}.deadline", pymongo.ASCENDING),
+    ("pub_date", pymongo.ASCENDING),
+]
+# Fields of reserved programs needed to estimate whether they meet deadlines.
+DEADLINE_PROJECTION = {"service_id": 1, "duration": 1, f"{QUEUE_KEY}.deadline": 1}
+
+
+def deadline_update(availability_days: Dict[str, float]) -> List[Dict[str, Any]]:
+    return [{"$set": {f"{QUEUE_KEY}.deadline": deadline_expression(availability_days)}}]
+
+
+def deadline_program(program: Dict[str, Any]) -> Dict[str, Any]:
+    """Reserved program projected by `DEADLINE_PROJECTION` given to
+    `estimate_at_risk`."""
+    return {**program, "deadline": program[QUEUE_KEY].get("deadline")}
+
+
+def expired_query(now: datetime.datetime) -> Dict[str, Any]:
+    """Query for unleased reserved programs which can no longer be downloaded."""
+    return {
+        "$and": [
+            unleased_query(now),
+            {f"{QUEUE_KEY}.state": {"$ne": FAILED_STATE}},
+            {f"{QUEUE_KEY}.deadline": {"$lt": now}},
+        ]
+    }
+
+
+def expired_update() -> Dict[str, Any]:
+    return {
+        "$set": {
+            f"{QUEUE_KEY}.state": FAILED_STATE,
+            f"{QUEUE_KEY}.next_attempt_at": None,
+            f"{QUEUE_KEY}.last_error": "Expired: not available on the service anymore",
+        }
+    }
+
+
+def at_risk_updates(at_risk: List[Any]) -> List[pymongo.UpdateMany]:
+    return [
+        pymongo.UpdateMany(
+            {"_id": {"$in": at_risk}}, {"$set": {f"{QUEUE_KEY}.at_risk": True}}
+        ),
+        pymongo.UpdateMany(
+            {"_id": {"$nin": at_risk}, f"{QUEUE_KEY}.at_risk": True},
+            {"$set": {f"{QUEUE_KEY}.at_risk": False}},
+        ),
+    ]
+
+
+def log_deadlines(num_programs: int, at_risk: List[Any], num_missed: int) -> None:
+    message = (
+        f"Deadlines: {num_programs} reserved program(s), {len(at_risk)} at risk, "
+        f"{num_missed} missed"
+    )
+    if at_risk or num_missed:
+        logger.warning(message)
+    else:
+        logger.info(message)
+
+
+def lease_update(
+    worker_id: str, now: datetime.datetime, lease_seconds: float
+) -> Dict[str, Any]:
+    return {
+        "$set": {
+            f"{QUEUE_KEY}.owner": worker_id,
+            f"{QUEUE_KEY}.claimed_at": now,
+            f"{QUEUE_KEY}.heartbeat_at": now,
+            f"{QUEUE_KEY}.expires_at": now + datetime.timedelta(seconds=lease_seconds),
+        }
+    }
+
+
+def heartbeat_update(now: datetime.datetime, lease_seconds: float) -> Dict[str, Any]:
+    return {
+        "$set": {
+            f"{QUEUE_KEY}.expires_at": now + datetime.timedelta(seconds=lease_seconds),
+            f"{QUEUE_KEY}.heartbeat_at": now,
+        }
+    }
+
+
+def retry_delay(attempts: int, base: float, limit: float) -> datetime.timedelta:
+    """Exponential backoff: base, 2 * base, 4 * base, ... up to limit seconds."""
+    return datetime.timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), limit))
+
+
+def retry_update(
+    target_id: Any,
+    queue_state: Dict[str, Any],
+    error: Exception,
+    max_attempts: int,
+    retry_backoff: float,
+    max_retry_backoff: float,
+) -> Dict[str, Any]:
+    """Update releasing the lease of a reserved program which failed to be recorded.
+
+    The program is retried after exponential backoff, or marked as failed once
+    `max_attempts` is reached.
+    """
+    now = datetime.datetime.now()
+    attempts = queue_state.get("attempts", 0) + 1
+    update = {
+        f"{QUEUE_KEY}.owner": None,
+        f"{QUEUE_KEY}.expires_at": None,
+        f"{QUEUE_KEY}.attempts": attempts,
+        f"{QUEUE_KEY}.last_error": f"{type(error).__name__}: {error}",
+        f"{QUEUE_KEY}.last_attempt_at": now,
+    }
+    if attempts >= max_attempts:
+        update[f"{QUEUE_KEY}.state"] = FAILED_STATE
+        update[f"{QUEUE_KEY}.next_attempt_at"] = None
+        logger.error(f"Give up recording {target_id} after {attempts} attempts")
+    else:
+        backoff = retry_delay(attempts, retry_backoff, max_retry_backoff)
+        update[f"{QUEUE_KEY}.next_attempt_at"] = now + backoff
+        logger.info(f"Retry recording {target_id} in {backoff} ({attempts})")
+    return {"$set": update}
+
+
+def service_stats_update(
+    program: Program, num_bytes: int, seconds: float
+) -> Dict[str, Any]:
+    return {
+        "$inc": {
+            "downloads": 1,
+            "downloaded_bytes": num_bytes,
+            "download_seconds": seconds,
+            "downloaded_duration": program.duration or 0,
+        },
+        "$set": {"timestamp": datetime.datetime.now()},
+    }
+
+
+def download_media(
+    service: Jadio,
+    program: Program,
+    media_path: Path,
+    hls_downloader: Optional[HlsDownloader] = None,
+    resolve_playlist: Optional[
+        Callable[[Program], Optional[Tuple[str, Dict[str, str]]]]
+    ] = None,
+) -> None:
+    """Downloads the media file of a program by `hls_downloader` if
+    `resolve_playlist(program)` returns the URL and the HTTP headers of its HLS
+    playlist, and by the service otherwise or if the HLS download fails."""
+    if hls_downloader is not None and resolve_playlist is not None:
+        try:
+            playlist = resolve_playlist(program)
+            if playlist:
+                playlist_url, headers = playlist
+                hls_downloader.download(playlist_url, media_path, headers=headers)
+                return
+        except HlsError as err:
+            logger.warning(f"Download by the service instead of HLS: {err}")
+    service.download(program, str(media_path))
+
+
+def recorded_document(program: Program, volume: str) -> Dict[str, Any]:
+    """Document of `recorded_programs` of a program stored on `volume`."""
+    return {**program.to_dict(), VOLUME_KEY: volume}
+
+
+def save_program_files(save_root: Path, tmp_media_path: Path, program: Program) -> None:
+    # move downloaded media file to specified media root
+    save_root.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(tmp_media_path), str(save_root / tmp_media_path.name))
+
+    # save program information as JSON file
+    with open(str(save_root / "program.json"), "w") as fh:
+        fh.write(program.to_json(indent=2, ensure_ascii=False))
+
+    logger.debug(f"Save media and program file to {save_root}")
+
+
+def index_program(
+    search_index: Optional[SearchIndex], object_id: Any, program: Program
+) -> None:
+    # the index can be rebuilt by `jadio search`, so errors do not fail recording
+    if search_index is None:
+        return
+    try:
+        search_index.add(object_id, program.to_dict())
+    except Exception as err:
+        logger.warning(f"Failed to index {object_id}: {err}")
+
+
+def log_failed(num_failed: int) -> None:
+    if num_failed:
+        logger.warning(f"{num_failed} reserved program(s) failed to be recorded")
+
+
+def log_throughput(rate_limiters: Dict[str, ServiceRateLimiter]) -> None:
+    for service_id, rate_limiter in sorted(rate_limiters.items()):
+        if rate_limiter.num_downloads == 0:
+            continue
+        throughput = rate_limiter.throughput
+        logger.info(
+            f"Throughput: {service_id}: {rate_limiter.num_downloads} download(s), "
+            f"{rate_limiter.downloaded_bytes / 1e6:.1f} MB in "
+            f"{rate_limiter.download_seconds:.1f} s "
+            f"({(throughput or 0) / 1e3:.1f} KB/s), "
+            f"waited {rate_limiter.waited_seconds:.1f} s for rate limits"
+        )
+
+
+# Keys identifying a program in fetched, reserved and recorded programs.
+PROGRAM_KEYS = [
+    "service_id",
+    "station_id",
+    "program_id",
+    "episode_id",
+    "program_title",
+    "episode_title",
+]
+# Unique index of reserved and recorded programs on `PROGRAM_KEYS`, so that a
+# program is reserved and recorded only once even by concurrent recorders.
+PROGRAM_KEYS_INDEX = [(key, pymongo.ASCENDING) for key in PROGRAM_KEYS]
+
+
+def log_duplicate_programs(collection_name: str, err: Exception) -> None:
+    """Logs that `PROGRAM_KEYS_INDEX` cannot be created on a collection holding
+    the same program more than once (e.g. recorded by older versions)."""
+    logger.error(
+        f"Skip the unique index of {collection_name}, which has duplicate programs."
+        " Programs may be recorded twice by concurrent recorders until the"
+        f" duplicates are removed: {err}"
+    )
+
+
+# Field of fetched program documents holding when the program was first fetched
+# and last updated, which are used by `search_programs` to only evaluate new or
+# updated programs.
+FETCH_KEY = "fetch"
+
+# Engines to evaluate program groups against fetched programs in
+# `search_programs`: queries of MongoDB or `ProgramCatalogue` by NumPy.
+SEARCH_ENGINES = ["mongo", "numpy"]
+
+
+def json_digest(data: Any) -> str:
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, default=str, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+def reserved_program(program: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Query by `PROGRAM_KEYS` and document of a fetched program to be reserved.
+
+    The program is reserved by an upsert of the document by the query, so that
+    it is reserved only once even by concurrent recorders.
+    """
+    program.pop("_id")
+    program.pop(FETCH_KEY, None)
+    return {key: program[key] for key in PROGRAM_KEYS}, program
+
+
+# Order of fetched programs from the last fetched or updated one.
+LAST_FETCHED_SORT = [(f"{FETCH_KEY}.updated_at", pymongo.DESCENDING)]
+
+
+def high_water_mark(last_fetched: Optional[Dict[str, Any]]) -> Any:
+    """When the last fetched program found by `LAST_FETCHED_SORT` was updated."""
+    return (last_fetched or {}).get(FETCH_KEY, {}).get("updated_at")
+
+
+def fetched_programs_requests(
+    programs: Iterable[Program],
+    existing: Dict[Tuple[Any, ...], Tuple[Any, Optional[str]]],
+    now: datetime.datetime,
+) -> List[Any]:
+    """Bulk write requests to replace fetched programs with `programs`.
+
+    Args:
+        programs (iterable of `Program`): Programs fetched from services.
+        existing (dict): `(_id, digest)` of the fetched programs in the DB
+            keyed by values of `PROGRAM_KEYS`.
+        now (`datetime.datetime`): Time when the programs were fetched.
+    """
+    ret = []
+    fetched_keys = set()
+    for program in programs:
+        program = program.to_dict()
+        key = tuple(program[k] for k in PROGRAM_KEYS)
+        if key in fetched_keys:
+            continue
+        fetched_keys.add(key)
+        digest = json_digest(program)
+        if key not in existing:
+            program[FETCH_KEY] = {
+                "digest": digest,
+                "first_seen_at": now,
+                "updated_at": now,
+            }
+            ret.append(pymongo.InsertOne(program))
+            continue
+        object_id, prev_digest = existing[key]
+        if digest != prev_digest:
+            program[f"{FETCH_KEY}.digest"] = digest
+            program[f"{FETCH_KEY}.updated_at"] = now
+            ret.append(pymongo.UpdateOne({"_id": object_id}, {"$set": program}))
+    # programs which are no longer provided by services
+    stale_ids = [
+        object_id for key, (object_id, _) in existing.items() if key not in fetched_keys
+    ]
+    if stale_ids:
+        ret.append(pymongo.DeleteMany({"_id": {"$in": stale_ids}}))
+    return ret
+
+
+def existing_fetched_program_key(
+    program: Dict[str, Any]
+) -> Tuple[Tuple[Any, ...], Tuple[Any, Optional[str]]]:
+    key = tuple(program.get(k) for k in PROGRAM_KEYS)
+    return key, (program["_id"], program.get(FETCH_KEY, {}).get("digest"))
+
+
+# Projection of fetched programs given to `existing_fetched_program_key`.
+EXISTING_FETCHED_PROGRAM_PROJECTION = {
+    **{key: 1 for key in PROGRAM_KEYS},
+    f"{FETCH_KEY}.digest": 1,
+}
+
+
+def query_digest(query: ProgramQuery) -> str:
+    """Digest of `query` identifying whether its program group has been
+    searched, including `FORMAT_VERSIONS` of the conditions it uses."""
+    data = query.to_dict(encode_json=True)
+    versions = {key: FORMAT_VERSIONS[key] for key in data if key in FORMAT_VERSIONS}
+    if versions:
+        data = {"query": data, "format_versions": versions}
+    return json_digest(data)
+
+
+def partition_queries(
+    program_groups: List[ProgramGroup],
+    last_search: Optional[Dict[str, Any]],
+    full: bool = False,
+) -> Tuple[List[ProgramQuery], List[ProgramQuery], List[str]]:
+    """Partitions the queries of `program_groups` by whether they have been
+    evaluated by the last search.
+
+    Returns:
+        tuple: The queries which are new or modified since the last search, the
+        queries evaluated by the last search and the digests of the queries of
+        `program_groups`.
+    """
+    digests = [query_digest(program_group.query) for program_group in program_groups]
+    last_search = last_search or {}
+    searched_digests = set(last_search.get("group_digests", []))
+    if full or last_search.get("high_water_mark") is None:
+        searched_digests = set()
+
+    new_queries, searched_queries = [], []
+    for program_group, digest in zip(program_groups, digests):
+        if digest in searched_digests:
+            searched_queries.append(program_group.query)
+        else:
+            new_queries.append(program_group.query)
+    return new_queries, searched_queries, digests
+
+
+def search_query(
+    program_groups: List[ProgramGroup],
+    last_search: Optional[Dict[str, Any]],
+    full: bool = False,
+) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """Query for fetched programs to be evaluated by `search_programs`.
+
+    Programs which have been fetched or updated since the last search are
+    evaluated against all program groups, and all programs are evaluated
+    against program groups which are new or modified since the last search.
+
+    Returns:
+        tuple: The query (None if nothing is to be evaluated) and the digests
+        of the queries of `program_groups`.
+    """
+    new_queries, searched_queries, digests = partition_queries(
+        program_groups, last_search, full=full
+    )
+    high_water_mark = (last_search or {}).get("high_water_mark")
+    conditions = []
+    if new_queries:
+        conditions.append(queries_to_mongo_format(new_queries))
+    if searched_queries:
+        conditions.append(
+            {
+                "$and": [
+                    {f"{FETCH_KEY}.updated_at": {"$gt": high_water_mark}},
+                    queries_to_mongo_format(searched_queries),
+                ]
+            }
+        )
+    if not conditions:
+        return None, digests
+    return {"$or": conditions}, digests
+
+
+def catalogue_search_query(
+    catalogue: ProgramCatalogue,
+    program_groups: List[ProgramGroup],
+    last_search: Optional[Dict[str, Any]],
+    full: bool = False,
+) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """Same as `search_query`, but the queries are evaluated by `catalogue`
+    and the returned query finds the matched programs by their IDs."""
+    new_queries, searched_queries, digests = partition_queries(
+        program_groups, last_search, full=full
+    )
+    high_water_mark = (last_search or {}).get("high_water_mark")
+    object_ids = catalogue.find(new_queries)
+    if searched_queries:
+        object_ids += catalogue.find(searched_queries, updated_after=high_water_mark)
+    if not object_ids:
+        return None, digests
+    return {"_id": {"$in": object_ids}}, digests
+
+
+def is_modified_groups(
+    digests: List[str], last_search: Optional[Dict[str, Any]]
+) -> bool:
+    """Whether program groups have been modified or removed since the last
+    search."""
+    return set(digests) != set((last_search or {}).get("group_digests", []))
+
+
+def stale_reservations_query(
+    program_groups: List[ProgramGroup], now: datetime.datetime
+) -> Dict[str, Any]:
+    """Query for reserved programs which no longer match any program group."""
+    conditions = [unleased_query(now), {f"{QUEUE_KEY}.attempts": None}]
+    if program_groups:
+        conditions.append(
+            {"$nor": [queries_to_mongo_format([g.query for g in program_groups])]}
+        )
+    return {"$and": conditions}
+
+
+class LazyLogin:
+    """Logs in to the services on first use instead of on `__enter__`, so that
+    runs which neither fetch nor download programs do not log in. Thread-safe.
+    """
+
+    def __init__(self, service: Jadio) -> None:
+        self._service = service
+        self._lock = threading.Lock()
+        self.logged_in = False
+
+    def ensure(self) -> None:
+        with self._lock:
+            if self.logged_in:
+                return
+            start = time.monotonic()
+            self._service.login()
+            logger.info(f"Login to services in {time.monotonic() - start:.1f} s")
+            self.logged_in = True
+
+
+class RecorderServices:
+    """Radio services, media volumes and the search index used to record
+    programs, configured by the arguments of `Recorder`.
+
+    The methods are blocking, so `AsyncRecorder` runs them in worker threads.
+    """
+
+    def __init__(
+        self,
+        service_config: Dict[str, str] = {},
+        media_root: Union[str, Path] = ".",
+        hls_workers: int = 0,
+        search_index_path: Optional[Union[str, Path]] = None,
+        media_volumes: Dict[str, Union[str, Path]] = {},
+        placement: str = "most_free",
+        pins: Dict[str, str] = {},
+    ) -> None:
+        self.volumes = MediaVolumes(media_root, media_volumes, placement, pins)
+        self.volumes.mkdirs()
+        service_config, rate_limits = split_service_config(service_config)
+        service_config, self.availability_days = split_availability_config(
+            service_config
+        )
+        self.service = Jadio(service_config)
+        self.login = LazyLogin(self.service)
+        self.rate_limiters = {
+            service_id: ServiceRateLimiter(rate_limits.get(service_id))
+            for service_id in set(service_config) | set(rate_limits)
+        }
+        self._hls_downloader = None
+        self._hls_resolver = None
+        if hls_workers > 0:
+            self._hls_downloader = HlsDownloader(hls_workers)
+            self._hls_resolver = RadikoPlaylistResolver()
+        self._search_index = None
+        if search_index_path:
+            self._search_index = SearchIndex(search_index_path)
+
+    def close(self) -> None:
+        if self.login.logged_in:
+            self.service.close()
+        if self._search_index is not None:
+            self._search_index.close()
+
+    def get_rate_limiter(self, service_id: str) -> ServiceRateLimiter:
+        if service_id not in self.rate_limiters:
+            self.rate_limiters[service_id] = ServiceRateLimiter()
+        return self.rate_limiters[service_id]
+
+    def get_programs(self) -> List[Program]:
+        # Jadio fetches programs from all services at once
+        self.login.ensure()
+        for rate_limiter in self.rate_limiters.values():
+            rate_limiter.request()
+        return self.service.get_programs()
+
+    def media_suffix(self, program: Program) -> str:
+        return Path(self.service._get_default_file_path(program)).suffix
+
+    def download(self, program: Program, media_path: Path) -> Tuple[int, float]:
+        """Downloads the media file of a program within its rate limits.
+
+        Returns:
+            tuple: The size of the media file in bytes and the seconds taken.
+        """
+        self.login.ensure()
+        rate_limiter = self.get_rate_limiter(program.service_id)
+        with rate_limiter.download():
+            start = time.monotonic()
+            download_media(
+                self.service,
+                program,
+                media_path,
+                self._hls_downloader,
+                self._hls_resolver.resolve if self._hls_resolver else None,
+            )
+            seconds = time.monotonic() - start
+        num_bytes = media_path.stat().st_size
+        rate_limiter.record_download(num_bytes, seconds)
+        return num_bytes, seconds
+
+    def place(self, program: Program) -> str:
+        return self.volumes.place(program.service_id, program.program_id)
+
+    def store(
+        self, program: Program, tmp_media_path: Path, object_id: Any, volume: str
+    ) -> None:
+        """Moves a downloaded media file of a recorded program to its volume."""
+        save_root = self.volumes.media_dir(
+            program.service_id, program.program_id, object_id, volume
+        )
+        save_program_files(save_root, tmp_media_path, program)
+        index_program(self._search_index, object_id, program)
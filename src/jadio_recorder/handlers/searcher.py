@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from ..media_volume import MediaVolumes
+from ..search_index import SearchHit, SearchIndex
+from .base import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+
+class Searcher(DatabaseHandler):
+    """Searches recorded programs by the full-text index.
+
+    The index at `index_path` is synchronized with `recorded_programs` before
+    searching, so that programs recorded by any recorder are found.
+    """
+
+    def __init__(
+        self,
+        index_path: Union[str, Path],
+        media_root: Union[str, Path] = ".",
+        db_host: Optional[str] = None,
+        db_name: str = "jadio",
+        media_volumes: Dict[str, Union[str, Path]] = {},
+    ) -> None:
+        super().__init__(db_host, db_name)
+        self._index = SearchIndex(index_path)
+        self._volumes = MediaVolumes(media_root, media_volumes)
+
+    def close(self) -> None:
+        super().close()
+        self._index.close()
+
+    def sync(self, full: bool = False) -> int:
+        num_programs = self._index.sync(self.db.recorded_programs, full=full)
+        self._update_timestamp("sync_search_index")
+        logger.info(f"Index {num_programs} recorded program(s)")
+        return num_programs
+
+    def search(
+        self,
+        keywords: str,
+        limit: int = 20,
+        service_ids: Optional[List[str]] = None,
+    ) -> List[SearchHit]:
+        return self._index.search(keywords, limit=limit, service_ids=service_ids)
+
+    def get_media_path(self, hit: SearchHit) -> Optional[Path]:
+        found = self._volumes.find_media_path(
+            hit.service_id, hit.program_id, hit.object_id
+        )
+        return found[1] if found else None
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import logging
+import re
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+__all__ = [
+    "HlsDownloader",
+    "HlsError",
+    "MediaPlaylist",
+    "parse_master_playlist",
+    "parse_media_playlist",
+]
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of output files to which segments are written as they are. Segments
+# are remuxed by ffmpeg for the other suffixes (e.g. ".m4a", ".mp4").
+RAW_SUFFIXES = {".aac", ".ts"}
+
+_ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class HlsError(Exception):
+    pass
+
+
+def _parse_attributes(text: str) -> Dict[str, str]:
+    return {key: value.strip('"') for key, value in _ATTRIBUTE_PATTERN.findall(text)}
+
+
+@dataclass
+class MediaPlaylist:
+    """Media playlist of HLS.
+
+    Attributes:
+        url (str): URL of the playlist.
+        segments (list of str): Absolute URLs of the media segments.
+        durations (list of float): Durations of the media segments in seconds.
+        init_segment (str): Absolute URL of the initialization segment
+            (EXT-X-MAP), or None.
+        ended (bool): Whether the playlist has EXT-X-ENDLIST, i.e. the program
+            is not being broadcast anymore.
+        encrypted (bool): Whether the segments are encrypted (EXT-X-KEY).
+    """
+
+    url: str
+    segments: List[str] = field(default_factory=list)
+    durations: List[float] = field(default_factory=list)
+    init_segment: Optional[str] = None
+    ended: bool = False
+    encrypted: bool = False
+
+    @property
+    def duration(self) -> float:
+        return sum(self.durations)
+
+
+def parse_master_playlist(text: str, base_url: str) -> List[Tuple[int, str]]:
+    """Parses a master playlist.
+
+    Returns:
+        list of (int, str): Bandwidths and absolute URLs of the variant streams.
+    """
+    ret = []
+    bandwidth = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            attributes = _parse_attributes(line.split(":", 1)[1])
+            bandwidth = int(attributes.get("BANDWIDTH", 0))
+        elif line and not line.startswith("#") and bandwidth is not None:
+            ret.append((bandwidth, urllib.parse.urljoin(base_url, line)))
+            bandwidth = None
+    return ret
+
+
+def parse_media_playlist(text: str, base_url: str) -> MediaPlaylist:
+    """Parses a media playlist."""
+    lines = [line.strip() for line in text.splitlines()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise HlsError(f"Not a HLS playlist: {base_url}")
+    ret = MediaPlaylist(base_url)
+    duration = None
+    for line in lines[1:]:
+        if line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0])
+        elif line.startswith("#EXT-X-KEY:"):
+            method = _parse_attributes(line.split(":", 1)[1]).get("METHOD")
+            ret.encrypted = method != "NONE"
+        elif line.startswith("#EXT-X-MAP:"):
+            uri = _parse_attributes(line.split(":", 1)[1])["URI"]
+            ret.init_segment = urllib.parse.urljoin(base_url, uri)
+        elif line == "#EXT-X-ENDLIST":
+            ret.ended = True
+        elif line and not line.startswith("#"):
+            ret.segments.append(urllib.parse.urljoin(base_url, line))
+            ret.durations.append(duration or 0.0)
+            duration = None
+    return ret
+
+
+class HlsDownloader:
+    """Downloads a HLS stream by fetching its segments concurrently.
+
+    Segments are fetched by `num_workers` threads, and written to the output
+    file in order of the playlist as soon as they are fetched. At most
+    `2 * num_workers` segments are held in memory, so the whole program is
+    never buffered. Segments are written as they are for `RAW_SUFFIXES`, and
+    remuxed by ffmpeg (`-c copy`) for the other suffixes.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 8,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0,
+        timeout: float = 30.0,
+        ffmpeg: str = "ffmpeg",
+    ) -> None:
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be positive: {num_workers}")
+        self._num_workers = num_workers
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._timeout = timeout
+        self._ffmpeg = ffmpeg
+
+    def _fetch(self, url: str, headers: Dict[str, str]) -> bytes:
+        attempt = 0
+        while True:
+            try:
+                request = urllib.request.Request(url, headers=headers)
+                with urllib.request.urlopen(request, timeout=self._timeout) as res:
+                    return res.read()
+            except (urllib.error.URLError, OSError) as err:
+                # client errors (e.g. 403 of an expired token) are not retried
+                is_client_error = (
+                    isinstance(err, urllib.error.HTTPError) and err.code < 500
+                )
+                if is_client_error or attempt >= self._max_retries:
+                    raise HlsError(f"Failed to fetch {url}: {err}") from err
+                wait = self._retry_backoff * 2**attempt
+                logger.debug(f"Retry fetching {url} in {wait:.1f} s: {err}")
+            time.sleep(wait)
+            attempt += 1
+
+    def resolve(
+        self, playlist_url: str, headers: Optional[Dict[str, str]] = None
+    ) -> MediaPlaylist:
+        """Fetches the media playlist, choosing the variant stream of the
+        highest bandwidth if `playlist_url` is a master playlist."""
+        headers = headers or {}
+        text = self._fetch(playlist_url, headers).decode("utf-8")
+        variants = parse_master_playlist(text, playlist_url)
+        if variants:
+            playlist_url = max(variants)[1]
+            text = self._fetch(playlist_url, headers).decode("utf-8")
+        return parse_media_playlist(text, playlist_url)
+
+    def _iter_segments(
+        self, playlist: MediaPlaylist, headers: Dict[str, str]
+    ) -> Iterator[bytes]:
+        urls = list(playlist.segments)
+        if playlist.init_segment:
+            urls.insert(0, playlist.init_segment)
+        with ThreadPoolExecutor(self._num_workers) as executor:
+            futures: Deque[Future] = collections.deque()
+            try:
+                for url in urls:
+                    futures.append(executor.submit(self._fetch, url, headers))
+                    if len(futures) >= 2 * self._num_workers:
+                        yield futures.popleft().result()
+                while futures:
+                    yield futures.popleft().result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    @contextlib.contextmanager
+    def _open_output(self, output_path: Path) -> Iterator[IO[bytes]]:
+        if output_path.suffix in RAW_SUFFIXES:
+            with open(output_path, "wb") as fh:
+                yield fh
+            return
+
+        command = [self._ffmpeg, "-y", "-loglevel", "error", "-i", "pipe:0"]
+        command += ["-c", "copy", str(output_path)]
+        # stderr goes to a file, since ffmpeg blocks writing to a full pipe
+        # which is not read while segments are written to stdin
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=stderr)
+            try:
+                yield process.stdin
+                process.stdin.close()
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+            if process.wait() != 0:
+                stderr.seek(0)
+                message = stderr.read().decode("utf-8", errors="replace")
+                raise HlsError(f"ffmpeg failed ({process.returncode}): {message}")
+
+    def download(
+        self,
+        playlist_url: str,
+        output_path: Union[str, Path],
+        headers: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """Downloads a HLS stream to a file.
+
+        Args:
+            playlist_url (str): URL of the master or media playlist.
+            output_path (str or `Path`): Output file path.
+            headers (dict): HTTP headers of all requests (e.g. auth tokens).
+
+        Returns:
+            int: Number of downloaded bytes of the segments.
+
+        Raises:
+            HlsError: If the stream cannot be downloaded completely.
+        """
+        headers = headers or {}
+        output_path = Path(output_path)
+        playlist = self.resolve(playlist_url, headers)
+        if not playlist.ended:
+            raise HlsError(f"Playlist has no EXT-X-ENDLIST: {playlist.url}")
+        if playlist.encrypted:
+            raise HlsError(f"Encrypted segments are not supported: {playlist.url}")
+        if not playlist.segments:
+            raise HlsError(f"Playlist has no segments: {playlist.url}")
+
+        num_segments = num_bytes = 0
+        start = time.monotonic()
+        with self._open_output(output_path) as fh:
+            for data in self._iter_segments(playlist, headers):
+                if not data:
+                    raise HlsError(f"Empty segment #{num_segments}: {playlist.url}")
+                fh.write(data)
+                num_segments += 1
+                num_bytes += len(data)
+        num_expected = len(playlist.segments) + bool(playlist.init_segment)
+        if num_segments != num_expected:
+            raise HlsError(
+                f"Downloaded {num_segments} of {num_expected} segments: "
+                f"{playlist.url}"
+            )
+        logger.debug(
+            f"Download {num_segments} segments ({playlist.duration:.0f} s, "
+            f"{num_bytes / 1e6:.1f} MB) in {time.monotonic() - start:.1f} s "
+            f"to {output_path}"
+        )
+        return num_bytes
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+__all__ = ["DEFAULT_VOLUME", "PLACEMENT_POLICIES", "VOLUME_KEY", "MediaVolumes"]
+
+logger = logging.getLogger(__name__)
+
+# Name of the volume at `media_root`, to which programs recorded before
+# volumes were introduced belong.
+DEFAULT_VOLUME = "default"
+
+# Key of the volume of a program in `recorded_programs`.
+VOLUME_KEY = "media_volume"
+
+# Policies to place programs on volumes: the volume with the most free space,
+# volumes in turn, or only the volumes pinned to services or programs (the
+# default volume otherwise). Pinned volumes take precedence in all policies.
+PLACEMENT_POLICIES = ["most_free", "round_robin", "pinned"]
+
+
+class MediaVolumes:
+    """Media roots spread over volumes (e.g. disks).
+
+    Programs are stored as `<volume-root>/<service-id>/<program-id>/<id>/` on
+    a volume chosen by `place`, and the name of the volume is recorded in
+    `recorded_programs` as `VOLUME_KEY`. Media files of the default volume are
+    served at `<http-host>/media/` and those of the others at
+    `<http-host>/volumes/<name>/`.
+
+    Args:
+        media_root (str or `Path`): Root of the default volume.
+        volumes (dict): Roots of the other volumes by name.
+        policy (str): One of `PLACEMENT_POLICIES`.
+        pins (dict): Volume names by service ID or `<service-id>/<program-id>`.
+    """
+
+    def __init__(
+        self,
+        media_root: Union[str, Path] = ".",
+        volumes: Dict[str, Union[str, Path]] = {},
+        policy: str = "most_free",
+        pins: Dict[str, str] = {},
+    ) -> None:
+        if policy not in PLACEMENT_POLICIES:
+            raise ValueError(f"policy must be one of {PLACEMENT_POLICIES}.")
+        if DEFAULT_VOLUME in volumes:
+            raise ValueError(f"'{DEFAULT_VOLUME}' is reserved for media_root.")
+        self._roots = {DEFAULT_VOLUME: Path(media_root)}
+        self._roots.update({name: Path(root) for name, root in volumes.items()})
+        for key, name in pins.items():
+            if name not in self._roots:
+                raise ValueError(f"Volume '{name}' pinned to '{key}' is not found.")
+        self._policy = policy
+        self._pins = dict(pins)
+        self._cycle = itertools.cycle(list(self._roots))
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._roots)
+
+    def root(self, name: Optional[str] = None) -> Path:
+        return self._roots[name or DEFAULT_VOLUME]
+
+    def mkdirs(self) -> None:
+        for root in self._roots.values():
+            root.mkdir(parents=True, exist_ok=True)
+
+    def _most_free(self) -> str:
+        ret, max_free = DEFAULT_VOLUME, -1
+        for name, root in self._roots.items():
+            try:
+                free = shutil.disk_usage(root).free
+            except OSError as err:
+                logger.warning(f"Cannot get free space of volume '{name}': {err}")
+                continue
+            if free > max_free:
+                ret, max_free = name, free
+        return ret
+
+    def place(self, service_id: str, program_id: str) -> str:
+        """Chooses the volume to store a program on."""
+        pinned = self._pins.get(f"{service_id}/{program_id}")
+        pinned = pinned or self._pins.get(service_id)
+        if pinned:
+            return pinned
+        if self._policy == "pinned" or len(self._roots) == 1:
+            return DEFAULT_VOLUME
+        if self._policy == "round_robin":
+            with self._lock:
+                return next(self._cycle)
+        return self._most_free()
+
+    def media_dir(
+        self,
+        service_id: str,
+        program_id: str,
+        object_id: str,
+        volume: Optional[str] = None,
+    ) -> Path:
+        return self.root(volume).joinpath(service_id, program_id, str(object_id))
+
+    def find_media_dir(
+        self,
+        service_id: str,
+        program_id: str,
+        object_id: str,
+        volume: Optional[str] = None,
+    ) -> Optional[Tuple[str, Path]]:
+        """Finds the directory of a recorded program on its volume, or on the
+        other volumes if it is not found there (e.g. it has been moved).
+
+        Returns:
+            tuple: The name of the volume and the directory, or None.
+        """
+        volume = volume if volume in self._roots else DEFAULT_VOLUME
+        for name in [volume] + [name for name in self._roots if name != volume]:
+            media_dir = self.media_dir(service_id, program_id, object_id, name)
+            if media_dir.is_dir():
+                return name, media_dir
+        return None
+
+    def find_media_path(
+        self,
+        service_id: str,
+        program_id: str,
+        object_id: str,
+        volume: Optional[str] = None,
+    ) -> Optional[Tuple[str, Path]]:
+        """Same as `find_media_dir`, but returns the media file."""
+        found = self.find_media_dir(service_id, program_id, object_id, volume)
+        if found is None:
+            return None
+        name, media_dir = found
+        media_paths = list(media_dir.glob("media.*"))
+        return (name, media_paths[0]) if media_paths else None
+
+    def url_path(self, name: Optional[str] = None) -> str:
+        """Path of the URL serving media files of a volume."""
+        if (name or DEFAULT_VOLUME) == DEFAULT_VOLUME:
+            return "media/"
+        return f"volumes/{name}/"
@@ -2,13 +2,27 @@ from __future__ import annotations
 
 import copy
 import datetime as dt
+import email.utils
 import logging
 import os
+import re
 import urllib
 import urllib.parse
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from xml.sax.saxutils import escape, quoteattr
 
 import feedgen.entry
 import feedgen.feed
@@ -18,11 +32,31 @@ from dataclasses_json import DataClassJsonMixin
 from jadio import Program
 from mutagen import mp3, mp4
 
+from .media_volume import VOLUME_KEY, MediaVolumes
 from .program_category import ProgramCategory
 from .program_group import ProgramGroup
 
 RADIKO_LINK = "https://radiko.jp/"
 
+# Fields of recorded programs needed to create podcast items.
+FEED_ITEM_FIELDS = [
+    "service_id",
+    "station_id",
+    "program_id",
+    "episode_id",
+    "episode_title",
+    "pub_date",
+    "description",
+    "duration",
+    "link_url",
+    "image_url",
+    "is_video",
+    VOLUME_KEY,
+]
+
+# Characters which are not allowed in XML 1.0.
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
 logger = logging.getLogger(__name__)
 
 
@@ -49,11 +83,13 @@ def _fix_pub_data(pub_date: dt.datetime, zone: str = "Asia/Tokyo") -> str:
     return pub_date.replace(tzinfo=pytz.timezone(zone))
 
 
-def _path_to_enclosure_url(path: Path, path_root: Path, base_url: str) -> str:
+def _path_to_enclosure_url(
+    path: Path, path_root: Path, base_url: str, url_path: str = "media/"
+) -> str:
     url = os.path.relpath(str(path.absolute()), str(path_root))
     url = urllib.parse.quote(url)
     # TODO: fix join method
-    return urllib.parse.urljoin(base_url, "media/" + url)
+    return urllib.parse.urljoin(base_url, url_path + url)
 
 
 def _path_to_enclosure_length(path: Path) -> int:
@@ -62,6 +98,24 @@ def _path_to_enclosure_length(path: Path) -> int:
     return os.path.getsize(str(path.absolute()))
 
 
+def default_sort_by(station_ids: List[str], service_ids: List[str]) -> str:
+    """Selects the key to sort programs of a feed by.
+
+    Args:
+        station_ids (list of str): Station IDs of the programs.
+        service_ids (list of str): Service IDs of the programs.
+    """
+    if len(set(station_ids)) > 1:
+        # do not sort by episode_id because multiple platforms may be mixed
+        return "pub_date"
+    elif service_ids and service_ids[0] in ["onsen.ag", "hibiki-radio.jp"]:
+        # if platform is onsen.ag or hibiki-radio.jp, it is best to sort by episode_id.
+        return "episode_id"
+    # if station_id is unified with stations of radiko.jp,
+    # it is best to sort by pub_date.
+    return "pub_date"
+
+
 def _path_to_enclosure_type(path: Path, is_video: bool) -> str:
     if ".mp3" == path.suffix:
         return "audio/mpeg"
@@ -88,10 +142,13 @@ class Enclosure(DataClassJsonMixin):
         is_video: bool,
         base_url: str,
         media_root: Path,
+        url_path: str = "media/",
     ) -> Enclosure:
         path = Path(path)
         return cls(
-            url=_path_to_enclosure_url(path, media_root, base_url=base_url),
+            url=_path_to_enclosure_url(
+                path, media_root, base_url=base_url, url_path=url_path
+            ),
             length=_path_to_enclosure_length(path),
             type=_path_to_enclosure_type(path, is_video),
         )
@@ -103,6 +160,40 @@ class ItunesCategory(DataClassJsonMixin):
     sub: Optional[str] = None
 
 
+def _document_media(
+    document: Dict[str, Any],
+    base_url: str,
+    media_root: Union[Path, MediaVolumes],
+) -> Tuple[Enclosure, int]:
+    """Enclosure and duration (seconds) of the media file of a document of
+    `recorded_programs` having `FEED_ITEM_FIELDS` and `_id`.
+
+    The media file is looked up on the volume of the document first, and then
+    on the other volumes of `media_root`.
+    """
+    volumes = media_root
+    if not isinstance(volumes, MediaVolumes):
+        volumes = MediaVolumes(media_root)
+    found = volumes.find_media_path(
+        document["service_id"],
+        document["program_id"],
+        str(document["_id"]),
+        volume=document.get(VOLUME_KEY),
+    )
+    if found is None:
+        raise FileNotFoundError(f"Media file of {document['_id']} is not found")
+    volume, media_path = found
+    duration = document.get("duration") or _media_path_to_duration(media_path)
+    enclosure = Enclosure.from_path(
+        media_path,
+        document.get("is_video", False),
+        base_url,
+        volumes.root(volume),
+        url_path=volumes.url_path(volume),
+    )
+    return enclosure, int(duration)
+
+
 @dataclass
 class PodcastItem(DataClassJsonMixin):
     """
@@ -136,24 +227,35 @@ class PodcastItem(DataClassJsonMixin):
         program: Program,
         object_id: ObjectId,
         base_url: str,
-        media_root: Path,
+        media_root: Union[Path, MediaVolumes],
     ) -> PodcastItem:
-        media_dir = media_root.joinpath(
-            program.service_id, program.program_id, str(object_id)
-        )
-        media_path = list((media_dir).glob("media.*"))[0]
-        duration = program.duration or _media_path_to_duration(media_path)
+        document = {
+            key: getattr(program, key)
+            for key in FEED_ITEM_FIELDS
+            if hasattr(program, key)
+        }
+        document["_id"] = object_id
+        return cls.from_document(document, base_url, media_root)
+
+    @classmethod
+    def from_document(
+        cls,
+        document: Dict[str, Any],
+        base_url: str,
+        media_root: Union[Path, MediaVolumes],
+    ) -> PodcastItem:
+        """Creates an item from a document of `recorded_programs` having
+        `FEED_ITEM_FIELDS` and `_id`."""
+        enclosure, duration = _document_media(document, base_url, media_root)
         return cls(
-            title=program.episode_title,
-            enclosure=Enclosure.from_path(
-                media_path, program.is_video, base_url, media_root
-            ),
-            guid=str(program.episode_id),
-            pub_date=program.pub_date,
-            description=program.description,
-            itunes_duration=int(duration),
-            link=program.link_url,
-            itunes_image=program.image_url,
+            title=document.get("episode_title"),
+            enclosure=enclosure,
+            guid=str(document.get("episode_id")),
+            pub_date=document.get("pub_date"),
+            description=document.get("description"),
+            itunes_duration=duration,
+            link=document.get("link_url"),
+            itunes_image=document.get("image_url"),
         )
 
     def set_feed_entry(self, entry: feedgen.entry.FeedEntry) -> None:
@@ -181,6 +283,89 @@ class PodcastItem(DataClassJsonMixin):
         entry.podcast.itunes_block(self.itunes_block)
 
 
+def _xml_text(value: Any) -> str:
+    return escape(_INVALID_XML_CHARS.sub("", str(value)))
+
+
+def _xml_attr(value: Any) -> str:
+    return quoteattr(_INVALID_XML_CHARS.sub("", str(value)))
+
+
+class PodcastItemRecord(NamedTuple):
+    """Compact version of `PodcastItem` for feeds of recorded programs.
+
+    It is created directly from a document of `recorded_programs` and written
+    as the same `<item>` element as `PodcastItem.set_feed_entry` without
+    feedgen, so that items of large feeds do not hold dataclasses and lxml
+    elements.
+    """
+
+    title: Optional[str]
+    enclosure_url: str
+    enclosure_length: int
+    enclosure_type: str
+    guid: str
+    pub_date: Optional[dt.datetime]
+    description: Optional[str]
+    itunes_duration: int
+    link: Optional[str]
+    itunes_image: Optional[str]
+
+    @classmethod
+    def from_document(
+        cls,
+        document: Dict[str, Any],
+        base_url: str,
+        media_root: Union[Path, MediaVolumes],
+        image_url_mapper: Optional[Callable[[Optional[str]], Optional[str]]] = None,
+    ) -> PodcastItemRecord:
+        """Same as `PodcastItem.from_document`."""
+        enclosure, duration = _document_media(document, base_url, media_root)
+        image_url = document.get("image_url")
+        return cls(
+            title=document.get("episode_title"),
+            enclosure_url=enclosure.url,
+            enclosure_length=enclosure.length,
+            enclosure_type=enclosure.type,
+            guid=str(document.get("episode_id")),
+            pub_date=document.get("pub_date"),
+            description=document.get("description"),
+            itunes_duration=duration,
+            link=document.get("link_url"),
+            itunes_image=image_url_mapper(image_url) if image_url_mapper else image_url,
+        )
+
+    def to_rss(self, pretty: bool = False) -> str:
+        """Returns the `<item>` element in the order written by feedgen."""
+        elements = []
+        if self.title is not None:
+            elements.append(f"<title>{_xml_text(self.title)}</title>")
+        elements += [
+            f"<link>{_xml_text(self.link or RADIKO_LINK)}</link>",
+            f"<description>{_xml_text(self.description or ' ')}</description>",
+            f'<guid isPermaLink="false">{_xml_text(self.guid)}</guid>',
+            f"<enclosure url={_xml_attr(self.enclosure_url)} "
+            f'length="{self.enclosure_length}" '
+            f"type={_xml_attr(self.enclosure_type)}/>",
+        ]
+        if self.pub_date is not None:
+            pub_date = email.utils.format_datetime(_fix_pub_data(self.pub_date))
+            elements.append(f"<pubDate>{pub_date}</pubDate>")
+        elements.append("<itunes:block>no</itunes:block>")
+        if self.itunes_image:
+            elements.append(f"<itunes:image href={_xml_attr(self.itunes_image)}/>")
+        elements += [
+            # written by feedgen as a string, so even if 0
+            f"<itunes:duration>{self.itunes_duration}</itunes:duration>",
+            "<itunes:explicit>no</itunes:explicit>",
+            "<itunes:episodeType>full</itunes:episodeType>",
+        ]
+        if pretty:
+            children = "".join(f"      {element}\n" for element in elements)
+            return f"    <item>\n{children}    </item>\n"
+        return f"<item>{''.join(elements)}</item>"
+
+
 @dataclass
 class PodcastChannel(DataClassJsonMixin):
     """
@@ -262,13 +447,41 @@ class PodcastChannel(DataClassJsonMixin):
 
 
 class PodcastRssFeedGenCreator:
+    """Creates RSS feeds of podcast.
+
+    Args:
+        base_url (str): Base URL of media files.
+        media_root (str, `Path` or `MediaVolumes`): Root directory or volumes of
+            media files.
+        image_url_mapper (callable): Maps image URLs of the channel and items
+            (e.g. to the URLs of cached artworks by `ArtworkCache`).
+    """
+
     def __init__(
         self,
         base_url: str,
-        media_root: Union[str, Path],
+        media_root: Union[str, Path, MediaVolumes],
+        image_url_mapper: Optional[Callable[[Optional[str]], Optional[str]]] = None,
     ) -> None:
         self.base_url = base_url
-        self.media_root = Path(media_root)
+        if not isinstance(media_root, MediaVolumes):
+            media_root = MediaVolumes(media_root)
+        self.media_root = media_root
+        self.image_url_mapper = image_url_mapper
+
+    def _create_channel(self, program_group: ProgramGroup) -> PodcastChannel:
+        channel = PodcastChannel.from_program_group(program_group)
+        if self.image_url_mapper:
+            channel.itunes_image = self.image_url_mapper(channel.itunes_image)
+        return channel
+
+    def _set_feed_entry(
+        self, item: PodcastItem, feed_generator: feedgen.feed.FeedGenerator
+    ) -> None:
+        if self.image_url_mapper:
+            item.itunes_image = self.image_url_mapper(item.itunes_image)
+        # item order has been already controled
+        item.set_feed_entry(feed_generator.add_entry(order="append"))
 
     def create(
         self,
@@ -285,16 +498,11 @@ class PodcastRssFeedGenCreator:
                     f"'{sort_by}' is not supported sort_by. "
                     "Please select 'pub_date' or 'eposode_id'"
                 )
-        elif len(set(program.station_id for program, _ in program_and_id_pairs)) > 1:
-            # do not sort by episode_id because multiple platforms may be mixed
-            sort_by = "pub_date"
-        elif program_and_id_pairs[0][0].service_id in ["onsen.ag", "hibiki-radio.jp"]:
-            # if platform is onsen.ag or hibiki-radio.jp, it is best to sort by episode_id.
-            sort_by = "episode_id"
         else:
-            # if station_id is unified with stations of radiko.jp,
-            # it is best to sort by pub_date.
-            sort_by = "pub_date"
+            sort_by = default_sort_by(
+                [program.station_id for program, _ in program_and_id_pairs],
+                [program.service_id for program, _ in program_and_id_pairs],
+            )
         program_and_id_pairs = sorted(
             program_and_id_pairs,
             key=lambda x: getattr(x[0], sort_by),
@@ -321,7 +529,7 @@ class PodcastRssFeedGenCreator:
             program_and_id_pairs = unique_pairs
 
         # create channel of RSS feed
-        channel = PodcastChannel.from_program_group(program_group)
+        channel = self._create_channel(program_group)
 
         # create items of RSS feed
         feed_generator = channel.to_feed_generator()
@@ -330,9 +538,41 @@ class PodcastRssFeedGenCreator:
                 item = PodcastItem.from_program(
                     program, object_id, self.base_url, self.media_root
                 )
-                # item order has been already controled
-                item.set_feed_entry(feed_generator.add_entry(order="append"))
+                self._set_feed_entry(item, feed_generator)
             except Exception as err:
                 logger.error(f"error: {err}\n{program}", stack_info=True)
 
         return feed_generator
+
+    def iter_rss_from_documents(
+        self,
+        program_group: ProgramGroup,
+        documents: Iterable[Dict[str, Any]],
+        pretty: bool = True,
+    ) -> Iterator[bytes]:
+        """Streams the RSS feed of documents of `recorded_programs` which have
+        been already sorted and de-duplicated (e.g. by `Feeder`).
+
+        Only the channel is created by feedgen, and each item is written from a
+        `PodcastItemRecord` as soon as it is created, which gives the same items
+        as `PodcastItem` with much less memory and time per item.
+        """
+        channel = self._create_channel(program_group).to_feed_generator()
+        data = channel.rss_str(pretty=pretty)
+        end = data.rindex(b"</channel>")
+        if pretty:
+            yield data[:end].rstrip(b" ")
+        else:
+            yield data[:end]
+        for document in documents:
+            try:
+                item = PodcastItemRecord.from_document(
+                    document,
+                    self.base_url,
+                    self.media_root,
+                    image_url_mapper=self.image_url_mapper,
+                )
+                yield item.to_rss(pretty=pretty).encode("utf-8")
+            except Exception as err:
+                logger.error(f"error: {err}\n{document}", stack_info=True)
+        yield (b"  " if pretty else b"") + data[end:]
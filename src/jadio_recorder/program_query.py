@@ -16,6 +16,12 @@ __all__ = [
 ]
 
 
+# Versions of how `ProgramQuery.to_mongo_format` matches programs by each
+# condition. Bumping a version changes the digests of the program groups using
+# the condition, so that they are searched again against all fetched programs.
+FORMAT_VERSIONS = {"duration": 1, "is_video": 1}
+
+
 def _to_list(x: Union[T, List[T]]) -> List[T]:
     return [x] if not isinstance(x, list) else x
 
@@ -86,7 +92,7 @@ class ProgramQuery(DataClassJsonMixin):
                 and_cond.append({key: {"$gte": queries[0], "$lt": queries[1]}})
         if self.duration:
             key = "duration"
-            queries = _to_list(self.pub_date)
+            queries = _to_list(self.duration)
             if len(queries) > 2:
                 raise ValueError(f"len({key}) must be less than 2.")
             if len(queries) == 1:
@@ -94,11 +100,13 @@ class ProgramQuery(DataClassJsonMixin):
             elif queries[0] is None and queries[1] is None:
                 pass
             elif queries[0] is None:
-                and_cond.append({key: {"$lt": queries[0]}})
+                and_cond.append({key: {"$lt": queries[1]}})
             elif queries[1] is None:
                 and_cond.append({key: {"$gte": queries[0]}})
             else:
                 and_cond.append({key: {"$gte": queries[0], "$lt": queries[1]}})
+        if self.is_video is not None:
+            and_cond.append({"is_video": {"$in": _to_list(self.is_video)}})
         if self.keywords:
             queries = _to_list(self.keywords)
             keys = ["performers", "guests"]
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import base64
+import datetime as dt
+import logging
+import secrets
+import threading
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Optional, Tuple
+
+from .hls import HlsError
+
+__all__ = [
+    "RADIKO_SERVICE_ID",
+    "RadikoPlaylistResolver",
+]
+
+logger = logging.getLogger(__name__)
+
+RADIKO_SERVICE_ID = "radiko.jp"
+API_ROOT = "https://radiko.jp"
+# Public key of the HTML5 player of radiko, a part of which is sent by auth2.
+AUTH_KEY = "bcd151073c03b352e1ef2fd66c32209da9ca0afa"
+_AUTH_HEADERS = {
+    "X-Radiko-App": "pc_html5",
+    "X-Radiko-App-Version": "0.0.1",
+    "X-Radiko-Device": "pc",
+    "X-Radiko-User": "dummy_user",
+}
+_TIME_FORMAT = "%Y%m%d%H%M%S"
+# Time zone of the times of time-free programs.
+_JST = dt.timezone(dt.timedelta(hours=9))
+
+
+class RadikoPlaylistResolver:
+    """Resolves the HLS playlist of a radiko time-free program.
+
+    jadio downloads radiko programs without exposing their playlists, so the
+    playlist is resolved as done by the HTML5 player of radiko: an auth token
+    of the area of this host is issued by auth1/auth2, and the time-free
+    playlist URL of the station is found in its stream list. Programs of
+    stations outside the area (i.e. area-free of radiko premium) cannot be
+    resolved, and are downloaded by jadio.
+    """
+
+    def __init__(self, api_root: str = API_ROOT, timeout: float = 30.0) -> None:
+        self._api_root = api_root.rstrip("/")
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._playlist_create_urls: Dict[str, Optional[str]] = {}
+
+    def _request(self, path: str, headers: Dict[str, str]) -> Tuple[bytes, Any]:
+        request = urllib.request.Request(self._api_root + path, headers=headers)
+        with urllib.request.urlopen(request, timeout=self._timeout) as res:
+            return res.read(), res.headers
+
+    def _authorize(self) -> Tuple[str, str]:
+        """Issues an auth token.
+
+        Returns:
+            tuple: The auth token and the area ID (e.g. "JP13").
+        """
+        _, headers = self._request("/v2/api/auth1", _AUTH_HEADERS)
+        token = headers["X-Radiko-AuthToken"]
+        offset = int(headers["X-Radiko-KeyOffset"])
+        length = int(headers["X-Radiko-KeyLength"])
+        partial_key = base64.b64encode(AUTH_KEY[offset : offset + length].encode())
+        body, _ = self._request(
+            "/v2/api/auth2",
+            {
+                **_AUTH_HEADERS,
+                "X-Radiko-AuthToken": token,
+                "X-Radiko-PartialKey": partial_key.decode(),
+            },
+        )
+        area_id = body.decode("utf-8").strip().split(",")[0]
+        return token, area_id
+
+    def _playlist_create_url(self, station_id: str) -> Optional[str]:
+        with self._lock:
+            if station_id in self._playlist_create_urls:
+                return self._playlist_create_urls[station_id]
+        body, _ = self._request(
+            f"/v3/station/stream/pc_html5/{urllib.parse.quote(station_id)}.xml", {}
+        )
+        ret = None
+        for url in ET.fromstring(body).iter("url"):
+            if url.get("timefree") == "1" and url.get("areafree") == "0":
+                ret = url.findtext("playlist_create_url")
+                break
+        with self._lock:
+            self._playlist_create_urls[station_id] = ret
+        return ret
+
+    def resolve(self, program: Any) -> Optional[Tuple[str, Dict[str, str]]]:
+        """Resolves the HLS playlist of a program.
+
+        Returns:
+            tuple: The URL and the HTTP headers of the playlist, or None if
+            `program` is not a radiko program.
+
+        Raises:
+            HlsError: If the playlist cannot be resolved.
+        """
+        if program.service_id != RADIKO_SERVICE_ID or not program.duration:
+            return None
+        try:
+            playlist_create_url = self._playlist_create_url(program.station_id)
+            if playlist_create_url is None:
+                raise HlsError(f"No time-free stream of {program.station_id}")
+            token, area_id = self._authorize()
+        except (OSError, KeyError, ValueError, ET.ParseError) as err:
+            raise HlsError(f"Failed to resolve the radiko playlist: {err}") from err
+
+        pub_date = program.pub_date
+        if pub_date.tzinfo is not None:
+            pub_date = pub_date.astimezone(_JST)
+        start = pub_date.strftime(_TIME_FORMAT)
+        end = pub_date + dt.timedelta(seconds=program.duration)
+        end = end.strftime(_TIME_FORMAT)
+        params = {
+            "station_id": program.station_id,
+            "start_at": start,
+            "ft": start,
+            "seek": start,
+            "end_at": end,
+            "to": end,
+            "l": 15,
+            "lsid": secrets.token_hex(16),
+            "type": "b",
+        }
+        url = f"{playlist_create_url}?{urllib.parse.urlencode(params)}"
+        logger.debug(f"Resolve HLS playlist of {program.station_id} in {area_id}")
+        return url, {"X-Radiko-AuthToken": token, "X-Radiko-AreaId": area_id}
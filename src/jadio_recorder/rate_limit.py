@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import contextlib
+import copy
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from dataclasses_json import DataClassJsonMixin
+
+__all__ = [
+    "RateLimit",
+    "ServiceRateLimiter",
+    "TokenBucket",
+    "split_service_config",
+]
+
+# Key of the rate limit settings in each service config of `service.json`.
+RATE_LIMIT_KEY = "rate_limit"
+
+
+class TokenBucket:
+    """Thread-safe token bucket.
+
+    Tokens are refilled at `rate` per second up to `capacity`. Consuming more
+    tokens than available blocks until the deficit has been refilled, so a
+    single request larger than `capacity` is also allowed.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError(f"rate must be positive: {rate}")
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else rate
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated_at) * self._rate
+        )
+        self._updated_at = now
+
+    def consume(self, amount: float = 1.0) -> float:
+        """Consume tokens and block until they are available.
+
+        Returns:
+            float: Seconds waited.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            wait = max(0.0, -self._tokens) / self._rate
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+@dataclass
+class RateLimit(DataClassJsonMixin):
+    """Rate limit settings of a radio service.
+
+    Attributes:
+        max_concurrent_downloads (int): Max number of programs of the service
+            downloaded at the same time by all recorders sharing the DB. It is
+            strict within a recorder, but best-effort across recorders: they
+            count the active leases of the service before claiming, so that
+            recorders claiming at the same time may exceed it.
+        bytes_per_second (float): Max average download throughput in bytes.
+        requests_per_minute (float): Max number of requests (fetching programs
+            and downloading) per minute.
+    """
+
+    max_concurrent_downloads: Optional[int] = None
+    bytes_per_second: Optional[float] = None
+    requests_per_minute: Optional[float] = None
+
+
+class ServiceRateLimiter:
+    """Applies `RateLimit` of a radio service and observes its throughput."""
+
+    def __init__(self, rate_limit: Optional[RateLimit] = None) -> None:
+        self.rate_limit = rate_limit or RateLimit()
+        self._requests = None
+        if self.rate_limit.requests_per_minute:
+            self._requests = TokenBucket(
+                self.rate_limit.requests_per_minute / 60.0, capacity=1.0
+            )
+        self._semaphore = None
+        if self.rate_limit.max_concurrent_downloads:
+            self._semaphore = threading.BoundedSemaphore(
+                self.rate_limit.max_concurrent_downloads
+            )
+
+        self.num_downloads = 0
+        self.downloaded_bytes = 0
+        self.download_seconds = 0.0
+        self.waited_seconds = 0.0
+
+    def request(self) -> None:
+        if self._requests is not None:
+            self.waited_seconds += self._requests.consume()
+
+    @contextlib.contextmanager
+    def download(self) -> Iterator[None]:
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            self.request()
+            yield
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def record_download(self, num_bytes: int, seconds: float) -> None:
+        """Records the result of a download and paces the next one."""
+        self.num_downloads += 1
+        self.downloaded_bytes += num_bytes
+        self.download_seconds += seconds
+        if self.rate_limit.bytes_per_second:
+            # Jadio downloads a whole file at once, so the bandwidth limit is
+            # applied as the average throughput by delaying the next download
+            # for the time the download was faster than the limit.
+            wait = max(0.0, num_bytes / self.rate_limit.bytes_per_second - seconds)
+            if wait > 0:
+                time.sleep(wait)
+            self.waited_seconds += wait
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Observed throughput in bytes per second."""
+        if self.download_seconds <= 0:
+            return None
+        return self.downloaded_bytes / self.download_seconds
+
+
+def split_service_config(
+    service_config: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Dict[str, RateLimit]]:
+    """Splits the rate limit settings from the service config given to `Jadio`."""
+    service_config = copy.deepcopy(service_config)
+    rate_limits = {}
+    for service_id, config in service_config.items():
+        if isinstance(config, dict) and RATE_LIMIT_KEY in config:
+            rate_limits[service_id] = RateLimit.from_dict(config.pop(RATE_LIMIT_KEY))
+    return service_config, rate_limits
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import datetime
+import re
+import sqlite3
+import threading
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from bson import ObjectId
+
+__all__ = ["SearchHit", "SearchIndex"]
+
+# Runs of ASCII alphanumerics (words) or of the other letters (e.g. Japanese)
+# in normalized text.
+_WORD_PATTERN = re.compile(r"[0-9a-z]+|[^\W0-9a-z_]+")
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+# Weights of the "title", "people" and "text" columns for bm25.
+_COLUMN_WEIGHTS = (10.0, 5.0, 1.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS programs (
+    id INTEGER PRIMARY KEY,
+    object_id TEXT UNIQUE NOT NULL,
+    service_id TEXT,
+    station_id TEXT,
+    program_id TEXT,
+    program_title TEXT,
+    episode_title TEXT,
+    pub_date TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS programs_fts USING fts5(
+    title, people, text, tokenize = 'unicode61 remove_diacritics 0'
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _tokenize(text: str) -> List[str]:
+    """Splits text into ASCII words and bigrams of the other letters.
+
+    Japanese text has no spaces between words, so it is indexed by overlapping
+    bigrams, which match any keyword of two or more characters.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    ret = []
+    for word in _WORD_PATTERN.findall(text):
+        if word.isascii() or len(word) == 1:
+            ret.append(word)
+        else:
+            ret += [word[i : i + 2] for i in range(len(word) - 1)]
+    return ret
+
+
+def _to_text(*values: Any) -> str:
+    texts = []
+    for value in values:
+        if isinstance(value, list):
+            texts += [str(x) for x in value if x]
+        elif value:
+            texts.append(_TAG_PATTERN.sub(" ", str(value)))
+    return " ".join(_tokenize(" ".join(texts)))
+
+
+def _to_match_expression(keywords: str) -> Optional[str]:
+    phrases = []
+    for keyword in keywords.split():
+        tokens = _tokenize(keyword)
+        if len(tokens) == 1 and not tokens[0].isascii() and len(tokens[0]) == 1:
+            # a single letter only matches the beginning of bigrams
+            phrases.append(f'"{tokens[0]}"*')
+        elif tokens:
+            phrases.append('"' + " ".join(tokens) + '"')
+    return " AND ".join(phrases) if phrases else None
+
+
+@dataclass
+class SearchHit:
+    object_id: str
+    service_id: str
+    station_id: str
+    program_id: str
+    program_title: str
+    episode_title: str
+    pub_date: Optional[str]
+    score: float
+
+
+class SearchIndex:
+    """Full-text index of recorded programs on SQLite FTS5.
+
+    Titles, performers and guests, descriptions and information of recorded
+    programs are indexed, and hits are ranked by bm25 weighting titles most.
+    The index is updated incrementally by `add` (e.g. by `Recorder` as
+    programs are recorded) and `sync` against `recorded_programs`. It can be
+    shared by threads.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> SearchIndex:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def _delete(self, object_id: str) -> None:
+        row = self._connection.execute(
+            "SELECT id FROM programs WHERE object_id = ?", (object_id,)
+        ).fetchone()
+        if row:
+            self._connection.execute("DELETE FROM programs_fts WHERE rowid = ?", row)
+            self._connection.execute("DELETE FROM programs WHERE id = ?", row)
+
+    def _add(self, object_id: str, program: Dict[str, Any]) -> None:
+        self._delete(object_id)
+        pub_date = program.get("pub_date")
+        if isinstance(pub_date, datetime.datetime):
+            pub_date = pub_date.isoformat()
+        cursor = self._connection.execute(
+            "INSERT INTO programs (object_id, service_id, station_id, program_id, "
+            "program_title, episode_title, pub_date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                object_id,
+                program.get("service_id"),
+                program.get("station_id"),
+                program.get("program_id"),
+                program.get("program_title"),
+                program.get("episode_title"),
+                pub_date,
+            ),
+        )
+        self._connection.execute(
+            "INSERT INTO programs_fts (rowid, title, people, text) VALUES (?, ?, ?, ?)",
+            (
+                cursor.lastrowid,
+                _to_text(program.get("program_title"), program.get("episode_title")),
+                _to_text(program.get("performers"), program.get("guests")),
+                _to_text(program.get("description"), program.get("information")),
+            ),
+        )
+
+    def add(self, object_id: Union[str, ObjectId], program: Dict[str, Any]) -> None:
+        """Adds or replaces a recorded program (a document or `Program.to_dict()`)."""
+        with self._lock, self._connection:
+            self._add(str(object_id), program)
+
+    def remove(self, object_ids: Iterable[Union[str, ObjectId]]) -> None:
+        with self._lock, self._connection:
+            for object_id in object_ids:
+                self._delete(str(object_id))
+
+    def sync(
+        self,
+        collection: Any,
+        full: bool = False,
+        lookback: datetime.timedelta = datetime.timedelta(hours=1),
+    ) -> int:
+        """Indexes recorded programs inserted since the last sync.
+
+        Programs are found by the high-water mark of their ObjectIds. As
+        ObjectIds are generated by clients, programs generated up to `lookback`
+        before the mark are indexed again. If `full`, all programs are indexed
+        and programs removed from the collection are removed from the index.
+
+        Args:
+            collection (`pymongo.collection.Collection`): `recorded_programs`.
+
+        Returns:
+            int: Number of indexed programs.
+        """
+        query: Dict[str, Any] = {}
+        high_water_mark = None if full else self._get_meta("high_water_mark")
+        if high_water_mark:
+            generation_time = ObjectId(high_water_mark).generation_time - lookback
+            query = {"_id": {"$gt": ObjectId.from_datetime(generation_time)}}
+
+        num_programs = 0
+        object_ids = set()
+        with self._lock, self._connection:
+            for program in collection.find(query).sort("_id", 1):
+                object_id = str(program["_id"])
+                self._add(object_id, program)
+                object_ids.add(object_id)
+                high_water_mark = max(high_water_mark or object_id, object_id)
+                num_programs += 1
+            if full:
+                indexed_ids = self._connection.execute("SELECT object_id FROM programs")
+                for (object_id,) in indexed_ids.fetchall():
+                    if object_id not in object_ids:
+                        self._delete(object_id)
+            if high_water_mark:
+                self._set_meta("high_water_mark", high_water_mark)
+        return num_programs
+
+    def search(
+        self,
+        keywords: str,
+        limit: int = 20,
+        service_ids: Optional[List[str]] = None,
+    ) -> List[SearchHit]:
+        """Searches recorded programs having all keywords (separated by spaces).
+
+        Returns:
+            list of `SearchHit`: Hits from the most relevant one.
+        """
+        match = _to_match_expression(keywords)
+        if match is None:
+            return []
+        sql = (
+            "SELECT p.object_id, p.service_id, p.station_id, p.program_id, "
+            "p.program_title, p.episode_title, p.pub_date, "
+            "bm25(programs_fts, ?, ?, ?) AS score "
+            "FROM programs_fts JOIN programs AS p ON p.id = programs_fts.rowid "
+            "WHERE programs_fts MATCH ?"
+        )
+        params: List[Any] = [*_COLUMN_WEIGHTS, match]
+        if service_ids:
+            sql += f" AND p.service_id IN ({', '.join('?' * len(service_ids))})"
+            params += service_ids
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [SearchHit(*row) for row in rows]
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from pathlib import Path
+
+__all__ = ["write_atomic"]
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Writes a file readable by everyone, replacing it atomically so that
+    readers (e.g. the HTTP server) never see a partially written file."""
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as fh:
+        fh.write(data)
+    os.chmod(fh.name, 0o644)
+    os.replace(fh.name, path)
@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Replaces MongoDB with an in-memory mongomock server, so that handlers
+    can be created as they are. Returns the mongomock client."""
+    mongomock = pytest.importorskip("mongomock")
+    database = pytest.importorskip("jadio_recorder.database")
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database.pymongo, "MongoClient", lambda host: client)
+    return client
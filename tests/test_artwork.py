@@ -0,0 +1,139 @@
+import http.server
+import io
+import threading
+
+import pytest
+
+pytest.importorskip("PIL")
+artwork = pytest.importorskip("jadio_recorder.artwork")
+
+from PIL import Image  # noqa: E402
+
+
+def image_bytes(width, height, color="red", format="PNG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, format)
+    return buffer.getvalue()
+
+
+class ImageHandler(http.server.BaseHTTPRequestHandler):
+    """Serves `server.image` with `server.etag`, or `server.status` if set."""
+
+    def do_GET(self):
+        self.server.requests.append(self.headers)
+        if self.server.status:
+            self.send_error(self.server.status)
+            return
+        if self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Last-Modified", "Sun, 01 Jan 2023 00:00:00 GMT")
+        self.send_header("Content-Length", str(len(self.server.image)))
+        self.end_headers()
+        self.wfile.write(self.server.image)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    server.requests = []
+    server.status = None
+    server.etag = '"v1"'
+    server.image = image_bytes(300, 200)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    server.image_url = f"http://{host}:{port}/image.png"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def create_cache(tmp_path, **kwargs):
+    return artwork.ArtworkCache(tmp_path, "http://localhost/", **kwargs)
+
+
+def cached_image(tmp_path, image_url):
+    key = artwork._key(image_url)
+    return Image.open(tmp_path / artwork.ARTWORK_DIRNAME / f"{key}.jpg")
+
+
+def test_artwork_is_cropped_and_resized(tmp_path, server):
+    cache = create_cache(tmp_path, size=100)
+    url = cache(server.image_url)
+    key = artwork._key(server.image_url)
+    assert url == f"http://localhost/rss/artwork/{key}.jpg"
+    image = cached_image(tmp_path, server.image_url)
+    assert image.format == "JPEG"
+    assert image.size == (100, 100)
+
+    # small images are only cropped
+    server.image = image_bytes(80, 60)
+    create_cache(tmp_path / "small", size=100)(server.image_url)
+    assert cached_image(tmp_path / "small", server.image_url).size == (60, 60)
+
+
+@pytest.mark.parametrize("image_url", [None, ""])
+def test_no_artwork(tmp_path, image_url):
+    assert create_cache(tmp_path)(image_url) == image_url
+
+
+def test_artwork_is_downloaded_once_within_ttl(tmp_path, server):
+    cache = create_cache(tmp_path, ttl_seconds=0)
+    url = cache(server.image_url)
+    assert cache(server.image_url) == url
+    assert len(server.requests) == 1
+    # by another process
+    assert create_cache(tmp_path)(server.image_url) == url
+    assert len(server.requests) == 1
+
+
+def test_unchanged_artwork_is_revalidated(tmp_path, server):
+    url = create_cache(tmp_path, ttl_seconds=0)(server.image_url)
+    key = artwork._key(server.image_url)
+    image_path = tmp_path / artwork.ARTWORK_DIRNAME / f"{key}.jpg"
+    mtime_ns = image_path.stat().st_mtime_ns
+
+    assert create_cache(tmp_path, ttl_seconds=0)(server.image_url) == url
+    assert len(server.requests) == 2
+    assert server.requests[1]["If-None-Match"] == '"v1"'
+    assert server.requests[1]["If-Modified-Since"] == "Sun, 01 Jan 2023 00:00:00 GMT"
+    assert image_path.stat().st_mtime_ns == mtime_ns
+
+
+def test_changed_artwork_is_downloaded_again(tmp_path, server):
+    create_cache(tmp_path, ttl_seconds=0)(server.image_url)
+    server.etag = '"v2"'
+    server.image = image_bytes(300, 200, color="blue")
+    create_cache(tmp_path, ttl_seconds=0)(server.image_url)
+    red, green, blue = cached_image(tmp_path, server.image_url).getpixel((50, 50))
+    assert blue > 200 and red < 50
+    # the new ETag is revalidated next time
+    create_cache(tmp_path, ttl_seconds=0)(server.image_url)
+    assert server.requests[-1]["If-None-Match"] == '"v2"'
+
+
+def test_stale_artwork_is_used_if_not_downloaded(tmp_path, server):
+    url = create_cache(tmp_path, ttl_seconds=0)(server.image_url)
+    server.status = 503
+    assert create_cache(tmp_path, ttl_seconds=0)(server.image_url) == url
+    # revalidated again after the failure
+    server.status = None
+    create_cache(tmp_path, ttl_seconds=0)(server.image_url)
+    assert len(server.requests) == 3
+
+
+@pytest.mark.parametrize("failure", ["status", "image"])
+def test_original_url_is_used_if_not_cached(tmp_path, server, failure):
+    if failure == "status":
+        server.status = 404
+    else:
+        server.image = b"not an image"
+    cache = create_cache(tmp_path)
+    assert cache(server.image_url) == server.image_url
+    assert not list((tmp_path / artwork.ARTWORK_DIRNAME).iterdir())
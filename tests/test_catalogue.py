@@ -0,0 +1,125 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("numpy")
+catalogue = pytest.importorskip("jadio_recorder.catalogue")
+mongomock = pytest.importorskip("mongomock")
+
+from jadio_recorder.program_query import ProgramQuery  # noqa: E402
+
+FETCHED_AT = datetime.datetime(2023, 1, 8)
+
+
+def fetched_program(i):
+    return {
+        "service_id": ["radiko.jp", "onsen.ag"][i % 2],
+        "station_id": ["TBS", "QRR", "LFR"][i % 3],
+        "program_id": f"program-{i % 4}",
+        "episode_id": f"episode-{i}",
+        "program_title": f"Program {i % 4}",
+        "episode_title": f"Episode {i} news" if i % 5 == 0 else f"Episode {i}",
+        "description": "weather" if i % 7 == 0 else None,
+        "information": None,
+        "performers": ["Alice", "Bob"] if i % 3 == 0 else ["Carol"],
+        "guests": ["Dave"] if i == 4 else [],
+        "pub_date": datetime.datetime(2023, 1, 1) + datetime.timedelta(hours=5 * i),
+        "duration": None if i == 6 else 600 * (i % 6),
+        "is_video": i % 4 == 0,
+        "fetch": {"updated_at": FETCHED_AT + datetime.timedelta(minutes=i)},
+    }
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().jadio.fetched_programs
+    collection.insert_many([fetched_program(i) for i in range(40)])
+    return collection
+
+
+QUERIES = [
+    ProgramQuery(),
+    ProgramQuery(service_id="radiko.jp"),
+    ProgramQuery(station_id=["TBS", "LFR"], program_id="program-2"),
+    ProgramQuery(episode_id=["episode-3", "episode-30", "missing"]),
+    ProgramQuery(pub_date=datetime.datetime(2023, 1, 3)),
+    ProgramQuery(pub_date=[datetime.datetime(2023, 1, 3), None]),
+    ProgramQuery(pub_date=[None, datetime.datetime(2023, 1, 3)]),
+    ProgramQuery(
+        pub_date=[datetime.datetime(2023, 1, 2), datetime.datetime(2023, 1, 5)]
+    ),
+    ProgramQuery(duration=1200),
+    ProgramQuery(duration=[1200, None]),
+    ProgramQuery(duration=[None, 1800]),
+    ProgramQuery(duration=[600, 2400]),
+    ProgramQuery(is_video=True),
+    ProgramQuery(is_video=False, station_id="QRR"),
+    ProgramQuery(keywords="news"),
+    ProgramQuery(keywords=["Alice", "Dave", "weath"]),
+    ProgramQuery(keywords="Episode 1", service_id="onsen.ag", duration=[600, None]),
+]
+
+
+@pytest.mark.parametrize("query", QUERIES, ids=[str(q.to_dict()) for q in QUERIES])
+def test_catalogue_matches_mongo_query(collection, query):
+    programs = catalogue.ProgramCatalogue.from_documents(
+        collection.find({}, catalogue.CATALOGUE_PROJECTION), FETCHED_AT
+    )
+    expected = {
+        document["_id"] for document in collection.find(query.to_mongo_format())
+    }
+    assert set(programs.find([query])) == expected
+    # the programs are chosen so that every query matches some of them
+    assert expected
+
+
+def test_catalogue_matches_updated_programs(collection):
+    programs = catalogue.ProgramCatalogue.from_documents(
+        collection.find({}, catalogue.CATALOGUE_PROJECTION), FETCHED_AT
+    )
+    updated_after = FETCHED_AT + datetime.timedelta(minutes=30)
+    query = ProgramQuery(service_id="radiko.jp")
+    expected = {
+        document["_id"]
+        for document in collection.find(
+            {
+                "$and": [
+                    query.to_mongo_format(),
+                    {"fetch.updated_at": {"$gt": updated_after}},
+                ]
+            }
+        )
+    }
+    assert set(programs.find([query], updated_after=updated_after)) == expected
+
+
+def test_load_saved_catalogue(collection, tmp_path):
+    path = tmp_path / "catalogue.npz"
+    programs = catalogue.ProgramCatalogue.from_documents(
+        collection.find({}, catalogue.CATALOGUE_PROJECTION), FETCHED_AT
+    )
+    programs.save(path)
+    loaded = catalogue.ProgramCatalogue.load(path, FETCHED_AT)
+    query = ProgramQuery(keywords="news", is_video=False)
+    assert loaded.find([query]) == programs.find([query])
+    later = FETCHED_AT + datetime.timedelta(days=1)
+    assert catalogue.ProgramCatalogue.load(path, later) is None
+
+
+@pytest.mark.parametrize("damage", ["missing", "truncated", "garbage", "column"])
+def test_load_rejects_unusable_catalogue(collection, tmp_path, damage):
+    path = tmp_path / "catalogue.npz"
+    programs = catalogue.ProgramCatalogue.from_documents(
+        collection.find({}, catalogue.CATALOGUE_PROJECTION), FETCHED_AT
+    )
+    if damage != "missing":
+        programs.save(path)
+    if damage == "truncated":
+        path.write_bytes(path.read_bytes()[: path.stat().st_size // 2])
+    elif damage == "garbage":
+        path.write_bytes(b"PK\x03\x04" + b"\0" * 100)
+    elif damage == "column":
+        columns = dict(programs._columns)
+        columns.pop("duration")
+        catalogue.ProgramCatalogue(columns, FETCHED_AT).save(path)
+    assert catalogue.ProgramCatalogue.load(path, FETCHED_AT) is None
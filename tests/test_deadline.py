@@ -0,0 +1,135 @@
+import datetime
+
+import pytest
+
+deadline = pytest.importorskip("jadio_recorder.deadline")
+
+NOW = datetime.datetime(2023, 1, 8)
+
+
+def program(_id, deadline_hours, service_id="radiko.jp", duration=3600):
+    return {
+        "_id": _id,
+        "service_id": service_id,
+        "duration": duration,
+        "deadline": (
+            deadline_hours
+            if deadline_hours in [None, deadline.FAR_FUTURE]
+            else NOW + datetime.timedelta(hours=deadline_hours)
+        ),
+    }
+
+
+# an hour of program takes half an hour to download
+STATS = {
+    "radiko.jp": {
+        "downloads": 4,
+        "download_seconds": 7200.0,
+        "downloaded_duration": 14400,
+    },
+}
+
+
+def test_programs_are_at_risk_when_queue_exceeds_deadline():
+    programs = [program(i, 1.2) for i in range(4)]
+    assert deadline.estimate_at_risk(programs, STATS, NOW) == [2, 3]
+    assert deadline.estimate_at_risk(programs, STATS, NOW, concurrency=2) == []
+
+
+def test_earlier_programs_delay_later_programs():
+    programs = [program("a", 10, duration=36000), program("b", 5)]
+    assert deadline.estimate_at_risk(programs, STATS, NOW) == ["b"]
+
+
+def test_download_time_without_duration_is_average_of_downloads():
+    programs = [program(i, 1, duration=None) for i in range(3)]
+    # 30 minutes per download
+    assert deadline.estimate_at_risk(programs, STATS, NOW) == [2]
+    stats = {"radiko.jp": {**STATS["radiko.jp"], "downloaded_duration": 0}}
+    programs = [program(i, 1) for i in range(3)]
+    assert deadline.estimate_at_risk(programs, stats, NOW) == [2]
+
+
+@pytest.mark.parametrize("stats", [{}, {"radiko.jp": None}, {"radiko.jp": {}}])
+def test_programs_of_services_without_stats_take_no_time(stats):
+    programs = [program(i, 0.01) for i in range(100)]
+    assert deadline.estimate_at_risk(programs, stats, NOW) == []
+
+
+def test_programs_without_known_deadline_are_not_at_risk():
+    programs = [
+        program("long", 1, duration=360000),
+        program("unknown", None),
+        program("far", deadline.FAR_FUTURE),
+        program("passed", -1),
+    ]
+    assert deadline.estimate_at_risk(programs, STATS, NOW) == ["long", "passed"]
+
+
+def test_split_availability_config():
+    service_config = {
+        "radiko.jp": {"mail": "mail", "availability_days": None},
+        "onsen.ag": {"availability_days": "14"},
+        "hibiki-radio.jp": None,
+    }
+    config, availability_days = deadline.split_availability_config(service_config)
+    assert config == {
+        "radiko.jp": {"mail": "mail"},
+        "onsen.ag": {},
+        "hibiki-radio.jp": None,
+    }
+    assert availability_days == {"onsen.ag": 14.0}
+    assert "availability_days" in service_config["radiko.jp"]
+
+    _, availability_days = deadline.split_availability_config({})
+    assert availability_days == deadline.DEFAULT_AVAILABILITY_DAYS
+
+
+def test_deadline_expression():
+    expression = deadline.deadline_expression({"radiko.jp": 7.0, "onsen.ag": 0.5})
+    assert expression == {
+        "$switch": {
+            "branches": [
+                {
+                    "case": {"$eq": ["$service_id", "onsen.ag"]},
+                    "then": {"$add": ["$pub_date", 43200000]},
+                },
+                {
+                    "case": {"$eq": ["$service_id", "radiko.jp"]},
+                    "then": {"$add": ["$pub_date", 604800000]},
+                },
+            ],
+            "default": deadline.FAR_FUTURE,
+        }
+    }
+    assert deadline.deadline_expression({}) == deadline.FAR_FUTURE
+
+
+def test_reserved_programs_are_claimed_by_deadline(mongo):
+    recording = pytest.importorskip("jadio_recorder.handlers.recording")
+    collection = mongo.jadio.reserved_programs
+    queue = recording.QUEUE_KEY
+    # deadlines are set by `deadline_update`, whose date arithmetic mongomock
+    # does not support
+    collection.insert_many(
+        [
+            {"episode_id": "unknown", queue: {"deadline": deadline.FAR_FUTURE}},
+            {"episode_id": "week", queue: {"deadline": NOW}, "pub_date": 2},
+            {"episode_id": "tie", queue: {"deadline": NOW}, "pub_date": 1},
+            {"episode_id": "later", queue: {"deadline": NOW.replace(hour=12)}},
+            {
+                "episode_id": "failed",
+                queue: {"deadline": NOW, "state": recording.FAILED_STATE},
+            },
+        ]
+    )
+    programs = collection.find().sort(recording.DEADLINE_SORT)
+    assert [p["episode_id"] for p in programs] == [
+        "failed",
+        "tie",
+        "week",
+        "later",
+        "unknown",
+    ]
+    expired = collection.find(recording.expired_query(NOW.replace(hour=1)))
+    assert {p["episode_id"] for p in expired} == {"tie", "week"}
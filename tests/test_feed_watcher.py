@@ -0,0 +1,144 @@
+import datetime
+
+import pytest
+
+feed_watcher = pytest.importorskip("jadio_recorder.handlers.feed_watcher")
+
+from bson import ObjectId  # noqa: E402
+
+from jadio_recorder.program_group import ProgramGroup  # noqa: E402
+from jadio_recorder.program_query import ProgramQuery  # noqa: E402
+
+
+def create_watcher(tmp_path, **kwargs):
+    return feed_watcher.FeedWatcher(
+        rss_root=tmp_path / "rss",
+        media_root=tmp_path / "media",
+        poll_interval=0,
+        **kwargs,
+    )
+
+
+def insert_program_group(watcher, program_id):
+    program_group = ProgramGroup(
+        query=ProgramQuery(program_id=program_id), enable_feed=True
+    )
+    return watcher.db.program_groups.insert_one(program_group.to_dict()).inserted_id
+
+
+def object_id(seconds_ago):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return ObjectId.from_datetime(now - datetime.timedelta(seconds=seconds_ago))
+
+
+def next_changes(changes):
+    ret = []
+    for change in changes:
+        if change is None:
+            return ret
+        ret.append(change)
+
+
+def test_polling_finds_inserted_programs(mongo, tmp_path):
+    watcher = create_watcher(tmp_path)
+    watcher.db.recorded_programs.insert_one({"_id": object_id(10)})
+    changes = watcher._watch_polling()
+    assert next_changes(changes) == []
+
+    new_id = watcher.db.recorded_programs.insert_one({}).inserted_id
+    assert next_changes(changes) == [("recorded_programs", [new_id], False)]
+
+    # inserted by a client whose ObjectId is older than the newest one
+    old_id = watcher.db.recorded_programs.insert_one({"_id": object_id(60)}).inserted_id
+    assert next_changes(changes) == [("recorded_programs", [old_id], False)]
+    assert next_changes(changes) == []
+
+
+def test_polling_finds_deleted_programs(mongo, tmp_path):
+    watcher = create_watcher(tmp_path)
+    ids = watcher.db.recorded_programs.insert_many([{}, {}]).inserted_ids
+    changes = watcher._watch_polling()
+    assert next_changes(changes) == []
+
+    watcher.db.recorded_programs.delete_one({"_id": ids[0]})
+    assert next_changes(changes) == [("recorded_programs", [], True)]
+    assert next_changes(changes) == []
+
+
+def test_polling_finds_changed_program_groups(mongo, tmp_path):
+    watcher = create_watcher(tmp_path)
+    updated_id = insert_program_group(watcher, "updated")
+    deleted_id = insert_program_group(watcher, "deleted")
+    changes = watcher._watch_polling()
+    assert next_changes(changes) == []
+
+    watcher.db.program_groups.update_one(
+        {"_id": updated_id}, {"$set": {"title": "title"}}
+    )
+    watcher.db.program_groups.delete_one({"_id": deleted_id})
+    inserted_id = insert_program_group(watcher, "inserted")
+    [(collection, ids, deleted)] = next_changes(changes)
+    assert collection == "program_groups"
+    assert set(ids) == {updated_id, deleted_id, inserted_id}
+    assert not deleted
+
+
+def test_polling_refreshes_all_feeds_periodically(mongo, tmp_path):
+    watcher = create_watcher(tmp_path, full_refresh_seconds=0)
+    changes = watcher._watch_polling()
+    assert next_changes(changes) == [("recorded_programs", [], True)]
+
+
+class StubChangeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def try_next(self):
+        if not self.changes:
+            self.alive = False
+            return None
+        return self.changes.pop(0)
+
+
+def test_watch_updates_feeds_affected_by_change_stream(mongo, tmp_path, monkeypatch):
+    watcher = create_watcher(tmp_path, debounce_seconds=0)
+    affected_id = insert_program_group(watcher, "affected")
+    insert_program_group(watcher, "other")
+    program_id = watcher.db.recorded_programs.insert_one(
+        {"program_id": "affected"}
+    ).inserted_id
+    change = {
+        "ns": {"coll": "recorded_programs"},
+        "documentKey": {"_id": program_id},
+        "operationType": "insert",
+    }
+    monkeypatch.setattr(
+        watcher.db, "watch", lambda *args, **kwargs: StubChangeStream([change])
+    )
+    updated = []
+    monkeypatch.setattr(
+        watcher,
+        "_feed_rss",
+        lambda program_group, object_id: updated.append(object_id),
+    )
+    watcher.watch(timeout=0)
+    assert updated == [affected_id]
+
+
+def test_watch_falls_back_to_polling(mongo, tmp_path, monkeypatch):
+    watcher = create_watcher(tmp_path)
+
+    def watch(*args, **kwargs):
+        raise feed_watcher.pymongo.errors.OperationFailure("not a replica set")
+
+    monkeypatch.setattr(watcher.db, "watch", watch)
+    watcher.db.recorded_programs.insert_one({})
+    changes = watcher._watch()
+    assert next(changes) is None
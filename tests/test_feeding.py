@@ -0,0 +1,157 @@
+import datetime
+import gzip
+
+import pytest
+
+feeding = pytest.importorskip("jadio_recorder.handlers.feeding")
+mongomock = pytest.importorskip("mongomock")
+
+from jadio_recorder.program_group import ProgramGroup  # noqa: E402
+from jadio_recorder.program_query import ProgramQuery  # noqa: E402
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().jadio.recorded_programs
+
+
+def program(day, **kwargs):
+    document = {
+        "service_id": "radiko.jp",
+        "program_id": "program",
+        "pub_date": datetime.datetime(2023, 1, day),
+    }
+    document.update(kwargs)
+    return document
+
+
+def select(collection, **kwargs):
+    pipeline = feeding.feed_pipeline({"program_id": "program"}, "pub_date", **kwargs)
+    return [document["pub_date"].day for document in collection.aggregate(pipeline)]
+
+
+def test_feed_pipeline_removes_duplicates(collection):
+    collection.insert_many(
+        [
+            program(1, episode_id="a"),
+            program(2, episode_id="a"),
+            program(3, episode_id="b"),
+            program(3, episode_id="c"),
+            program(4, episode_id="d", program_id="other"),
+        ]
+    )
+    assert select(collection) == [3, 2]
+    assert select(collection, remove_duplicates=False) == [3, 3, 2, 1]
+    assert select(collection, from_oldest=True) == [1, 3]
+
+
+def test_feed_pipeline_keeps_programs_without_episode_ids(collection):
+    collection.insert_many(
+        [program(1, episode_id=None), program(2, episode_id=None), program(3)]
+    )
+    assert select(collection) == [3, 2, 1]
+
+
+def test_feed_pipeline_keeps_programs_without_pub_dates(collection):
+    collection.insert_many(
+        [program(1, episode_id="a"), program(1, episode_id="b", pub_date=None)]
+    )
+    pipeline = feeding.feed_pipeline({}, "episode_id")
+    documents = collection.aggregate(pipeline)
+    assert [document["episode_id"] for document in documents] == ["b", "a"]
+
+
+def test_feed_pipeline_limits_items(collection):
+    collection.insert_many([program(day, episode_id=str(day)) for day in range(1, 6)])
+    assert select(collection, limit=2) == [5, 4]
+
+
+def recorded_document(media_root, i):
+    document = {
+        "_id": f"{i:024x}",
+        "service_id": "radiko.jp",
+        "station_id": "TBS",
+        "program_id": "program",
+        "episode_id": f"episode-{i}",
+        "episode_title": f"Episode {i}",
+        "pub_date": datetime.datetime(2023, 1, i + 1),
+        "duration": 3600,
+        "is_video": False,
+    }
+    media_dir = media_root / "radiko.jp" / "program" / document["_id"]
+    media_dir.mkdir(parents=True, exist_ok=True)
+    (media_dir / "media.m4a").write_bytes(b"\0" * 1024)
+    return document
+
+
+def write_feed(tmp_path, num_documents=3, **kwargs):
+    media_root = tmp_path / "media"
+    documents = [recorded_document(media_root, i) for i in range(num_documents)]
+    return feeding.write_rss_feed(
+        documents,
+        ProgramGroup(query=ProgramQuery(program_id="program"), title="title"),
+        tmp_path / "rss" / "group.xml",
+        "http://localhost/",
+        media_root,
+        **kwargs,
+    )
+
+
+def read_feeds(tmp_path):
+    return {path.name: path.read_bytes() for path in (tmp_path / "rss").iterdir()}
+
+
+def test_write_rss_feed_with_precompressed_files(tmp_path):
+    brotli = pytest.importorskip("brotli")
+    sizes = write_feed(tmp_path, precompress=True)
+    feeds = read_feeds(tmp_path)
+    assert set(feeds) == {"group.xml", "group.xml.gz", "group.xml.br"}
+    assert sizes == {
+        ".xml": len(feeds["group.xml"]),
+        ".gz": len(feeds["group.xml.gz"]),
+        ".br": len(feeds["group.xml.br"]),
+    }
+    xml = feeds["group.xml"]
+    # compact even if pretty
+    assert xml.count(b"\n") <= 1
+    assert xml.count(b"<item>") == 3
+    assert gzip.decompress(feeds["group.xml.gz"]) == xml
+    assert brotli.decompress(feeds["group.xml.br"]) == xml
+    assert sizes[".gz"] < sizes[".xml"] and sizes[".br"] < sizes[".xml"]
+
+
+def test_unchanged_feed_is_compressed_to_same_bytes(tmp_path, monkeypatch):
+    # lastBuildDate is the time of writing
+    monkeypatch.setattr(
+        feeding.PodcastRssFeedGenCreator,
+        "iter_rss_from_documents",
+        lambda self, program_group, documents, pretty: [b"<rss>", b"</rss>"],
+    )
+    write_feed(tmp_path, precompress=True)
+    first = read_feeds(tmp_path)
+    write_feed(tmp_path, precompress=True)
+    assert read_feeds(tmp_path) == first
+
+
+def test_write_rss_feed_without_brotli(tmp_path, monkeypatch):
+    monkeypatch.setattr(feeding, "brotli", None)
+    (tmp_path / "rss").mkdir()
+    (tmp_path / "rss" / "group.xml.br").write_bytes(b"stale")
+    sizes = write_feed(tmp_path, precompress=True)
+    assert set(sizes) == {".xml", ".gz"}
+    assert set(read_feeds(tmp_path)) == {"group.xml", "group.xml.gz"}
+
+
+def test_stale_compressed_files_are_removed(tmp_path):
+    write_feed(tmp_path, precompress=True)
+    sizes = write_feed(tmp_path, num_documents=4)
+    feeds = read_feeds(tmp_path)
+    assert set(feeds) == {"group.xml"}
+    assert sizes == {".xml": len(feeds["group.xml"])}
+    assert feeds["group.xml"].count(b"<item>") == 4
+    assert b"\n  <channel>" in feeds["group.xml"]
+
+
+def test_no_feed_without_documents(tmp_path):
+    assert write_feed(tmp_path, num_documents=0, precompress=True) == {}
+    assert not (tmp_path / "rss").exists()
@@ -0,0 +1,167 @@
+import http.server
+import sys
+import threading
+
+import pytest
+
+hls = pytest.importorskip("jadio_recorder.hls")
+
+
+class PlaylistServer(http.server.ThreadingHTTPServer):
+    """Serves `files` by path. Paths in `failures` respond 500 as many times as
+    their counts before succeeding."""
+
+    def __init__(self, files, failures=None):
+        super().__init__(("127.0.0.1", 0), PlaylistHandler)
+        self.files = files
+        self.failures = dict(failures or {})
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+
+class PlaylistHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            failure = server.failures.get(self.path, 0)
+            if failure:
+                server.failures[self.path] = failure - 1
+        if failure:
+            self.send_error(500)
+            return
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+        data = server.files[self.path]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def media_playlist(num_segments, ended=True):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:5"]
+    for i in range(num_segments):
+        lines += ["#EXTINF:5.0,", f"segment{i}.ts"]
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines).encode()
+
+
+def segment(i):
+    # segments of different sizes so that they complete out of order
+    return f"<segment {i}>".encode() * (1000 if i % 2 == 0 else 1)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(files, failures=None):
+        server = PlaylistServer(files, failures)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def segment_files(num_segments, ended=True):
+    files = {"/media.m3u8": media_playlist(num_segments, ended=ended)}
+    files.update({f"/segment{i}.ts": segment(i) for i in range(num_segments)})
+    return files
+
+
+def test_download_writes_segments_in_order(serve, tmp_path):
+    server = serve(segment_files(20))
+    output_path = tmp_path / "media.ts"
+    downloader = hls.HlsDownloader(num_workers=4)
+    num_bytes = downloader.download(f"{server.url}/media.m3u8", output_path)
+    expected = b"".join(segment(i) for i in range(20))
+    assert output_path.read_bytes() == expected
+    assert num_bytes == len(expected)
+
+
+def test_download_resolves_master_playlist(serve, tmp_path):
+    files = segment_files(3)
+    files["/master.m3u8"] = (
+        b"#EXTM3U\n"
+        b"#EXT-X-STREAM-INF:BANDWIDTH=64000\nlow.m3u8\n"
+        b"#EXT-X-STREAM-INF:BANDWIDTH=128000\nmedia.m3u8\n"
+    )
+    server = serve(files)
+    output_path = tmp_path / "media.ts"
+    hls.HlsDownloader(num_workers=2).download(f"{server.url}/master.m3u8", output_path)
+    assert output_path.read_bytes() == b"".join(segment(i) for i in range(3))
+    assert "/low.m3u8" not in server.requests
+
+
+def test_download_retries_failing_segment(serve, tmp_path):
+    server = serve(segment_files(5), failures={"/segment2.ts": 2})
+    output_path = tmp_path / "media.ts"
+    downloader = hls.HlsDownloader(num_workers=2, max_retries=3, retry_backoff=0.01)
+    downloader.download(f"{server.url}/media.m3u8", output_path)
+    assert output_path.read_bytes() == b"".join(segment(i) for i in range(5))
+    assert server.requests.count("/segment2.ts") == 3
+
+
+def test_download_fails_after_max_retries(serve, tmp_path):
+    server = serve(segment_files(5), failures={"/segment2.ts": 10})
+    downloader = hls.HlsDownloader(num_workers=2, max_retries=2, retry_backoff=0.01)
+    with pytest.raises(hls.HlsError, match="segment2.ts"):
+        downloader.download(f"{server.url}/media.m3u8", tmp_path / "media.ts")
+    assert server.requests.count("/segment2.ts") == 3
+
+
+def test_download_rejects_incomplete_playlist(serve, tmp_path):
+    server = serve(segment_files(5, ended=False))
+    downloader = hls.HlsDownloader(num_workers=2)
+    with pytest.raises(hls.HlsError, match="EXT-X-ENDLIST"):
+        downloader.download(f"{server.url}/media.m3u8", tmp_path / "media.ts")
+    assert not any(path.startswith("/segment") for path in server.requests)
+
+
+def fake_ffmpeg(tmp_path, exit_code):
+    """Script copying stdin to the output file like `ffmpeg -c copy`, writing
+    more to stderr than a pipe buffer can hold."""
+    path = tmp_path / "ffmpeg"
+    path.write_text(
+        f"#!{sys.executable}\n"
+        "import shutil, sys\n"
+        "sys.stderr.write('warning\\n' * 100000)\n"
+        "sys.stderr.flush()\n"
+        "with open(sys.argv[-1], 'wb') as fh:\n"
+        "    shutil.copyfileobj(sys.stdin.buffer, fh)\n"
+        f"sys.exit({exit_code})\n"
+    )
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires a shebang script")
+def test_download_remuxes_with_chatty_ffmpeg(serve, tmp_path):
+    server = serve(segment_files(20))
+    output_path = tmp_path / "media.m4a"
+    downloader = hls.HlsDownloader(num_workers=4, ffmpeg=fake_ffmpeg(tmp_path, 0))
+    downloader.download(f"{server.url}/media.m3u8", output_path)
+    assert output_path.read_bytes() == b"".join(segment(i) for i in range(20))
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires a shebang script")
+def test_download_reports_ffmpeg_error(serve, tmp_path):
+    server = serve(segment_files(3))
+    downloader = hls.HlsDownloader(num_workers=2, ffmpeg=fake_ffmpeg(tmp_path, 1))
+    with pytest.raises(hls.HlsError, match="ffmpeg failed \\(1\\): warning"):
+        downloader.download(f"{server.url}/media.m3u8", tmp_path / "media.m4a")
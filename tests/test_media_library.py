@@ -0,0 +1,183 @@
+import datetime
+import json
+import os
+
+import pytest
+
+media_library = pytest.importorskip("jadio_recorder.handlers.media_library")
+
+from bson import ObjectId  # noqa: E402
+
+
+class StubProgram:
+    """`jadio.Program` which only round-trips its JSON."""
+
+    def __init__(self, data):
+        self._data = data
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(json.loads(text))
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def old_id(days=1):
+    """Returns a unique ObjectId generated `days` ago."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    timestamp = ObjectId.from_datetime(now - datetime.timedelta(days=days))
+    return ObjectId(timestamp.binary[:4] + ObjectId().binary[4:])
+
+
+def add_media(root, service_id, program_id, object_id, media=True, size=10):
+    path = root / service_id / program_id / str(object_id)
+    path.mkdir(parents=True)
+    if media:
+        (path / "media.m4a").write_bytes(b"x" * size)
+    program = {"service_id": service_id, "program_id": program_id}
+    (path / "program.json").write_text(json.dumps(program))
+    return path
+
+
+def touch(path, seconds):
+    """Moves the mtime of `path` forward, since directory mtimes of quick
+    successive changes may be equal."""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + int(seconds * 1e9)))
+
+
+def insert(library, object_id, service_id="radiko.jp", program_id="p1"):
+    library.db.recorded_programs.insert_one(
+        {"_id": object_id, "service_id": service_id, "program_id": program_id}
+    )
+
+
+@pytest.fixture
+def library(mongo, tmp_path):
+    return media_library.MediaLibrary(media_root=tmp_path / "media")
+
+
+def test_scan_finds_orphans_missing_and_recent(library, tmp_path):
+    root = tmp_path / "media"
+    recorded, orphan, missing, recent = old_id(), old_id(), old_id(), ObjectId()
+    add_media(root, "radiko.jp", "p1", recorded, size=100)
+    add_media(root, "radiko.jp", "p2", orphan, size=20)
+    for object_id in [recorded, missing, recent]:
+        insert(library, object_id)
+
+    ret = library.scan()
+    assert ret.num_programs == 2
+    assert ret.total_bytes > 120
+    assert ret.orphans == [root / "radiko.jp" / "p2" / str(orphan)]
+    assert ret.missing == [missing]
+    assert ret.recent == [recent]
+    assert ret.restored == ret.removed == []
+    assert library.db.recorded_programs.count_documents({}) == 3
+
+
+def test_directory_without_media_file_is_missing(library, tmp_path):
+    object_id = old_id()
+    add_media(tmp_path / "media", "radiko.jp", "p1", object_id, media=False)
+    insert(library, object_id)
+    ret = library.scan()
+    assert ret.missing == [object_id]
+    assert ret.orphans == []
+
+
+def test_repair_restores_orphans_and_removes_missing(library, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_library, "Program", StubProgram)
+    root = tmp_path / "media"
+    orphan, no_media, missing, recent = old_id(), old_id(), old_id(), ObjectId()
+    add_media(root, "radiko.jp", "p1", orphan)
+    add_media(root, "radiko.jp", "p1", no_media, media=False)
+    add_media(root, "radiko.jp", "p1", "not-an-object-id")
+    for object_id in [missing, recent]:
+        insert(library, object_id)
+
+    ret = library.scan(repair=True)
+    assert len(ret.orphans) == 3
+    assert ret.restored == [orphan]
+    assert ret.removed == [missing]
+    assert {p["_id"] for p in library.db.recorded_programs.find()} == {
+        orphan,
+        recent,
+    }
+    restored = library.db.recorded_programs.find_one({"_id": orphan})
+    assert restored["program_id"] == "p1"
+    assert restored[media_library.VOLUME_KEY] == media_library.DEFAULT_VOLUME
+    assert sorted(library.scan().orphans) == sorted(
+        [
+            root / "radiko.jp" / "p1" / str(no_media),
+            root / "radiko.jp" / "p1" / "not-an-object-id",
+        ]
+    )
+
+
+def test_rescan_only_lists_changed_directories(library, tmp_path):
+    root = tmp_path / "media"
+    first, second = old_id(), old_id()
+    add_media(root, "radiko.jp", "p1", first)
+    insert(library, first)
+    insert(library, second)
+
+    ret = library.scan()
+    assert ret.num_stats == 1 + 1 + 2
+    assert ret.missing == [second]
+    assert (root / media_library.MANIFEST_NAME).exists()
+
+    ret = library.scan()
+    assert ret.num_stats == 1 + 1
+    assert ret.missing == [second]
+
+    # a recorded program moved into the program directory
+    add_media(root, "radiko.jp", "p1", second)
+    touch(root / "radiko.jp" / "p1", 1)
+    ret = library.scan()
+    assert ret.num_stats == 1 + 2 + 2
+    assert ret.missing == []
+    assert ret.num_programs == 2
+
+    # a file replaced in a media directory
+    media_path = root / "radiko.jp" / "p1" / str(first) / "media.m4a"
+    media_path.unlink()
+    touch(media_path.parent, 2)
+    ret = library.scan()
+    assert ret.missing == [first]
+
+    # a change which the manifest cannot see is found by a full scan
+    mtime_ns = media_path.parent.stat().st_mtime_ns
+    media_path.write_bytes(b"x")
+    os.utime(media_path.parent, ns=(mtime_ns, mtime_ns))
+    assert library.scan().missing == [first]
+    assert library.scan(full=True).missing == []
+
+
+@pytest.mark.parametrize(
+    "manifest", ["{", json.dumps({"version": 0, "dirs": {"radiko.jp/p1": {}}})]
+)
+def test_unusable_manifest_is_rebuilt(library, tmp_path, manifest):
+    root = tmp_path / "media"
+    object_id = old_id()
+    add_media(root, "radiko.jp", "p1", object_id)
+    insert(library, object_id)
+    (root / media_library.MANIFEST_NAME).write_text(manifest)
+    ret = library.scan()
+    assert ret.missing == ret.orphans == []
+    manifest = json.loads((root / media_library.MANIFEST_NAME).read_text())
+    assert manifest["version"] == media_library.MANIFEST_VERSION
+
+
+def test_media_on_any_volume_is_found(mongo, tmp_path):
+    library = media_library.MediaLibrary(
+        media_root=tmp_path / "media",
+        media_volumes={"extra": tmp_path / "extra", "absent": tmp_path / "absent"},
+    )
+    (tmp_path / "media").mkdir()
+    object_id = old_id()
+    add_media(tmp_path / "extra", "radiko.jp", "p1", object_id)
+    insert(library, object_id)
+    ret = library.scan()
+    assert ret.num_programs == 1
+    assert ret.missing == ret.orphans == []
+    assert (tmp_path / "extra" / media_library.MANIFEST_NAME).exists()
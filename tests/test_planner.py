@@ -0,0 +1,119 @@
+import pytest
+
+planner = pytest.importorskip("jadio_recorder.handlers.planner")
+
+from jadio_recorder.program_group import ProgramGroup  # noqa: E402
+from jadio_recorder.program_query import ProgramQuery  # noqa: E402
+from jadio_recorder.rate_limit import RateLimit  # noqa: E402
+
+
+def program(episode_id, service_id="radiko.jp", duration=3600, title="news"):
+    return {
+        "service_id": service_id,
+        "station_id": "TBS",
+        "program_id": "program",
+        "episode_id": episode_id,
+        "program_title": "Program",
+        "episode_title": title,
+        "duration": duration,
+    }
+
+
+NEWS = ProgramGroup(query=ProgramQuery(keywords="news"))
+
+
+@pytest.fixture
+def db(mongo):
+    db = mongo.jadio
+    db.fetched_programs.insert_many(
+        [
+            program("recorded"),
+            program("reserved"),
+            program("new"),
+            program("no-duration", duration=None),
+            program("music", title="music"),
+            program("onsen", service_id="onsen.ag", duration=1800),
+        ]
+    )
+    db.recorded_programs.insert_many(
+        [program("recorded"), program("old", service_id="hibiki-radio.jp")]
+    )
+    db.reserved_programs.insert_one(program("reserved"))
+    return db
+
+
+def test_plan_counts_programs_by_service(db):
+    plan = planner.Planner().plan(NEWS)
+    assert plan.program_group == NEWS
+    assert [
+        (p.service_id, p.num_matched, p.num_recorded, p.num_reserved, p.num_new)
+        for p in plan.services
+    ] == [
+        ("hibiki-radio.jp", 0, 1, 0, 0),
+        ("onsen.ag", 1, 0, 0, 1),
+        ("radiko.jp", 4, 1, 1, 2),
+    ]
+    assert [p.duration for p in plan.services] == [0, 1800, 3600]
+    # nothing is known to estimate
+    assert all(p.estimated_seconds is None for p in plan.services)
+    assert db.reserved_programs.count_documents({}) == 1
+
+
+def test_estimate_by_download_stats_and_rate_limits(db):
+    db.service_stats.insert_many(
+        [
+            {
+                "service_id": "radiko.jp",
+                "downloaded_bytes": 1000,
+                "downloaded_duration": 100,
+                "download_seconds": 10,
+            },
+            {
+                "service_id": "onsen.ag",
+                "downloaded_bytes": 1000,
+                "downloaded_duration": 10,
+                "download_seconds": 1,
+            },
+        ]
+    )
+    rate_limits = {
+        "radiko.jp": RateLimit(max_concurrent_downloads=2),
+        "onsen.ag": RateLimit(bytes_per_second=100, requests_per_minute=1e-3),
+    }
+    plans = {p.service_id: p for p in planner.Planner(rate_limits).plan(NEWS).services}
+
+    radiko = plans["radiko.jp"]
+    assert radiko.bitrate == 10
+    assert radiko.estimated_bytes == 36000
+    assert radiko.throughput == 200
+    assert radiko.estimated_seconds == 180
+
+    onsen = plans["onsen.ag"]
+    assert onsen.bitrate == 100
+    assert onsen.throughput == 100
+    # a request per 1000 minutes is longer than the download itself
+    assert onsen.estimated_seconds == pytest.approx(60000)
+
+
+def test_throughput_of_rate_limit_without_stats(db):
+    rate_limits = {"radiko.jp": RateLimit(bytes_per_second=50)}
+    plans = {p.service_id: p for p in planner.Planner(rate_limits).plan(NEWS).services}
+    assert plans["radiko.jp"].throughput == 50
+    # the size is unknown without the bitrate
+    assert plans["radiko.jp"].estimated_seconds is None
+
+
+def test_bitrate_sampled_from_recorded_media(db, tmp_path):
+    recorded = db.recorded_programs.find_one({"episode_id": "recorded"})
+    media_dir = tmp_path / "radiko.jp" / "program" / str(recorded["_id"])
+    media_dir.mkdir(parents=True)
+    (media_dir / "media.m4a").write_bytes(b"x" * 7200)
+    db.recorded_programs.insert_one(program("missing-media"))
+
+    plans = {
+        p.service_id: p
+        for p in planner.Planner(media_root=tmp_path).plan(NEWS).services
+    }
+    assert plans["radiko.jp"].bitrate == 2
+    assert plans["radiko.jp"].estimated_bytes == 7200
+    assert plans["onsen.ag"].bitrate is None
@@ -0,0 +1,87 @@
+import datetime
+import re
+
+import pytest
+
+podcast = pytest.importorskip("jadio_recorder.podcast")
+
+import feedgen.feed  # noqa: E402
+
+from jadio_recorder.program_group import ProgramGroup  # noqa: E402
+from jadio_recorder.program_query import ProgramQuery  # noqa: E402
+
+BASE_URL = "http://localhost/"
+
+
+def recorded_document(media_root, **kwargs):
+    document = {
+        "_id": "0123456789abcdef01234567",
+        "service_id": "radiko.jp",
+        "station_id": "TBS",
+        "program_id": "program",
+        "episode_id": "episode<1>",
+        "episode_title": "Episode & 1",
+        "pub_date": datetime.datetime(2023, 1, 1, 1),
+        "description": "Description <b>bold</b>",
+        "duration": 3600,
+        "link_url": "https://example.com/?a=1&b=2",
+        "image_url": "https://example.com/image.jpg",
+        "is_video": False,
+    }
+    document.update(kwargs)
+    media_dir = media_root / "radiko.jp" / "program" / document["_id"]
+    media_dir.mkdir(parents=True, exist_ok=True)
+    (media_dir / "media.m4a").write_bytes(b"\0" * 1024)
+    return document
+
+
+def feedgen_item(document, media_root):
+    feed_generator = feedgen.feed.FeedGenerator()
+    feed_generator.load_extension("podcast")
+    feed_generator.title("title")
+    feed_generator.link(href=BASE_URL)
+    feed_generator.description("description")
+    item = podcast.PodcastItem.from_document(document, BASE_URL, media_root)
+    item.set_feed_entry(feed_generator.add_entry())
+    rss = feed_generator.rss_str(pretty=False).decode("utf-8")
+    return re.search(r"<item>.*</item>", rss).group(0)
+
+
+def record_item(document, media_root):
+    item = podcast.PodcastItemRecord.from_document(document, BASE_URL, media_root)
+    return item.to_rss()
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"episode_title": None, "link_url": None, "image_url": None},
+        {"description": None, "duration": 0.5},
+    ],
+)
+def test_record_item_equals_feedgen_item(tmp_path, kwargs):
+    document = recorded_document(tmp_path, **kwargs)
+    assert record_item(document, tmp_path) == feedgen_item(document, tmp_path)
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+def test_streamed_feed_equals_feedgen_feed(tmp_path, pretty):
+    documents = [
+        recorded_document(tmp_path, _id=f"{i:024x}", episode_id=f"episode-{i}")
+        for i in range(3)
+    ]
+    program_group = ProgramGroup(query=ProgramQuery(program_id="program"), title="t")
+    creator = podcast.PodcastRssFeedGenCreator(BASE_URL, tmp_path)
+
+    feed_generator = creator._create_channel(program_group).to_feed_generator()
+    for document in documents:
+        item = podcast.PodcastItem.from_document(document, BASE_URL, tmp_path)
+        creator._set_feed_entry(item, feed_generator)
+    expected = feed_generator.rss_str(pretty=pretty)
+    streamed = b"".join(
+        creator.iter_rss_from_documents(program_group, documents, pretty=pretty)
+    )
+    # lastBuildDate is the time of writing
+    pattern = re.compile(rb"<lastBuildDate>[^<]*</lastBuildDate>")
+    assert pattern.sub(b"", streamed) == pattern.sub(b"", expected)
@@ -0,0 +1,102 @@
+import datetime
+import http.server
+import threading
+import urllib.parse
+from types import SimpleNamespace
+
+import pytest
+
+radiko = pytest.importorskip("jadio_recorder.radiko")
+
+STREAM_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urls>
+  <url areafree="1" timefree="1"><playlist_create_url>https://areafree/playlist.m3u8</playlist_create_url></url>
+  <url areafree="0" timefree="0"><playlist_create_url>https://live/playlist.m3u8</playlist_create_url></url>
+  <url areafree="0" timefree="1"><playlist_create_url>https://timefree/playlist.m3u8</playlist_create_url></url>
+</urls>
+"""
+
+
+class RadikoHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers))
+        if self.path == "/v2/api/auth1":
+            self.send_response(200)
+            self.send_header("X-Radiko-AuthToken", "token")
+            self.send_header("X-Radiko-KeyOffset", "8")
+            self.send_header("X-Radiko-KeyLength", "16")
+            body = b""
+        elif self.path == "/v2/api/auth2":
+            self.send_response(200)
+            body = b"JP13,tokyo Japan\r\n"
+        elif self.path == "/v3/station/stream/pc_html5/TBS.xml":
+            self.send_response(200)
+            body = STREAM_XML
+        else:
+            self.send_error(404)
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RadikoHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def program(**kwargs):
+    values = dict(
+        service_id="radiko.jp",
+        station_id="TBS",
+        pub_date=datetime.datetime(2023, 1, 1, 23, 30),
+        duration=3600,
+    )
+    values.update(kwargs)
+    return SimpleNamespace(**values)
+
+
+def test_resolve_time_free_playlist(server):
+    host, port = server.server_address
+    resolver = radiko.RadikoPlaylistResolver(f"http://{host}:{port}")
+    url, headers = resolver.resolve(program())
+
+    assert url.startswith("https://timefree/playlist.m3u8?")
+    params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    assert params["station_id"] == ["TBS"]
+    assert params["ft"] == ["20230101233000"]
+    assert params["to"] == ["20230102003000"]
+    assert headers == {"X-Radiko-AuthToken": "token", "X-Radiko-AreaId": "JP13"}
+    auth2_headers = dict(server.requests)["/v2/api/auth2"]
+    partial_key = radiko.base64.b64encode(radiko.AUTH_KEY[8:24].encode()).decode()
+    assert auth2_headers["X-Radiko-PartialKey"] == partial_key
+
+
+def test_resolve_converts_pub_date_to_jst(server):
+    host, port = server.server_address
+    resolver = radiko.RadikoPlaylistResolver(f"http://{host}:{port}")
+    pub_date = datetime.datetime(2023, 1, 1, 14, 30, tzinfo=datetime.timezone.utc)
+    url, _ = resolver.resolve(program(pub_date=pub_date))
+    assert "ft=20230101233000" in url
+
+
+def test_resolve_ignores_other_services(server):
+    host, port = server.server_address
+    resolver = radiko.RadikoPlaylistResolver(f"http://{host}:{port}")
+    assert resolver.resolve(program(service_id="onsen.ag")) is None
+    assert server.requests == []
+
+
+def test_resolve_fails_for_unknown_station(server):
+    host, port = server.server_address
+    resolver = radiko.RadikoPlaylistResolver(f"http://{host}:{port}")
+    with pytest.raises(radiko.HlsError, match="radiko playlist"):
+        resolver.resolve(program(station_id="UNKNOWN"))
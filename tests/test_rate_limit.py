@@ -0,0 +1,164 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+rate_limit = pytest.importorskip("jadio_recorder.rate_limit")
+
+
+class FakeClock:
+    """`time.monotonic` and `time.sleep` of `rate_limit`, where sleeping
+    advances the clock at once."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limit.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_token_bucket_allows_burst_then_paces(clock):
+    bucket = rate_limit.TokenBucket(rate=2.0, capacity=3.0)
+    assert [bucket.consume() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.consume() == pytest.approx(0.5)
+    assert bucket.consume() == pytest.approx(0.5)
+    assert clock.now == pytest.approx(1001.0)
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = rate_limit.TokenBucket(rate=1.0, capacity=2.0)
+    bucket.consume(2.0)
+    clock.now += 100.0
+    assert bucket.consume(2.0) == 0.0
+    assert bucket.consume() == pytest.approx(1.0)
+
+
+def test_token_bucket_allows_request_larger_than_capacity(clock):
+    bucket = rate_limit.TokenBucket(rate=10.0, capacity=1.0)
+    assert bucket.consume(21.0) == pytest.approx(2.0)
+    # the deficit has been refilled while waiting
+    assert bucket.consume() == pytest.approx(0.1)
+
+
+@pytest.mark.parametrize("rate", [0.0, -1.0])
+def test_token_bucket_rejects_non_positive_rate(rate):
+    with pytest.raises(ValueError):
+        rate_limit.TokenBucket(rate)
+
+
+def test_requests_are_paced_by_requests_per_minute(clock):
+    limiter = rate_limit.ServiceRateLimiter(
+        rate_limit.RateLimit(requests_per_minute=30)
+    )
+    for _ in range(3):
+        limiter.request()
+    assert clock.sleeps == [pytest.approx(2.0), pytest.approx(2.0)]
+    assert limiter.waited_seconds == pytest.approx(4.0)
+
+
+def test_unlimited_service_does_not_wait(clock):
+    limiter = rate_limit.ServiceRateLimiter()
+    for _ in range(10):
+        with limiter.download():
+            pass
+        limiter.record_download(10**9, 0.1)
+    assert clock.sleeps == []
+    assert limiter.throughput == pytest.approx(10**10)
+
+
+def test_fast_download_delays_next_download(clock):
+    limiter = rate_limit.ServiceRateLimiter(
+        rate_limit.RateLimit(bytes_per_second=1000.0)
+    )
+    # 10 s at the limit, downloaded in 4 s
+    limiter.record_download(10000, 4.0)
+    assert clock.sleeps == [pytest.approx(6.0)]
+    # slower than the limit
+    limiter.record_download(1000, 5.0)
+    assert clock.sleeps == [pytest.approx(6.0)]
+    assert limiter.num_downloads == 2
+    assert limiter.throughput == pytest.approx(11000 / 9.0)
+
+
+def test_concurrent_downloads_are_limited():
+    limiter = rate_limit.ServiceRateLimiter(
+        rate_limit.RateLimit(max_concurrent_downloads=2)
+    )
+    lock = threading.Lock()
+    active, max_active = 0, 0
+
+    def download():
+        nonlocal active, max_active
+        with limiter.download():
+            with lock:
+                active += 1
+                max_active = max(max_active, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+
+    threads = [threading.Thread(target=download) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max_active == 2
+
+
+def test_split_service_config():
+    service_config = {
+        "radiko.jp": {"mail": "mail", "rate_limit": {"bytes_per_second": 100}},
+        "onsen.ag": {"mail": "mail"},
+        "hibiki-radio.jp": None,
+    }
+    config, rate_limits = rate_limit.split_service_config(service_config)
+    assert config == {
+        "radiko.jp": {"mail": "mail"},
+        "onsen.ag": {"mail": "mail"},
+        "hibiki-radio.jp": None,
+    }
+    assert rate_limits == {"radiko.jp": rate_limit.RateLimit(bytes_per_second=100)}
+    assert "rate_limit" in service_config["radiko.jp"]
+
+
+def test_claim_query_skips_saturated_services(mongo):
+    recording = pytest.importorskip("jadio_recorder.handlers.recording")
+    collection = mongo.jadio.reserved_programs
+    now = datetime.datetime(2023, 1, 1)
+    limiters = {
+        "radiko.jp": rate_limit.ServiceRateLimiter(
+            rate_limit.RateLimit(max_concurrent_downloads=1)
+        ),
+        "onsen.ag": rate_limit.ServiceRateLimiter(),
+    }
+    assert recording.concurrency_limits(limiters) == {"radiko.jp": 1}
+    collection.insert_many(
+        [
+            {"service_id": "radiko.jp", "episode_id": "leased"},
+            {"service_id": "radiko.jp", "episode_id": "waiting"},
+            {"service_id": "onsen.ag", "episode_id": "other"},
+        ]
+    )
+    collection.update_one(
+        {"episode_id": "leased"}, recording.lease_update("worker", now, 600)
+    )
+    assert collection.count_documents(recording.active_lease_query("radiko.jp", now))
+
+    query = recording.claim_query({}, now, ["radiko.jp"])
+    assert [p["episode_id"] for p in collection.find(query)] == ["other"]
+    query = recording.claim_query({}, now, [])
+    assert {p["episode_id"] for p in collection.find(query)} == {"waiting", "other"}
@@ -0,0 +1,92 @@
+import datetime
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+recorder = pytest.importorskip("jadio_recorder.handlers.recorder")
+
+from jadio_recorder.handlers.recording import QUEUE_KEY  # noqa: E402
+
+
+class StubCollection:
+    """`reserved_programs` holding one program, supporting `update_one` by
+    `_id` and lease owner as done by `_LeaseHeartbeat`."""
+
+    def __init__(self, document):
+        self.document = document
+        self.num_updates = 0
+        self.updated = threading.Event()
+
+    def update_one(self, filter, update):
+        queue = self.document[QUEUE_KEY]
+        matched = (
+            filter["_id"] == self.document["_id"]
+            and filter[f"{QUEUE_KEY}.owner"] == queue["owner"]
+        )
+        if matched:
+            for key, value in update["$set"].items():
+                queue[key[len(f"{QUEUE_KEY}.") :]] = value
+        self.num_updates += 1
+        self.updated.set()
+        return SimpleNamespace(matched_count=int(matched))
+
+
+def reserved_program(owner):
+    claimed_at = datetime.datetime.now() - datetime.timedelta(minutes=1)
+    return {
+        "_id": "target",
+        QUEUE_KEY: {
+            "owner": owner,
+            "claimed_at": claimed_at,
+            "heartbeat_at": claimed_at,
+            "expires_at": claimed_at,
+        },
+    }
+
+
+def test_lease_heartbeat_extends_lease():
+    collection = StubCollection(reserved_program("worker"))
+    expires_at = collection.document[QUEUE_KEY]["expires_at"]
+    with recorder._LeaseHeartbeat(collection, "target", "worker", 0.3) as heartbeat:
+        assert collection.updated.wait(5)
+    assert collection.num_updates >= 1
+    assert not heartbeat.lost
+    queue = collection.document[QUEUE_KEY]
+    assert queue["owner"] == "worker"
+    assert queue["expires_at"] > expires_at
+    assert queue["expires_at"] > queue["heartbeat_at"]
+
+
+def test_lease_heartbeat_detects_lost_lease():
+    collection = StubCollection(reserved_program("another-worker"))
+    with recorder._LeaseHeartbeat(collection, "target", "worker", 0.3) as heartbeat:
+        heartbeat.join(5)
+    assert heartbeat.lost
+    assert collection.num_updates == 1
+    assert collection.document[QUEUE_KEY]["owner"] == "another-worker"
+
+
+class IndexedCollection:
+    """Collection whose unique index cannot be created if `duplicated`."""
+
+    def __init__(self, name, duplicated=False):
+        self.name = name
+        self.duplicated = duplicated
+        self.indexes = []
+
+    def create_index(self, keys, unique=False):
+        if unique and self.duplicated:
+            raise recorder.pymongo.errors.DuplicateKeyError("E11000 duplicate key")
+        self.indexes.append((keys, unique))
+
+
+def test_create_program_indexes_skips_collection_of_duplicate_programs(caplog):
+    db = SimpleNamespace(
+        reserved_programs=IndexedCollection("reserved_programs"),
+        recorded_programs=IndexedCollection("recorded_programs", duplicated=True),
+    )
+    recorder.Recorder._create_program_indexes(SimpleNamespace(db=db))
+    assert db.reserved_programs.indexes == [(recorder.PROGRAM_KEYS_INDEX, True)]
+    assert db.recorded_programs.indexes == []
+    assert "unique index of recorded_programs" in caplog.text
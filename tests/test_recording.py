@@ -0,0 +1,238 @@
+import datetime
+
+import pytest
+
+recording = pytest.importorskip("jadio_recorder.handlers.recording")
+
+from jadio_recorder.program_group import ProgramGroup  # noqa: E402
+from jadio_recorder.program_query import ProgramQuery  # noqa: E402
+
+
+def test_partition_queries_searches_groups_of_changed_conditions_again():
+    keywords = ProgramQuery(keywords="news")
+    duration = ProgramQuery(keywords="news", duration=[None, 600])
+    is_video = ProgramQuery(is_video=True)
+    program_groups = [ProgramGroup(query=q) for q in [keywords, duration, is_video]]
+    # digests stored by a search before the conditions were versioned
+    last_search = {
+        "high_water_mark": 0,
+        "group_digests": [
+            recording.json_digest(g.query.to_dict(encode_json=True))
+            for g in program_groups
+        ],
+    }
+    new_queries, searched_queries, digests = recording.partition_queries(
+        program_groups, last_search
+    )
+    assert searched_queries == [keywords]
+    assert new_queries == [duration, is_video]
+
+    last_search["group_digests"] = digests
+    new_queries, _, _ = recording.partition_queries(program_groups, last_search)
+    assert new_queries == []
+
+
+class StubService:
+    def __init__(self):
+        self.downloads = []
+
+    def download(self, program, file_path):
+        self.downloads.append(file_path)
+
+
+class StubHlsDownloader:
+    def __init__(self, error=None):
+        self.downloads = []
+        self.error = error
+
+    def download(self, playlist_url, output_path, headers=None):
+        self.downloads.append((playlist_url, output_path, headers))
+        if self.error:
+            raise self.error
+
+
+def test_download_media_downloads_resolved_playlist_by_hls(tmp_path):
+    service, downloader = StubService(), StubHlsDownloader()
+    playlist = ("http://localhost/playlist.m3u8", {"X-Token": "token"})
+    recording.download_media(
+        service, None, tmp_path / "media.m4a", downloader, lambda _: playlist
+    )
+    url, headers = playlist
+    assert downloader.downloads == [(url, tmp_path / "media.m4a", headers)]
+    assert service.downloads == []
+
+
+@pytest.mark.parametrize("hls", ["disabled", "unresolved", "failed"])
+def test_download_media_falls_back_to_service(tmp_path, hls):
+    service = StubService()
+    downloader = StubHlsDownloader(error=recording.HlsError("403"))
+    playlist = ("http://localhost/playlist.m3u8", {})
+    resolve_playlist = {
+        "disabled": None,
+        "unresolved": lambda _: None,
+        "failed": lambda _: playlist,
+    }[hls]
+    recording.download_media(
+        service, None, tmp_path / "media.m4a", downloader, resolve_playlist
+    )
+    assert service.downloads == [str(tmp_path / "media.m4a")]
+    assert len(downloader.downloads) == (hls == "failed")
+
+
+class StubProgram:
+    def __init__(self, episode_id, episode_title="title", duration=600):
+        self._data = {
+            "service_id": "radiko.jp",
+            "station_id": "TBS",
+            "program_id": "program",
+            "episode_id": episode_id,
+            "program_title": "Program",
+            "episode_title": episode_title,
+            "duration": duration,
+        }
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def fetch(collection, programs, now):
+    existing = dict(
+        recording.existing_fetched_program_key(program)
+        for program in collection.find(
+            {}, recording.EXISTING_FETCHED_PROGRAM_PROJECTION
+        )
+    )
+    requests = recording.fetched_programs_requests(programs, existing, now)
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+    return requests
+
+
+def fetched(collection):
+    return {
+        program["episode_id"]: program[recording.FETCH_KEY]
+        for program in collection.find()
+    }
+
+
+def test_fetched_programs_keep_first_seen_and_updated_times(mongo):
+    collection = mongo.jadio.fetched_programs
+    day1, day2 = datetime.datetime(2023, 1, 1), datetime.datetime(2023, 1, 2)
+    fetch(collection, [StubProgram("a"), StubProgram("b"), StubProgram("a")], day1)
+    assert collection.count_documents({}) == 2
+    first = fetched(collection)
+
+    # "a" is unchanged, "b" is updated in place, "c" is new
+    programs = [StubProgram("a"), StubProgram("b", duration=1200), StubProgram("c")]
+    fetch(collection, programs, day2)
+    ret = fetched(collection)
+    assert ret["a"] == first["a"]
+    assert ret["b"]["first_seen_at"] == day1
+    assert ret["b"]["updated_at"] == day2
+    assert ret["b"]["digest"] != first["b"]["digest"]
+    assert ret["c"] == {**ret["c"], "first_seen_at": day2, "updated_at": day2}
+    assert collection.find_one({"episode_id": "b"})["duration"] == 1200
+    assert (
+        recording.high_water_mark(collection.find_one(sort=recording.LAST_FETCHED_SORT))
+        == day2
+    )
+
+    # nothing to write again, and programs no longer provided are removed
+    assert fetch(collection, programs, day2) == []
+    fetch(collection, [StubProgram("c")], day2)
+    assert set(fetched(collection)) == {"c"}
+
+
+def test_program_with_changed_key_is_a_new_program(mongo):
+    collection = mongo.jadio.fetched_programs
+    day1, day2 = datetime.datetime(2023, 1, 1), datetime.datetime(2023, 1, 2)
+    fetch(collection, [StubProgram("a", episode_title="old")], day1)
+    fetch(collection, [StubProgram("a", episode_title="new")], day2)
+    programs = list(collection.find())
+    assert [p["episode_title"] for p in programs] == ["new"]
+    assert programs[0][recording.FETCH_KEY]["first_seen_at"] == day2
+
+
+@pytest.mark.parametrize("last_fetched", [None, {}, {"fetch": {}}])
+def test_high_water_mark_of_no_fetched_programs(last_fetched):
+    assert recording.high_water_mark(last_fetched) is None
+
+
+def find_episode_ids(collection, query):
+    if query is None:
+        return set()
+    return {program["episode_id"] for program in collection.find(query)}
+
+
+def test_search_query_evaluates_only_new_programs_or_new_groups(mongo):
+    collection = mongo.jadio.fetched_programs
+    day1, day2 = datetime.datetime(2023, 1, 1), datetime.datetime(2023, 1, 2)
+    fetch(collection, [StubProgram("a", "news"), StubProgram("b", "music")], day1)
+    news = ProgramGroup(query=ProgramQuery(keywords="news"))
+    music = ProgramGroup(query=ProgramQuery(keywords="music"))
+
+    # first search
+    query, digests = recording.search_query([news], None)
+    assert find_episode_ids(collection, query) == {"a"}
+    last_search = {"high_water_mark": day1, "group_digests": digests}
+
+    # nothing has changed
+    query, _ = recording.search_query([news], last_search)
+    assert find_episode_ids(collection, query) == set()
+    assert not recording.is_modified_groups(digests, last_search)
+
+    # a new program and a new group
+    fetch(
+        collection,
+        [StubProgram("a", "news"), StubProgram("b", "music"), StubProgram("c", "news")],
+        day2,
+    )
+    query, digests = recording.search_query([news, music], last_search)
+    assert find_episode_ids(collection, query) == {"b", "c"}
+    assert recording.is_modified_groups(digests, last_search)
+
+    # all programs by a full search or without the high-water mark
+    last_search = {"high_water_mark": day2, "group_digests": digests}
+    query, _ = recording.search_query([news, music], last_search, full=True)
+    assert find_episode_ids(collection, query) == {"a", "b", "c"}
+    last_search["high_water_mark"] = None
+    query, _ = recording.search_query([news, music], last_search)
+    assert find_episode_ids(collection, query) == {"a", "b", "c"}
+
+    assert recording.search_query([], last_search) == (None, [])
+
+
+def test_removed_group_is_modified():
+    news = ProgramGroup(query=ProgramQuery(keywords="news"))
+    music = ProgramGroup(query=ProgramQuery(keywords="music"))
+    _, digests = recording.search_query([news, music], None)
+    last_search = {"high_water_mark": 0, "group_digests": digests}
+    _, digests = recording.search_query([news], last_search)
+    assert recording.is_modified_groups(digests, last_search)
+    # the order of groups does not matter
+    _, digests = recording.search_query([music, news], last_search)
+    assert not recording.is_modified_groups(digests, last_search)
+
+
+def test_stale_reservations_are_unclaimed_unmatched_programs(mongo):
+    collection = mongo.jadio.reserved_programs
+    now = datetime.datetime(2023, 1, 1)
+    collection.insert_many(
+        [
+            StubProgram("news", "news").to_dict(),
+            StubProgram("music", "music").to_dict(),
+            StubProgram("leased", "music").to_dict(),
+            StubProgram("retried", "music").to_dict(),
+        ]
+    )
+    collection.update_one(
+        {"episode_id": "leased"}, recording.lease_update("worker", now, 600)
+    )
+    collection.update_one(
+        {"episode_id": "retried"}, {"$set": {f"{recording.QUEUE_KEY}.attempts": 1}}
+    )
+    news = ProgramGroup(query=ProgramQuery(keywords="news"))
+    query = recording.stale_reservations_query([news], now)
+    assert find_episode_ids(collection, query) == {"music"}
+    query = recording.stale_reservations_query([], now)
+    assert find_episode_ids(collection, query) == {"news", "music"}
@@ -0,0 +1,142 @@
+import datetime
+
+import pytest
+
+search_index = pytest.importorskip("jadio_recorder.search_index")
+
+from bson import ObjectId  # noqa: E402
+
+
+def program(object_id, **kwargs):
+    document = {
+        "_id": ObjectId(object_id),
+        "service_id": "radiko.jp",
+        "station_id": "TBS",
+        "program_id": "program",
+        "program_title": "Program",
+        "episode_title": None,
+        "performers": [],
+        "guests": [],
+        "description": None,
+        "information": None,
+        "pub_date": datetime.datetime(2023, 1, 1),
+    }
+    document.update(kwargs)
+    return document
+
+
+PROGRAMS = [
+    program("0" * 24, program_title="深夜のラジオ番組", performers=["山田太郎"]),
+    program("1" * 24, episode_title="News", description="<b>今日の天気</b>"),
+    program("2" * 24, service_id="onsen.ag", description="ラジオの話", guests=["鈴木"]),
+    program("3" * 24, program_title="ＡＢＣ　ラジオ　２０２３"),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    with search_index.SearchIndex(tmp_path / "index" / "search.db") as index:
+        for document in PROGRAMS:
+            index.add(document["_id"], document)
+        yield index
+
+
+def search(index, keywords, **kwargs):
+    return [hit.object_id[0] for hit in index.search(keywords, **kwargs)]
+
+
+def search_ids(index, keywords):
+    return sorted(search(index, keywords))
+
+
+@pytest.mark.parametrize(
+    "text, tokens",
+    [
+        ("深夜のラジオ", ["深夜", "夜の", "のラ", "ラジ", "ジオ"]),
+        ("ＡＢＣ ２０２３年", ["abc", "2023", "年"]),
+        ("Hello, World!", ["hello", "world"]),
+        ("ラジオ2023", ["ラジ", "ジオ", "2023"]),
+    ],
+)
+def test_tokenize(text, tokens):
+    assert search_index._tokenize(text) == tokens
+
+
+@pytest.mark.parametrize(
+    "keywords, expected",
+    [
+        ("ラジオ", ["0", "2", "3"]),
+        ("深夜 ラジオ", ["0"]),
+        ("夜のラ", ["0"]),
+        # not contiguous in the text
+        ("深夜ラジオ", []),
+        ("山田", ["0"]),
+        ("天気", ["1"]),
+        ("news", ["1"]),
+        ("NEWS", ["1"]),
+        # full-width letters are normalized
+        ("abc 2023", ["3"]),
+        ("ＡＢＣ", ["3"]),
+        # tags of descriptions are not indexed
+        ("b", []),
+        ("鈴", ["2"]),
+        ("!!", []),
+        ("", []),
+    ],
+)
+def test_search(index, keywords, expected):
+    assert search_ids(index, keywords) == expected
+
+
+def test_titles_rank_first(index):
+    assert search(index, "ラジオ")[-1] == "2"
+    assert search(index, "ラジオ", limit=2) in [["0", "3"], ["3", "0"]]
+    assert search(index, "ラジオ", service_ids=["onsen.ag"]) == ["2"]
+    hit = index.search("天気")[0]
+    assert hit.program_title == "Program"
+    assert hit.pub_date == "2023-01-01T00:00:00"
+
+
+def test_add_replaces_and_remove_deletes(index):
+    document = program("0" * 24, program_title="朝のニュース")
+    index.add(document["_id"], document)
+    assert search(index, "深夜") == []
+    assert search(index, "ニュース") == ["0"]
+    index.remove([document["_id"], "9" * 24])
+    assert search(index, "ニュース") == []
+
+
+def object_id(seconds_ago):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    generation_time = now - datetime.timedelta(seconds=seconds_ago)
+    return ObjectId(ObjectId.from_datetime(generation_time).binary[:4] + b"\1" * 8)
+
+
+def test_sync_indexes_programs_inserted_since_last_sync(tmp_path, mongo):
+    collection = mongo.jadio.recorded_programs
+    collection.insert_many(
+        [
+            program(object_id(600), program_title="first"),
+            program(object_id(10), program_title="second"),
+        ]
+    )
+    index = search_index.SearchIndex(tmp_path / "search.db")
+    assert index.sync(collection) == 2
+    assert index.sync(collection, lookback=datetime.timedelta(seconds=60)) == 1
+
+    # generated before the high-water mark, but within the lookback
+    late = program(object_id(30), program_title="late")
+    collection.insert_one(late)
+    assert index.sync(collection, lookback=datetime.timedelta(seconds=60)) == 2
+    assert [hit.object_id for hit in index.search("late")] == [str(late["_id"])]
+
+    collection.delete_one({"program_title": "first"})
+    assert search(index, "first")
+    assert index.sync(collection, full=True) == 2
+    assert search(index, "first") == []
+    index.close()
+
+    # the high-water mark is kept in the index, and only the programs generated
+    # in its second are indexed again
+    with search_index.SearchIndex(tmp_path / "search.db") as index:
+        assert index.sync(collection, lookback=datetime.timedelta(0)) == 1